@@ -0,0 +1,72 @@
+'''切牌后的鸣牌仲裁
+
+每位有可选操作的玩家在响应前，其能提出的最高优先级为其可选操作中的最高优先级。
+已收到的最佳请求为(i, p)时，尚未响应的玩家j只有在 其最高优先级>p，或两者相等且j<i 时才可能胜出；
+没有这样的玩家时立即裁决，其余玩家的等待随之取消，而不必等所有玩家响应或超时。
+'''
+
+from typing import Optional
+import asyncio
+
+from utils import REQUEST_PRIORITY
+
+
+class ClaimArbiter:
+    '''单次切牌的鸣牌仲裁，优先级相同时序号小者优先，与原先的比较规则一致'''
+
+    def __init__(self, priority:dict[str, int]=REQUEST_PRIORITY):
+        self.priority = priority
+        '''请求类型优先级'''
+        self.options:dict[int, list[dict]] = {}
+        '''各玩家的可选操作'''
+        self.pending:dict[int, int] = {}
+        '''尚未响应的玩家及其能提出的最高优先级'''
+        self.requests:dict[int, dict] = {}
+        '''已收到的请求'''
+        self.winner:Optional[int] = None
+        '''当前最佳请求的玩家序号，没有时为None'''
+        self.best:int = 0
+        '''当前最佳请求的优先级，cancel为0，不会胜出'''
+        self.resolved = asyncio.Event()
+        '''裁决完成时触发'''
+
+    def offer(self, player_index:int, options:list[dict]):
+        '''登记玩家的可选操作，没有可选操作的玩家不参与仲裁'''
+        if not options:
+            return
+        self.options[player_index] = options
+        self.pending[player_index] = max(self.priority.get(option["action"], 0) for option in options)
+
+    def open(self):
+        '''登记完毕，开始仲裁'''
+        self._check()
+
+    def submit(self, player_index:int, request:dict):
+        '''
+        收到玩家的请求
+        请求类型不在其可选操作中时视为cancel，避免无效请求提前结束仲裁
+        '''
+        if player_index not in self.pending:
+            return
+        self.pending.pop(player_index)
+        request_type = (request or {}).get("type", "cancel")
+        if request_type in {option["action"] for option in self.options[player_index]}:
+            self.requests[player_index] = request
+            priority = self.priority.get(request_type, 0)
+            if priority > self.best or (priority == self.best and priority and player_index < self.winner):
+                self.winner, self.best = player_index, priority
+        self._check()
+
+    def can_win(self, player_index:int) -> bool:
+        '''尚未响应的玩家是否仍可能胜出'''
+        top = self.pending.get(player_index)
+        if top is None:
+            return False
+        return top > self.best or (top == self.best and top and player_index < self.winner)
+
+    def _check(self):
+        if not any(self.can_win(index) for index in self.pending):
+            self.resolved.set()
+
+    async def wait(self):
+        await self.resolved.wait()
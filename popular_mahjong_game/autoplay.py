@@ -0,0 +1,67 @@
+'''托管策略模块，为超时或断线的玩家代为决定操作'''
+
+from typing import TYPE_CHECKING
+
+from tile import tile_to_str, action_to_str
+
+if TYPE_CHECKING:
+    from match import Match
+
+
+class AutoPlayPolicy:
+    '''托管策略基类，返回值与客户端发来的请求格式相同'''
+
+    def choose(self, match:"Match", player_index:int, options:list[dict]) -> dict:
+        '''
+        在可选操作中为玩家作出选择
+        :param match: 当前牌局
+        :param player_index: 托管玩家序号
+        :param options: action_check 返回的可选操作，牌为整数编码
+        '''
+        for option in options:
+            if option["action"] == "win":
+                return self._to_request(option)
+        if any(option["action"] == "discard" for option in options):
+            return self.choose_discard(match, player_index)
+        return {"type": "cancel"}
+
+    def choose_discard(self, match:"Match", player_index:int) -> dict:
+        '''选择切牌，默认摸切'''
+        return {
+            "type": "discard",
+            "player_index": player_index,
+            "tile_type": "",
+            "discard_draw": True
+        }
+
+    @staticmethod
+    def _to_request(option:dict) -> dict:
+        request = action_to_str(option)
+        request["type"] = request.pop("action")
+        return request
+
+
+class EfficiencyPolicy(AutoPlayPolicy):
+    '''牌效率托管策略，能和则和，否则切出使向听数最小、有效进张最多的牌'''
+
+    def choose_discard(self, match:"Match", player_index:int) -> dict:
+        player = match.player[player_index]
+        candidates = player.discard_candidates(match.visible_count(player_index), best_only=True)
+        if not candidates:
+            return super().choose_discard(match, player_index)
+        _, best_shanten, best_ukeire = candidates[0]
+        tile = candidates[0][0]
+        # 效率相同时优先摸切
+        if player.draw is not None and any(
+                candidate == (player.draw, best_shanten, best_ukeire) for candidate in candidates):
+            tile = player.draw
+        return {
+            "type": "discard",
+            "player_index": player_index,
+            "tile_type": tile_to_str(tile),
+            "discard_draw": tile == player.draw
+        }
+
+
+DEFAULT_POLICY = EfficiencyPolicy()
+'''牌桌默认托管策略'''
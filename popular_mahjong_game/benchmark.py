@@ -0,0 +1,286 @@
+'''牌局热点路径基准测试
+
+所有手牌语料均由固定种子生成，结果可保存为基线文件，并与之比较以发现性能退化。
+耗时的绝对值只在同一台机器上有意义，因此仓库中不提交基线文件：先在改动前的代码上于本机生成基线，再在改动后比较。
+
+用法：
+    git stash && python benchmark.py --save && git stash pop
+    python benchmark.py --compare --threshold 0.2
+'''
+
+from time import perf_counter
+from typing import Callable, Optional
+from loguru import logger
+import argparse
+import asyncio
+import json
+import platform
+import random
+import sys
+
+import match
+from match import Match, PlayerInMatch, Table
+from engine import HandEvaluator
+from player import Player
+from tile import Tile, TILE_KINDS, to_counts
+from utils import MATCH_PLAYER_COUNT
+from exceptions import MatchEndedException
+
+
+DEFAULT_SEED = 20230401
+'''语料默认随机种子'''
+
+DEFAULT_BASELINE = "benchmark_baseline.json"
+'''默认基线文件'''
+
+
+# 手牌语料
+
+def random_hands(count:int, rand_seed:int) -> list[tuple[list[Tile], Tile]]:
+    '''随机的(13张手牌, 新牌)'''
+    rng = random.Random(rand_seed)
+    deck = [tile for tile in range(TILE_KINDS) for _ in range(4)]
+    res = []
+    for _ in range(count):
+        tiles = rng.sample(deck, 14)
+        res.append((tiles[:13], tiles[13]))
+    return res
+
+def tenpai_hands(count:int, rand_seed:int) -> list[tuple[list[Tile], Tile]]:
+    '''由4面子1雀头拆出一张得到的听牌手牌，新牌即为拆出的牌'''
+    rng = random.Random(rand_seed)
+    res = []
+    while len(res) < count:
+        tiles = []
+        for _ in range(4):
+            suit, num = rng.randrange(3)*9, rng.randrange(9)
+            if rng.random() < 0.5 and num <= 6:
+                tiles += [suit+num, suit+num+1, suit+num+2]
+            else:
+                tiles += [suit+num]*3
+        tiles += [rng.randrange(TILE_KINDS)]*2
+        if max(to_counts(tiles)) > 4:
+            continue
+        rng.shuffle(tiles)
+        res.append((tiles[:13], tiles[13]))
+    return res
+
+def pure_suit_hands(count:int, rand_seed:int) -> list[tuple[list[Tile], Tile]]:
+    '''单一花色的手牌，拆解方式最多，原递归搜索在此类手牌上耗时最长'''
+    rng = random.Random(rand_seed)
+    res = [
+        ([0,0,0,1,2,3,4,5,6,7,8,8,8], tile) for tile in range(9)
+    ] + [
+        ([1,1,1,2,2,2,3,3,3,4,4,4,5], 5),
+        ([0,0,1,1,2,2,3,3,4,4,5,5,6], 6),
+    ]
+    deck = [tile for tile in range(9) for _ in range(4)]
+    while len(res) < count:
+        tiles = rng.sample(deck, 14)
+        res.append((tiles[:13], tiles[13]))
+    return res[:count]
+
+
+# 基准测试项
+
+def _make_players(hands:list[tuple[list[Tile], Tile]]) -> list[tuple[PlayerInMatch, Tile]]:
+    res = []
+    for close, new in hands:
+        player = PlayerInMatch(name="bench", user_id="bench", player_index=1, ws=None)
+        for tile in close:
+            player.add_close(tile)
+        res.append((player, new))
+    return res
+
+def bench_win_check(hands:list[tuple[list[Tile], Tile]], cached:bool) -> Callable[[], int]:
+    '''和牌检查，每次都重新计算听牌，uncached时不经过判定缓存'''
+    players = _make_players(hands)
+    def run() -> int:
+        evaluator = match.hand_evaluator
+        if not cached:
+            match.hand_evaluator = HandEvaluator(0)
+        try:
+            for player, new in players:
+                player._waits = None
+                player._win_check(new, 0)
+        finally:
+            match.hand_evaluator = evaluator
+        return len(hands)
+    return run
+
+def bench_win_evaluate(hands:list[tuple[list[Tile], Tile]]) -> Callable[[], int]:
+    '''和牌番数计算，只统计能和牌的手牌'''
+    players = [(player, new) for player, new in _make_players(hands) if new in player.waits]
+    def run() -> int:
+        evaluator = match.hand_evaluator
+        match.hand_evaluator = HandEvaluator(0)
+        game = Match.__new__(Match)
+        try:
+            for player, new in players:
+                game.player = [player]*MATCH_PLAYER_COUNT
+                try:
+                    game.win(1, new, 0)
+                except MatchEndedException:
+                    pass
+        finally:
+            match.hand_evaluator = evaluator
+        return len(players)
+    return run
+
+def bench_chi_check(hands:list[tuple[list[Tile], Tile]]) -> Callable[[], int]:
+    players = _make_players(hands)
+    def run() -> int:
+        for player, new in players:
+            player._chi_check(new, 0)
+        return len(players)
+    return run
+
+def bench_kan_check(hands:list[tuple[list[Tile], Tile]]) -> Callable[[], int]:
+    players = _make_players(hands)
+    def run() -> int:
+        for player, new in players:
+            player._kan_check(new)
+            player._kan_check(new, 0)
+        return 2*len(players)
+    return run
+
+def _bot_players() -> list[Player]:
+    return [Player(name=f"bot{i}", user_id=f"bot_{i:05}", email="") for i in range(MATCH_PLAYER_COUNT)]
+
+def bench_draw_discard(rand_seed:int, matches:int) -> Callable[[], int]:
+    '''摸切循环，直至牌堆为空'''
+    players = _bot_players()
+    def run() -> int:
+        ops = 0
+        for seed in range(rand_seed, rand_seed+matches):
+            game = Match(players, seed)
+            try:
+                while True:
+                    player_index, _ = game.draw()
+                    game.discard(player_index)
+                    ops += 1
+            except MatchEndedException:
+                pass
+        return ops
+    return run
+
+def _late_game_match(rand_seed:int) -> Match:
+    '''摸切至牌堆余10张的牌局，牌河较长'''
+    game = Match(_bot_players(), rand_seed)
+    while len(game.deck) > 10:
+        player_index, _ = game.draw()
+        game.discard(player_index)
+    return game
+
+def bench_to_dict(rand_seed:int, public:bool) -> Callable[[], int]:
+    game = _late_game_match(rand_seed)
+    def run() -> int:
+        for _ in range(100):
+            for player in game.player:
+                player.to_public_dict() if public else player.to_dict()
+        return 100*len(game.player)
+    return run
+
+def bench_table_run(rand_seed:int, matches:int) -> Callable[[], int]:
+    '''断线玩家全托管时 Table.run 的每回合耗时，回合数以摸牌数计'''
+    async def run_tables() -> int:
+        turns = 0
+        for seed in range(rand_seed, rand_seed+matches):
+            table = Table(table_code="bench", player=_bot_players(), rand_seed=seed, autostart=False)
+            await table.run()
+            turns += 4*TILE_KINDS - 13*MATCH_PLAYER_COUNT - len(table.match.deck)
+        return turns
+    return lambda:asyncio.run(run_tables())
+
+
+def build_suite(rand_seed:int=DEFAULT_SEED) -> dict[str, Callable[[], int]]:
+    '''构造全部测试项，返回值为运行一次并返回操作数的函数'''
+    random_corpus = random_hands(2000, rand_seed)
+    tenpai_corpus = tenpai_hands(500, rand_seed+1)
+    pure_corpus = pure_suit_hands(300, rand_seed+2)
+    return {
+        "win_check.random": bench_win_check(random_corpus, False),
+        "win_check.tenpai": bench_win_check(tenpai_corpus, False),
+        "win_check.pure_suit": bench_win_check(pure_corpus, False),
+        "win_check.pure_suit.cached": bench_win_check(pure_corpus, True),
+        "win_evaluate.tenpai": bench_win_evaluate(tenpai_corpus),
+        "win_evaluate.pure_suit": bench_win_evaluate(pure_corpus),
+        "chi_check.random": bench_chi_check(random_corpus),
+        "kan_check.random": bench_kan_check(random_corpus),
+        "match.draw_discard": bench_draw_discard(rand_seed, 20),
+        "player.to_dict": bench_to_dict(rand_seed, False),
+        "player.to_public_dict": bench_to_dict(rand_seed, True),
+        "table.run_turn": bench_table_run(rand_seed, 5),
+    }
+
+def measure(func:Callable[[], int], repeat:int) -> float:
+    '''运行repeat次，返回最快一次的单次操作耗时（微秒）'''
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        ops = func()
+        cost = (perf_counter()-start)/max(ops, 1)*1e6
+        best = cost if best is None else min(best, cost)
+    return best
+
+def run_suite(rand_seed:int=DEFAULT_SEED, repeat:int=5, only:Optional[str]=None) -> dict:
+    '''运行基准测试，only为测试项名前缀'''
+    results = {}
+    for name, func in build_suite(rand_seed).items():
+        if only and not name.startswith(only):
+            continue
+        results[name] = measure(func, repeat)
+    return {
+        "meta": {
+            "seed": rand_seed,
+            "repeat": repeat,
+            "python": platform.python_version(),
+            "platform": platform.platform()
+        },
+        "results_us": results
+    }
+
+def compare(current:dict, baseline:dict, threshold:float) -> list[str]:
+    '''与基线比较，返回耗时超过 基线*(1+threshold) 的测试项说明'''
+    for key in ("python", "platform"):
+        if baseline["meta"].get(key) != current["meta"][key]:
+            logger.warning(f"基线的{key}为【{baseline['meta'].get(key)}】，与本次运行的【{current['meta'][key]}】不同，比较结果可能不可靠。")
+    regressions = []
+    for name, cost in current["results_us"].items():
+        base = baseline["results_us"].get(name)
+        if base is None:
+            continue
+        if cost > base*(1+threshold):
+            regressions.append(f"{name}: {base:.3f}us -> {cost:.3f}us (+{(cost/base-1)*100:.1f}%)")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="牌局热点路径基准测试")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="语料随机种子")
+    parser.add_argument("--repeat", type=int, default=5, help="每项重复次数，取最快一次")
+    parser.add_argument("--only", default=None, help="只运行名称以此开头的测试项")
+    parser.add_argument("--save", nargs="?", const=DEFAULT_BASELINE, default=None, help="将结果保存为基线文件")
+    parser.add_argument("--compare", nargs="?", const=DEFAULT_BASELINE, default=None, help="与基线文件比较")
+    parser.add_argument("--threshold", type=float, default=0.2, help="判定为退化的相对增幅")
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    current = run_suite(args.seed, args.repeat, args.only)
+    for name, cost in current["results_us"].items():
+        print(f"{name:32}{cost:12.3f} us/op")
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(current, f, ensure_ascii=False, indent=2)
+        print(f"基线已保存到 {args.save}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print("检测到性能退化：")
+            for line in regressions:
+                print("  "+line)
+            sys.exit(1)
+        print("未检测到性能退化。")
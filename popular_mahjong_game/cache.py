@@ -0,0 +1,86 @@
+'''有界缓存模块'''
+
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class LRUCache:
+    '''最近最少使用淘汰的有界缓存，记录命中、未命中与淘汰次数'''
+
+    def __init__(self, maxsize:int=1024):
+        self.maxsize = maxsize
+        '''最大条目数，为0时不缓存'''
+        self.hits = 0
+        '''命中次数'''
+        self.misses = 0
+        '''未命中次数'''
+        self.evictions = 0
+        '''淘汰次数'''
+        self._data:OrderedDict[Hashable, Any] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key:Hashable) -> bool:
+        return key in self._data
+
+    def get(self, key:Hashable, default:Any=None) -> Any:
+        '''取得缓存值，命中时将其移到最近使用位置'''
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key:Hashable, value:Any):
+        '''写入缓存，超出容量时淘汰最久未使用的条目'''
+        if self.maxsize <= 0:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_compute(self, key:Hashable, func:Callable[[], Any]) -> Any:
+        '''取得缓存值，未命中时调用func计算并写入'''
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            value = func()
+            self.put(key, value)
+            return value
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def pop(self, key:Hashable, default:Any=None) -> Any:
+        '''移除并返回指定条目'''
+        return self._data.pop(key, default)
+
+    def resize(self, maxsize:int):
+        '''修改容量，缩小时立即淘汰多余条目'''
+        self.maxsize = maxsize
+        while len(self._data) > max(maxsize, 0):
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        '''清空缓存，不重置统计'''
+        self._data.clear()
+
+    def stats(self) -> dict:
+        '''缓存统计信息'''
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits/total if total else 0.0
+        }
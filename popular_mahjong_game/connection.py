@@ -0,0 +1,244 @@
+'''WebSocket连接管理
+
+每个连接只有一个读取循环，收到的消息按类型分发：ping/pong用于保活，注册了处理函数的类型（如resync）直接处理，
+其余消息放入该连接的收件队列，由等待玩家操作的牌桌读取，牌桌不再直接读取WebSocket。
+
+失联检测主要依靠WebSocket协议层的ping/pong（见 WS_PING_INTERVAL），浏览器会自动回应，不需要客户端代码配合。
+应用层保活由一个共享的时间轮完成：每个连接按下次检查时间登记在时间轮的某一格，定时器每秒只处理当前一格的连接，
+连接数量再多，单次处理的也只是其中一小部分。连接空闲超过 HEARTBEAT_INTERVAL 时：
+    从未回应过pong的客户端（旧客户端）照旧收到 heartbeat 消息，不因静默而断开，只在发送失败时关闭连接；
+    回应过pong的客户端收到ping，PONG_TIMEOUT 内仍未收到任何消息即判定对端失联并关闭连接。
+客户端以pong回应 heartbeat 即视为支持应用层ping，此后改发ping。
+'''
+
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional, TYPE_CHECKING
+from fastapi import WebSocket
+from loguru import logger
+import asyncio
+
+from scheduler import scheduler, TimerHandle
+from wire import Codec
+from metrics import SEND_FAILURES
+from utils import HEARTBEAT_INTERVAL, PONG_TIMEOUT, CONNECTION_INBOX_SIZE
+
+if TYPE_CHECKING:
+    from player import Player
+
+
+WHEEL_TICK = 1
+'''时间轮每格的时长（秒）'''
+
+WHEEL_SLOTS = 64
+'''时间轮格数，登记的最长延迟为 WHEEL_TICK*(WHEEL_SLOTS-1)'''
+
+
+class ConnectionClosed(Exception):
+    '''等待消息时连接已断开'''
+
+
+@dataclass(eq=False)
+class Connection:
+    '''单个玩家的WebSocket连接'''
+    player:"Player"
+    ws:WebSocket=field(repr=False)
+    codec:Codec=field(repr=False)
+    inbox:asyncio.Queue=field(default_factory=lambda:asyncio.Queue(CONNECTION_INBOX_SIZE), repr=False)
+    '''待牌桌读取的消息，None表示连接已断开'''
+    last_seen:float=0
+    '''最近一次收到消息的事件循环时间'''
+    ping_sent:Optional[float]=None
+    '''已发出且尚未收到回应的ping的发送时间'''
+    heartbeat_sent:float=0
+    '''最近一次向旧客户端发送heartbeat的事件循环时间'''
+    answers_ping:bool=False
+    '''客户端是否回应过pong，只对回应过的客户端发送ping并检查超时'''
+    closed:bool=False
+
+    def deliver(self, msg:Optional[dict]):
+        '''放入收件队列，队列已满时丢弃最早的消息'''
+        if self.inbox.full():
+            self.inbox.get_nowait()
+            logger.warning(f"玩家【{self.player.user_id}】收件队列已满，已丢弃最早的消息。")
+        self.inbox.put_nowait(msg)
+
+
+class ConnectionManager:
+    '''连接管理器，管理所有玩家连接的读取、分发与保活'''
+
+    def __init__(self, interval:float=HEARTBEAT_INTERVAL, pong_timeout:float=PONG_TIMEOUT):
+        self.interval = interval
+        '''空闲多久后发送ping（秒）'''
+        self.pong_timeout = pong_timeout
+        '''发送ping后等待回应的时间（秒）'''
+        self.connections:dict[str, Connection] = {}
+        '''用户ID到当前连接的索引'''
+        self.handlers:dict[str, Callable[["Player", dict], Awaitable]] = {}
+        '''由读取循环直接处理的消息类型'''
+        self.connect_handlers:list[Callable[["Player"], Awaitable]] = []
+        '''连接建立后、开始读取前依次调用的处理函数'''
+        self._wheel:list[set[Connection]] = [set() for _ in range(WHEEL_SLOTS)]
+        self._current = 0
+        '''时间轮当前格'''
+        self._timer:Optional[TimerHandle] = None
+
+    def __len__(self) -> int:
+        return len(self.connections)
+
+    def on(self, msg_type:str, handler:Callable[["Player", dict], Awaitable]):
+        '''登记由读取循环直接处理的消息类型'''
+        self.handlers[msg_type] = handler
+
+    def on_connect(self, handler:Callable[["Player"], Awaitable]):
+        '''登记连接建立后调用的处理函数，此时已可向玩家发送消息'''
+        self.connect_handlers.append(handler)
+
+    async def serve(self, player:"Player", ws:WebSocket, codec:Codec):
+        '''接管已接受的WebSocket连接，直至连接断开'''
+        old = self.connections.get(player.user_id)
+        if old is not None:
+            await self._close(old, "玩家重新连接")
+        conn = Connection(player, ws, codec, last_seen=scheduler.time())
+        self.connections[player.user_id] = conn
+        player.ws = ws
+        player.codec = codec
+        self._schedule(conn, self.interval)
+        try:
+            for handler in self.connect_handlers:
+                try:
+                    await handler(player)
+                except Exception as e:
+                    logger.error(f"处理用户【{player.user_id}】的连接建立时出错，错误类型为{e}。")
+            await self._read(conn)
+        except Exception as e:
+            logger.info(f"检测到用户【{player.user_id}】WebSocket连接断开，原因为{e!r}。")
+        finally:
+            self._discard(conn)
+
+    async def _read(self, conn:Connection):
+        while not conn.closed:
+            message = await conn.ws.receive()
+            if message["type"] == "websocket.disconnect":
+                logger.info(f"检测到用户【{conn.player.user_id}】WebSocket连接断开。")
+                return
+            data = message.get("bytes") if conn.codec.binary else message.get("text")
+            if data is None:
+                continue
+            conn.last_seen = scheduler.time()
+            conn.ping_sent = None
+            try:
+                msg = conn.codec.decode(data)
+            except Exception as e:
+                logger.warning(f"无法解析用户【{conn.player.user_id}】发来的消息，已忽略。错误类型为{e}。")
+                continue
+            msg_type = msg.get("type")
+            if msg_type == "pong":
+                conn.answers_ping = True
+                continue
+            if msg_type == "ping":
+                await self._send(conn, {"type":"pong"})
+                continue
+            handler = self.handlers.get(msg_type)
+            if handler is not None:
+                try:
+                    await handler(conn.player, msg)
+                except Exception as e:
+                    logger.error(f"处理用户【{conn.player.user_id}】的【{msg_type}】消息时出错，错误类型为{e}。")
+                continue
+            conn.deliver(msg)
+
+    async def receive(self, user_id:str) -> dict:
+        '''等待玩家当前连接的下一条消息，连接不存在或断开时抛出ConnectionClosed'''
+        conn = self.connections.get(user_id)
+        if conn is None:
+            raise ConnectionClosed(user_id)
+        msg = await conn.inbox.get()
+        if msg is None:
+            raise ConnectionClosed(user_id)
+        return msg
+
+    def clear(self, user_id:str):
+        '''丢弃玩家当前连接收件队列中的消息'''
+        conn = self.connections.get(user_id)
+        if conn is None or conn.closed:
+            return
+        while not conn.inbox.empty():
+            conn.inbox.get_nowait()
+
+    def _discard(self, conn:Connection):
+        '''连接结束后的清理，唤醒正在等待该连接消息的牌桌'''
+        if conn.closed:
+            return
+        conn.closed = True
+        if self.connections.get(conn.player.user_id) is conn:
+            self.connections.pop(conn.player.user_id)
+        if conn.player.ws is conn.ws:
+            conn.player.ws = None
+        conn.deliver(None)
+
+    async def _close(self, conn:Connection, reason:str):
+        try:
+            await conn.ws.close()
+        except Exception as e:
+            logger.debug(f"关闭用户【{conn.player.user_id}】的WebSocket连接时出错，错误类型为{e}。")
+        self._discard(conn)
+        logger.info(f"用户【{conn.player.user_id}】的WebSocket连接已关闭，原因为【{reason}】。")
+
+    async def _send(self, conn:Connection, msg:dict) -> bool:
+        try:
+            await conn.player.send_encoded(conn.codec.encode(msg))
+        except Exception as e:
+            SEND_FAILURES.inc()
+            logger.debug(f"向用户【{conn.player.user_id}】发送保活消息时出错，错误类型为{e}。")
+            return False
+        return True
+
+    async def _heartbeat(self, conn:Connection):
+        '''向旧客户端发送不需要回应的保活消息，发送失败时关闭连接'''
+        if not await self._send(conn, {"type":"heartbeat"}):
+            await self._close(conn, "保活消息发送失败")
+
+    # 时间轮
+
+    def _schedule(self, conn:Connection, delay:float):
+        '''将连接登记到delay秒后的格中'''
+        ticks = min(max(int(delay/WHEEL_TICK+0.999), 1), WHEEL_SLOTS-1)
+        self._wheel[(self._current+ticks) % WHEEL_SLOTS].add(conn)
+        if self._timer is None:
+            self._timer = scheduler.call_later(WHEEL_TICK, self._tick)
+
+    async def _tick(self):
+        self._timer = None
+        self._current = (self._current+1) % WHEEL_SLOTS
+        due, self._wheel[self._current] = self._wheel[self._current], set()
+        now = scheduler.time()
+        tasks = []
+        for conn in due:
+            if conn.closed:
+                continue
+            if conn.ping_sent is not None:
+                if now-conn.ping_sent >= self.pong_timeout:
+                    tasks.append(self._close(conn, "心跳超时"))
+                else:
+                    self._schedule(conn, conn.ping_sent+self.pong_timeout-now)
+            elif conn.answers_ping and now-conn.last_seen >= self.interval:
+                conn.ping_sent = now
+                tasks.append(self._send(conn, {"type":"ping"}))
+                self._schedule(conn, self.pong_timeout)
+            elif not conn.answers_ping and now-max(conn.last_seen, conn.heartbeat_sent) >= self.interval:
+                conn.heartbeat_sent = now
+                tasks.append(self._heartbeat(conn))
+                self._schedule(conn, self.interval)
+            else:
+                self._schedule(conn, max(conn.last_seen, conn.heartbeat_sent)+self.interval-now)
+        if self._timer is None and any(self._wheel):
+            self._timer = scheduler.call_later(WHEEL_TICK, self._tick)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def init_connection_manager():
+    '''初始化连接管理器'''
+    global connection_manager
+    connection_manager = ConnectionManager()
+
+init_connection_manager()
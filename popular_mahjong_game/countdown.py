@@ -0,0 +1,87 @@
+'''进程内倒计时服务
+
+每次等待只向玩家发送一帧带截止时间戳的倒计时，客户端据此自行渲染计时器。
+所有牌桌的倒计时共用一个校准定时器，每隔固定间隔批量补发一次剩余时间，不再为每位玩家创建倒计时任务。
+'''
+
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional
+from math import ceil
+from time import time
+import asyncio
+import itertools
+
+from scheduler import scheduler, TimerHandle
+from utils import COUNTDOWN_RESYNC_INTERVAL
+
+
+@dataclass
+class Countdown:
+    '''单次等待的倒计时'''
+    deadline:float
+    '''截止时间，为Unix时间戳（秒）'''
+    send:Callable[[dict], Awaitable]=field(repr=False)
+    '''向玩家发送消息的函数'''
+    seq:int=0
+    '''登记序号'''
+
+    def frame(self, now:Optional[float]=None) -> dict:
+        '''倒计时消息，count为剩余整秒数，deadline为截止时间的毫秒时间戳'''
+        now = time() if now is None else now
+        return {
+            "type": "countdown",
+            "data": {
+                "count": max(ceil(self.deadline-now), 0),
+                "deadline": int(self.deadline*1000)
+            }
+        }
+
+
+class CountdownService:
+    '''倒计时服务，登记与注销为O(1)，校准帧由共享定时器批量发送'''
+
+    def __init__(self, resync_interval:float=COUNTDOWN_RESYNC_INTERVAL):
+        self.resync_interval = resync_interval
+        '''校准间隔（秒），为0时不发送校准帧'''
+        self._active:dict[int, Countdown] = {}
+        self._counter = itertools.count()
+        self._timer:Optional[TimerHandle] = None
+
+    def __len__(self) -> int:
+        return len(self._active)
+
+    async def start(self, send:Callable[[dict], Awaitable], timeout:float) -> Countdown:
+        '''开始倒计时并立即发送一帧带截止时间的倒计时消息'''
+        countdown = Countdown(time()+timeout, send, next(self._counter))
+        self._active[countdown.seq] = countdown
+        self._schedule_tick()
+        await send(countdown.frame())
+        return countdown
+
+    def stop(self, countdown:Countdown):
+        '''结束倒计时'''
+        self._active.pop(countdown.seq, None)
+        if not self._active and self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+    def _schedule_tick(self):
+        if self._timer is None and self.resync_interval > 0:
+            self._timer = scheduler.call_later(self.resync_interval, self._tick)
+
+    async def _tick(self):
+        '''向所有未到期的倒计时批量发送校准帧'''
+        self._timer = None
+        now = time()
+        tasks = [countdown.send(countdown.frame(now)) for countdown in self._active.values() if countdown.deadline-now >= 1]
+        if self._active:
+            self._schedule_tick()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def init_countdown_service():
+    '''初始化倒计时服务'''
+    global countdown_service
+    countdown_service = CountdownService()
+
+init_countdown_service()
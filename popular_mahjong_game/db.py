@@ -0,0 +1,241 @@
+'''数据库访问模块
+
+所有查询都在专用线程池中执行，不阻塞事件循环；连接来自容量有限的连接池，
+空闲超过 DB_PING_INTERVAL 的连接在取出时先做健康检查并自动重连。
+SQL统一使用 %s 占位符传参，后端为sqlite时自动转换为 ?。
+
+后端可选mysql（pymysql）或sqlite（标准库，用于本地测试）：
+    await db_open()                                  # 默认MySQL配置
+    await db_open("sqlite", database="mahjong.db")
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+from time import monotonic
+from loguru import logger
+import asyncio
+import sqlite3
+
+import pymysql
+
+from utils import ACCOUNT_TABLES_NAME, TABLE_TABLES_NAME, DB_POOL_SIZE, DB_PING_INTERVAL
+
+
+class Database:
+    '''带连接池的异步数据库访问层'''
+
+    def __init__(self, connect:Callable[[], Any], backend:str="mysql", pool_size:int=DB_POOL_SIZE):
+        '''
+        :param connect: 新建一个数据库连接的函数
+        :param backend: mysql或sqlite
+        :param pool_size: 连接池容量，也是执行查询的线程数
+        '''
+        self.backend = backend
+        self.pool_size = pool_size
+        self._connect = connect
+        self._idle:asyncio.Queue = asyncio.Queue()
+        '''空闲连接及其最后使用时间'''
+        self._created = 0
+        self._lock = asyncio.Lock()
+        self._executor = ThreadPoolExecutor(pool_size, thread_name_prefix="db")
+
+    async def _run(self, func:Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def acquire(self):
+        '''取得一个可用连接，池中无空闲连接且已达容量时等待归还'''
+        async with self._lock:
+            if self._idle.empty() and self._created < self.pool_size:
+                self._created += 1
+                try:
+                    return await self._run(self._connect)
+                except Exception:
+                    self._created -= 1
+                    raise
+        conn, last_used = await self._idle.get()
+        if monotonic()-last_used > DB_PING_INTERVAL:
+            try:
+                await self._run(self._ping, conn)
+            except Exception as e:
+                logger.warning(f"数据库连接健康检查失败，已重新建立连接。错误类型为{e}。")
+                await self._run(self._close_quietly, conn)
+                try:
+                    conn = await self._run(self._connect)
+                except Exception:
+                    # 重连失败时释放名额，下次取用时重新创建，避免连接池永久缩小
+                    self._created -= 1
+                    raise
+        return conn
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception as e:
+            logger.debug(f"关闭失效的数据库连接时出错，已忽略。错误类型为{e}。")
+
+    def release(self, conn):
+        '''归还连接'''
+        self._idle.put_nowait((conn, monotonic()))
+
+    def _ping(self, conn):
+        if self.backend == "mysql":
+            conn.ping(reconnect=True)
+        else:
+            conn.execute("SELECT 1")
+
+    async def transaction(self, func:Callable[[Any], Any]) -> Any:
+        '''
+        在同一连接上执行func(cursor)并提交，出错时回滚
+        func在线程池中运行，其中的SQL需先经过sql()转换占位符
+        '''
+        conn = await self.acquire()
+        try:
+            return await self._run(self._transaction, conn, func)
+        finally:
+            self.release(conn)
+
+    def _transaction(self, conn, func:Callable[[Any], Any]) -> Any:
+        cursor = conn.cursor()
+        try:
+            res = func(cursor)
+            conn.commit()
+            return res
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def sql(self, sql:str) -> str:
+        '''将 %s 占位符转换为当前后端的形式'''
+        return sql.replace("%s", "?") if self.backend == "sqlite" else sql
+
+    async def execute(self, sql:str, args:tuple=()) -> int:
+        '''执行写入语句并提交，返回影响行数'''
+        sql = self.sql(sql)
+        def query(cursor):
+            cursor.execute(sql, args)
+            return cursor.rowcount
+        return await self.transaction(query)
+
+    async def fetchone(self, sql:str, args:tuple=()) -> Optional[tuple]:
+        sql = self.sql(sql)
+        def query(cursor):
+            cursor.execute(sql, args)
+            return cursor.fetchone()
+        return await self.transaction(query)
+
+    async def fetchall(self, sql:str, args:tuple=()) -> list[tuple]:
+        sql = self.sql(sql)
+        def query(cursor):
+            cursor.execute(sql, args)
+            return list(cursor.fetchall())
+        return await self.transaction(query)
+
+    async def close(self):
+        '''关闭池中所有空闲连接并停止线程池'''
+        while not self._idle.empty():
+            conn, _ = self._idle.get_nowait()
+            try:
+                await self._run(conn.close)
+            except Exception as e:
+                logger.debug(f"关闭数据库连接时出错，错误类型为{e}。")
+        self._created = 0
+        self._executor.shutdown(wait=False)
+
+    async def init_schema(self):
+        '''如果未创建所需表，则创建所需表'''
+        if self.backend == "mysql":
+            id_col = "id INT NOT NULL AUTO_INCREMENT"
+            primary_key = ",\n            PRIMARY KEY (id)"
+        else:
+            id_col = "id INTEGER PRIMARY KEY AUTOINCREMENT"
+            primary_key = ""
+        await self.execute(f"""
+            CREATE TABLE IF NOT EXISTS {ACCOUNT_TABLES_NAME}(
+            {id_col},
+            name VARCHAR(7) NOT NULL,
+            user_id VARCHAR(15) NOT NULL,
+            email VARCHAR(320) NOT NULL,
+            password VARCHAR(32) NOT NULL,
+            total_score INT NOT NULL{primary_key}
+            );""")
+        logger.info(f"登录表 {ACCOUNT_TABLES_NAME} 检查完成。")
+        await self.execute(f"""
+            CREATE TABLE IF NOT EXISTS {TABLE_TABLES_NAME}(
+            {id_col},
+            hash CHAR(32) NOT NULL UNIQUE,
+            log BLOB NOT NULL,
+            created BIGINT NOT NULL{primary_key}
+            );""")
+        logger.info(f"牌局表 {TABLE_TABLES_NAME} 检查完成。")
+
+
+database:Database = None
+'''全局数据库，由 db_open 在服务启动时建立'''
+
+async def db_open(backend:str="mysql",
+            host='localhost',
+            user='mahjong',
+            password='MahjongPassword123456',
+            database='mahjong',
+            pool_size:int=DB_POOL_SIZE,
+            **kwargs):
+    '''
+    建立数据库连接池，并暂存到本模块database变量
+    :param database: MySQL数据库名，后端为sqlite时为数据库文件路径
+    '''
+    if backend == "mysql":
+        connect = lambda:pymysql.connect(host=host, user=user, password=password, database=database, **kwargs)
+    elif backend == "sqlite":
+        # 内存数据库每个连接各自独立，只能使用单个连接
+        if database == ":memory:":
+            pool_size = 1
+        connect = lambda:sqlite3.connect(database, check_same_thread=False, **kwargs)
+    else:
+        raise ValueError(f"不支持的数据库后端：{backend}")
+    pool = Database(connect, backend, pool_size)
+    try:
+        pool.release(await pool.acquire())
+    except Exception as e:
+        logger.error("数据库连接错误，请检查配置项。")
+        raise e
+    logger.info(f"数据库连接成功，后端为【{backend}】，连接池容量为{pool_size}。")
+    await pool.init_schema()
+    _set_database(pool)
+
+def _set_database(pool:Optional[Database]):
+    global database
+    database = pool
+
+async def db_close():
+    '''关闭数据库连接池'''
+    if database is not None:
+        await database.close()
+        _set_database(None)
+    logger.info("数据库连接已关闭。")
+
+
+# 账户查询
+
+async def get_player_info(user_id:str) -> dict:
+    '''从数据库获取玩家信息'''
+    info_col = ["id", "name", "user_id", "email", "total_score"]
+    res = await database.fetchone(f"SELECT {','.join(info_col)} FROM {ACCOUNT_TABLES_NAME} WHERE user_id = %s;", (user_id,))
+    return dict(zip(info_col, res)) if res else {}
+
+async def get_account(user_id:str) -> Optional[tuple]:
+    '''获取账户整行数据，列顺序为 id, name, user_id, email, password, total_score'''
+    return await database.fetchone(f"SELECT id, name, user_id, email, password, total_score FROM {ACCOUNT_TABLES_NAME} WHERE user_id = %s;", (user_id,))
+
+async def account_exists(column:str, value:str) -> bool:
+    '''检查指定列(user_id或email)取值为value的账户是否存在'''
+    res = await database.fetchone(f"SELECT COUNT(*) FROM {ACCOUNT_TABLES_NAME} WHERE {column} = %s;", (value,))
+    return bool(res[0])
+
+async def create_account(name:str, user_id:str, email:str, password:str, total_score:int):
+    '''新建账户'''
+    await database.execute(
+        f"INSERT INTO {ACCOUNT_TABLES_NAME} (name, user_id, email, password, total_score) VALUES (%s, %s, %s, %s, %s);",
+        (name, user_id, email, password, total_score))
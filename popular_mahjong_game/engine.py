@@ -0,0 +1,241 @@
+'''和牌判定与番数计算引擎
+
+手牌以27格计数向量表示（万、索、筒各9格），每种花色再压缩为一个5进制整数键，
+和牌拆解通过预先生成的单花色查找表完成，判定只需数次查表，不再进行递归搜索。
+'''
+
+from itertools import combinations_with_replacement, product
+from random import Random
+from typing import Optional
+
+from tile import Tile, TILE_KINDS, suit_of
+from cache import LRUCache
+
+
+Meld = tuple[str, Tile]
+'''面子，为(种类,起始牌)元组，种类为 chi/pon/pair'''
+
+OPEN_SEQUENCE_TYPES = ("chi",)
+'''副露中属于顺子的种类'''
+
+OPEN_TRIPLET_TYPES = ("pon", "con_kan", "exp_kan")
+'''副露中属于刻子（含杠）的种类'''
+
+
+def suit_key(counts:list[int], start:int=0) -> int:
+    '''将某一花色的9格计数压缩为5进制整数键'''
+    key = 0
+    for i in range(start+8, start-1, -1):
+        key = key*5 + counts[i]
+    return key
+
+
+def _build_suit_tables() -> tuple[dict[int, tuple[tuple[Meld,...],...]], dict[int, tuple[tuple[Meld,...],...]]]:
+    '''
+    生成单花色查找表
+    :rtype: 返回(无雀头表, 含一雀头表)，键为花色键，值为该花色所有拆解方式
+    '''
+    melds:list[Meld] = [("chi", i) for i in range(7)] + [("pon", i) for i in range(9)]
+    body_table:dict[int, list[tuple[Meld,...]]] = {}
+    pair_table:dict[int, list[tuple[Meld,...]]] = {}
+    for meld_count in range(5):
+        for combo in combinations_with_replacement(melds, meld_count):
+            counts = [0]*9
+            for kind, start in combo:
+                if kind == "chi":
+                    counts[start] += 1
+                    counts[start+1] += 1
+                    counts[start+2] += 1
+                else:
+                    counts[start] += 3
+            if max(counts, default=0) > 4:
+                continue
+            body_table.setdefault(suit_key(counts), []).append(combo)
+            for pair in range(9):
+                if counts[pair] > 2:
+                    continue
+                counts[pair] += 2
+                pair_table.setdefault(suit_key(counts), []).append(combo+(("pair", pair),))
+                counts[pair] -= 2
+    return (
+        {k:tuple(v) for k,v in body_table.items()},
+        {k:tuple(v) for k,v in pair_table.items()}
+    )
+
+SUIT_BODY_TABLE, SUIT_PAIR_TABLE = _build_suit_tables()
+
+
+def _suit_parts(counts:list[int]) -> Optional[list[tuple[int, tuple[tuple[Meld,...],...]]]]:
+    '''查表取得各花色的拆解，不构成和牌形状时返回None'''
+    parts = []
+    has_pair = False
+    for suit in range(3):
+        start = suit*9
+        num = sum(counts[start:start+9])
+        if num%3 == 0:
+            table = SUIT_BODY_TABLE
+        elif num%3 == 2 and not has_pair:
+            table = SUIT_PAIR_TABLE
+            has_pair = True
+        else:
+            return None
+        decompositions = table.get(suit_key(counts, start))
+        if decompositions is None:
+            return None
+        parts.append((start, decompositions))
+    return parts if has_pair else None
+
+def _is_seven_pairs(counts:list[int]) -> bool:
+    return sum(counts) == 14 and all(not v%2 for v in counts)
+
+def is_win(counts:list[int], has_open:bool=False) -> bool:
+    '''
+    判断闭合手牌（含和牌张）是否和牌
+    :param counts: 27格计数向量
+    :param has_open: 是否有副露，有副露时不能成七对子
+    '''
+    if not has_open and _is_seven_pairs(counts):
+        return True
+    return _suit_parts(counts) is not None
+
+def decompose(counts:list[int]) -> list[tuple[Meld,...]]:
+    '''返回闭合手牌所有的标准拆解方式，面子的起始牌为全局下标'''
+    parts = _suit_parts(counts)
+    if parts is None:
+        return []
+    per_suit = [
+        [tuple((kind, start+i) for kind, i in decomposition) for decomposition in decompositions]
+        for start, decompositions in parts
+    ]
+    return [sum(combo, ()) for combo in product(*per_suit)]
+
+def evaluate(counts:list[int], open:list[tuple]=()) -> list[tuple[int, list[str]]]:
+    '''
+    计算和牌番数
+    :param counts: 闭合手牌（含和牌张）的27格计数向量
+    :param open: 玩家副露，为(种类,牌,...)元组，牌为整数编码
+    :rtype: 返回所有可能的(番数, 番种)结果，按番数由高到低排列，未和牌时为空列表
+    '''
+    win_result = []
+    # 七对子检查
+    if not open and _is_seven_pairs(counts):
+        win_result.append((12, ["七对子"]))
+    # 常规和牌番数计算，只与顺子、刻子的构成有关
+    open_chi = sum(1 for meld in open if meld[0] in OPEN_SEQUENCE_TYPES)
+    open_pon = sum(1 for meld in open if meld[0] in OPEN_TRIPLET_TYPES)
+    shapes = set()
+    for decomposition in decompose(counts):
+        chi = open_chi + sum(1 for kind, _ in decomposition if kind == "chi")
+        pon = open_pon + sum(1 for kind, _ in decomposition if kind == "pon")
+        shapes.add((chi, pon))
+    for chi, pon in shapes:
+        score, attribute = 3, ["素和"]
+        # 基本和检查（全是顺子）
+        if not pon:
+            score += 3
+            attribute.append("基本和")
+        # 对对和检查（全是刻子）
+        if not chi:
+            score += 5
+            attribute.append("对对和")
+        win_result.append((score, attribute))
+    # 清一色检查
+    if win_result:
+        suits = {suit for suit in range(3) if any(counts[suit*9:suit*9+9])}
+        suits.update(suit_of(meld[1]) for meld in open)
+        if len(suits) == 1:
+            win_result = [(score+9, attribute+["清一色"]) for score, attribute in win_result]
+    win_result.sort(reverse=True)
+    return win_result
+
+def waiting_tiles(counts:list[int], has_open:bool=False) -> frozenset[Tile]:
+    '''
+    计算听牌
+    :param counts: 不含和牌张的闭合手牌27格计数向量
+    :param has_open: 是否有副露
+    :rtype: 返回所有能使手牌和牌的牌
+    '''
+    if sum(counts)%3 != 1:
+        return frozenset()
+    counts = counts.copy()
+    waits = []
+    for tile in range(TILE_KINDS):
+        if counts[tile] >= 4:
+            continue
+        # 与手牌同花色且相距两张以上的牌不可能使手牌和牌
+        start = tile - tile%9
+        if not any(counts[max(start, tile-2):min(start+9, tile+3)]):
+            continue
+        counts[tile] += 1
+        if is_win(counts, has_open):
+            waits.append(tile)
+        counts[tile] -= 1
+    return frozenset(waits)
+
+
+def hand_signature(counts:list[int], open:list[tuple]=()) -> tuple:
+    '''
+    手牌的规范签名，番数与听牌结果只由签名决定
+    :rtype: 返回(三种花色键, 副露顺子数, 副露刻子数, 副露花色位掩码)
+    '''
+    open_suits = 0
+    open_chi = 0
+    for meld in open:
+        open_suits |= 1 << suit_of(meld[1])
+        if meld[0] in OPEN_SEQUENCE_TYPES:
+            open_chi += 1
+    return (suit_key(counts, 0), suit_key(counts, 9), suit_key(counts, 18), open_chi, len(open)-open_chi, open_suits)
+
+
+class HandEvaluator:
+    '''带缓存的手牌判定器，以手牌规范签名为键缓存番数与听牌结果'''
+
+    def __init__(self, cache_size:int=65536):
+        self.evaluate_cache = LRUCache(cache_size)
+        '''番数计算缓存'''
+        self.waits_cache = LRUCache(cache_size)
+        '''听牌计算缓存'''
+
+    def evaluate(self, counts:list[int], open:list[tuple]=()) -> list[tuple[int, list[str]]]:
+        '''同 evaluate，结果经缓存'''
+        res = self.evaluate_cache.get_or_compute(hand_signature(counts, open), lambda:evaluate(counts, open))
+        return [(score, list(attribute)) for score, attribute in res]
+
+    def waits(self, counts:list[int], has_open:bool=False) -> frozenset[Tile]:
+        '''同 waiting_tiles，结果经缓存'''
+        key = (suit_key(counts, 0), suit_key(counts, 9), suit_key(counts, 18), has_open)
+        return self.waits_cache.get_or_compute(key, lambda:waiting_tiles(counts, has_open))
+
+    def prewarm(self, hand_count:int, rand_seed:int=0):
+        '''
+        预热缓存，随机生成hand_count副听牌手牌并计算其听牌与和牌番数
+        :param hand_count: 生成的手牌数量
+        :param rand_seed: 随机种子，保证预热内容可复现
+        '''
+        rng = Random(rand_seed)
+        melds = [(kind, start) for kind, starts in (("chi", range(7)), ("pon", range(9))) for start in starts]
+        for _ in range(hand_count):
+            counts = [0]*TILE_KINDS
+            for kind, start in rng.choices(melds, k=4):
+                start += 9*rng.randrange(3)
+                if kind == "chi":
+                    counts[start] += 1
+                    counts[start+1] += 1
+                    counts[start+2] += 1
+                else:
+                    counts[start] += 3
+            counts[rng.randrange(TILE_KINDS)] += 2
+            if max(counts) > 4:
+                continue
+            counts[rng.choice([tile for tile in range(TILE_KINDS) if counts[tile]])] -= 1
+            for tile in self.waits(counts):
+                counts[tile] += 1
+                self.evaluate(counts)
+                counts[tile] -= 1
+
+    def stats(self) -> dict:
+        '''缓存统计信息'''
+        return {
+            "evaluate": self.evaluate_cache.stats(),
+            "waits": self.waits_cache.stats()
+        }
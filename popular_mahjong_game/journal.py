@@ -0,0 +1,146 @@
+'''玩家分数的延迟写入日志
+
+分数变更先追加到本地日志并fsync，随后由共享定时器在固定间隔内批量写入数据库：
+同一玩家的多次变更只保留最新值，所有变更在一个事务中以 CASE 语句多行更新。
+写入成功后日志只保留尚未写入的变更；服务崩溃后启动时重放日志，保证分数不丢失。
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional
+from loguru import logger
+import asyncio
+import os
+
+import db
+from scheduler import scheduler, TimerHandle
+from utils import ACCOUNT_TABLES_NAME, SCORE_JOURNAL_PATH, SCORE_FLUSH_INTERVAL, SCORE_FLUSH_BATCH
+
+
+class ScoreJournal:
+    '''分数写入日志，记录与写入数据库均不阻塞事件循环'''
+
+    def __init__(self, path:str=SCORE_JOURNAL_PATH, flush_interval:float=SCORE_FLUSH_INTERVAL):
+        self.path = path
+        '''本地日志路径，每行为 user_id\\t分数'''
+        self.flush_interval = flush_interval
+        '''最长写入间隔（秒）'''
+        self.pending:dict[str, int] = {}
+        '''尚未写入数据库的最新分数'''
+        self._file = None
+        self._timer:Optional[TimerHandle] = None
+        self._lock = asyncio.Lock()
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="journal")
+        '''单线程执行文件操作，保证追加顺序'''
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def record(self, user_id:str, total_score:int):
+        '''记录单个玩家的最新分数'''
+        await self.record_many([(user_id, total_score)])
+
+    async def record_many(self, scores:Iterable[tuple[str, int]]):
+        '''记录多个玩家的最新分数，返回时变更已持久化到本地日志'''
+        scores = list(scores)
+        if not scores:
+            return
+        # 先更新内存再排队追加，使重写日志时取得的快照包含所有已排队的追加
+        self.pending.update(scores)
+        await self._run(self._append, scores)
+        if self._timer is None:
+            self._timer = scheduler.call_later(self.flush_interval, self.flush)
+
+    def _append(self, scores:list[tuple[str, int]]):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write("".join(f"{user_id}\t{score}\n" for user_id, score in scores))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    async def flush(self):
+        '''将积累的变更批量写入数据库'''
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        async with self._lock:
+            if not self.pending:
+                return
+            batch, self.pending = self.pending, {}
+            try:
+                await db.database.transaction(lambda cursor:self._update(cursor, list(batch.items())))
+            except Exception as e:
+                # 写入失败时保留变更，期间的新变更优先
+                for user_id, score in batch.items():
+                    self.pending.setdefault(user_id, score)
+                logger.error(f"分数批量写入数据库失败，{len(self.pending)}条变更将在下次写入时重试。错误类型为{e}。")
+                self._timer = scheduler.call_later(self.flush_interval, self.flush)
+                return
+            await self._run(self._compact, list(self.pending.items()))
+            logger.debug(f"已将{len(batch)}条分数变更写入数据库。")
+            if self.pending and self._timer is None:
+                self._timer = scheduler.call_later(self.flush_interval, self.flush)
+
+    def _update(self, cursor, scores:list[tuple[str, int]]):
+        for start in range(0, len(scores), SCORE_FLUSH_BATCH):
+            chunk = scores[start:start+SCORE_FLUSH_BATCH]
+            sql = (f"UPDATE {ACCOUNT_TABLES_NAME} SET total_score = CASE user_id "
+                + "WHEN %s THEN %s "*len(chunk)
+                + f"END WHERE user_id IN ({', '.join(['%s']*len(chunk))});")
+            args = [value for pair in chunk for value in pair] + [user_id for user_id, _ in chunk]
+            cursor.execute(db.database.sql(sql), args)
+
+    def _compact(self, scores:list[tuple[str, int]]):
+        '''以尚未写入的变更重写日志'''
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("".join(f"{user_id}\t{score}\n" for user_id, score in scores))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def _load(self) -> dict[str, int]:
+        scores = {}
+        if not os.path.exists(self.path):
+            return scores
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                # 崩溃时可能留下不完整的末行，没有换行符的行不予采信
+                if not line.endswith("\n"):
+                    break
+                user_id, _, score = line[:-1].partition("\t")
+                if user_id and score.lstrip("-").isdigit():
+                    scores[user_id] = int(score)
+        return scores
+
+    async def replay(self):
+        '''启动时将日志中尚未写入的变更写入数据库'''
+        scores = await self._run(self._load)
+        if not scores:
+            return
+        logger.info(f"检测到{len(scores)}条未写入数据库的分数变更，开始重放。")
+        for user_id, score in scores.items():
+            self.pending.setdefault(user_id, score)
+        await self.flush()
+
+    async def close(self):
+        '''写入所有变更并关闭日志'''
+        await self.flush()
+        if self.pending:
+            logger.warning(f"关闭时仍有{len(self.pending)}条分数变更未写入数据库，已保留在日志【{self.path}】中。")
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._file is not None:
+            await self._run(self._file.close)
+            self._file = None
+
+
+def init_score_journal():
+    '''初始化分数写入日志'''
+    global score_journal
+    score_journal = ScoreJournal()
+
+init_score_journal()
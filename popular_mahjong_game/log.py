@@ -0,0 +1,74 @@
+'''牌桌日志
+
+牌桌代码通过 table_logger 取得绑定了牌桌号的记录器，日志参数以关键字传入：
+    log.debug("等待玩家响应 player_index={player_index}", player_index=player_index)
+关键字参数同时写入记录的extra字段，可按键值检索；消息只在确实输出时才格式化，DEBUG关闭时几乎没有开销。
+需要额外计算的参数用 log.opt(lazy=True) 并传入无参函数。
+
+DEBUG日志按牌桌抽样，未抽中的牌桌直接丢弃DEBUG及以下级别的日志，不生成记录。
+init_logging 添加的输出均为 enqueue=True，记录经队列交由后台线程写出，不占用事件循环时间。
+'''
+
+from typing import Any, Optional
+from loguru import logger
+import sys
+import zlib
+
+from utils import LOG_LEVEL, LOG_TABLE_SAMPLE_RATE, LOG_PATH, LOG_SERIALIZE
+
+
+LOG_FORMAT = "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | <cyan>{name}:{function}:{line}</cyan> | {extra[table]} - <level>{message}</level>"
+'''输出格式，未绑定牌桌号的记录显示为 -'''
+
+_sample_rate = LOG_TABLE_SAMPLE_RATE
+
+
+def is_sampled(table_code:str, rate:Optional[float]=None) -> bool:
+    '''牌桌是否被抽中记录DEBUG日志，同一牌桌号在各进程中结果相同'''
+    rate = _sample_rate if rate is None else rate
+    if rate >= 1:
+        return True
+    return zlib.crc32(table_code.encode()) % 10000 < rate*10000
+
+
+class _Unsampled:
+    '''未被抽样牌桌的记录器，DEBUG及以下级别直接丢弃，其余级别照常记录'''
+
+    def __init__(self, log):
+        self._log = log
+
+    def trace(self, *args, **kwargs):
+        pass
+
+    def debug(self, *args, **kwargs):
+        pass
+
+    def opt(self, *args, **kwargs) -> "_Unsampled":
+        return _Unsampled(self._log.opt(*args, **kwargs))
+
+    def bind(self, **kwargs) -> "_Unsampled":
+        return _Unsampled(self._log.bind(**kwargs))
+
+    def __getattr__(self, name:str) -> Any:
+        return getattr(self._log, name)
+
+
+def table_logger(table_code:str):
+    '''取得绑定了牌桌号的记录器'''
+    log = logger.bind(table=table_code)
+    return log if is_sampled(table_code) else _Unsampled(log)
+
+
+def init_logging(level:str=LOG_LEVEL, sample_rate:float=LOG_TABLE_SAMPLE_RATE, path:Optional[str]=LOG_PATH, serialize:bool=LOG_SERIALIZE):
+    '''
+    配置日志输出，替换默认输出
+    :param sample_rate: 记录DEBUG日志的牌桌比例
+    :param path: 日志文件路径，为None时输出到标准错误
+    :param serialize: 是否以JSON格式输出，便于按键值检索
+    '''
+    global _sample_rate
+    _sample_rate = sample_rate
+    logger.remove()
+    logger.configure(extra={"table": "-"})
+    logger.add(path or sys.stderr, level=level, format=LOG_FORMAT, serialize=serialize, enqueue=True)
+    logger.info(f"日志输出已配置，级别为【{level}】，牌桌抽样比例为{sample_rate}。")
@@ -1,10 +1,25 @@
 import uvicorn
-from fastapi import FastAPI, WebSocket, HTTPException
+from fastapi import FastAPI, WebSocket, HTTPException, Header
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 from utils import *
 from player import *
+from db import db_open, db_close
+import db
+from journal import score_journal
+from matchlog import match_log_writer
+from session import session_manager
+import hmac
 from match import *
+from wire import CODECS
+from log import init_logging
+from connection import connection_manager
+from monitor import loop_monitor, profiler
+from metrics import metrics, timed, HTTP_LATENCY, ACTIVE_TABLES, ONLINE_PLAYERS, OPEN_WEBSOCKETS
+
+
+init_logging()
 
 
 
@@ -23,21 +38,34 @@ app.add_middleware(
 async def _():
     return {"text":"This is a test..."}
 
+@app.get('/metrics', response_class=PlainTextResponse)
+async def metrics_handler():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+ACTIVE_TABLES.set_function(lambda:len(table_manager.tables))
+ONLINE_PLAYERS.set_function(lambda:len(player_manager.player_online))
+OPEN_WEBSOCKETS.set_function(lambda:len(connection_manager))
+
 
 
 
 # hook
 
-# @app.on_event('startup')
-# async def startup_handler():
-#     connection_open()
-#     init_player_manager()
-#     init_table_manager()
+@app.on_event('startup')
+async def startup_handler():
+    loop_monitor.start()
+    await db_open()
+    await score_journal.replay()
+    await match_log_writer.replay()
 
 @app.on_event('shutdown')
 async def shutdown_handler():
-    player_manager.save_all_data()
-    connection_close()
+    await player_manager.save_all_data()
+    await score_journal.close()
+    await match_log_writer.close()
+    session_manager.close()
+    await db_close()
+    loop_monitor.stop()
 
 
 
@@ -45,25 +73,19 @@ async def shutdown_handler():
 
 async def login_auth(user_id:str, token:str):
     '''登录验证'''
-    if not player_manager.if_online(user_id):
+    session, valid = await session_manager.validate(user_id, token)
+    if session is None:
         raise UserInvalidException(401, "该用户尚未登录")
-    if not player_manager.if_user_valid(user_id, token):
+    if not valid:
         raise UserInvalidException(401, "用户登录验证失败")
 
 @app.post('/register')
 async def register_handler(form:RegisterForm):
-    with connection.cursor() as cursor:
-        cursor.execute(f"SELECT COUNT(*) FROM {ACCOUNT_TABLES_NAME} WHERE user_id = '{form.user_id}';")
-        res = cursor.fetchone()
-        if res[0]:
-            raise HTTPException(422, "该用户ID已存在")
-        cursor.execute(f"SELECT COUNT(*) FROM {ACCOUNT_TABLES_NAME} WHERE email = '{form.email}';")
-        res = cursor.fetchone()
-        if res[0]:
-            raise HTTPException(422, "该邮箱已存在")
-        
-        cursor.execute(f"INSERT INTO {ACCOUNT_TABLES_NAME} (name, user_id, email, password, total_score) VALUES ('{form.name}', '{form.user_id}', '{form.email}', '{form.password}', {INIT_SCORE});")
-        connection.commit()
+    if await db.account_exists("user_id", form.user_id):
+        raise HTTPException(422, "该用户ID已存在")
+    if await db.account_exists("email", form.email):
+        raise HTTPException(422, "该邮箱已存在")
+    await db.create_account(form.name, form.user_id, form.email, form.password, INIT_SCORE)
     logger.info(f"新用户注册成功，用户ID为【{form.user_id}】。")
     return {
                 "result":"SUCCESS",
@@ -71,15 +93,14 @@ async def register_handler(form:RegisterForm):
             }
 
 @app.post('/login')
+@timed(HTTP_LATENCY.labels("/login"))
 async def login_handler(form:LoginForm):
-    with connection.cursor() as cursor:
-        cursor.execute(f"SELECT * FROM {ACCOUNT_TABLES_NAME} WHERE user_id = '{form.user_id}';")
-        res = cursor.fetchone()
+    res = await session_manager.get_account(form.user_id)
     if not res:
         raise HTTPException(422, "该用户ID不存在，请先注册")
-    if res[4] != form.password:
+    if not hmac.compare_digest(res[4].encode(), form.password.encode()):
         raise HTTPException(422, "密码错误")
-    token = player_manager.login(form.user_id)
+    token = await player_manager.login(res)
     logger.info(f"玩家【{form.user_id}】登录成功。")
     return {
                 "result":"SUCCESS",
@@ -101,14 +122,20 @@ async def logout_handler(form:LogoutForm):
 # 大厅部分
 
 @app.post('/hall')
+@timed(HTTP_LATENCY.labels("/hall"))
 async def hall_handler(form:ListTableForm):
     await login_auth(form.user_id, form.token)
+    res = table_manager.list_tables(form.status, form.page, form.page_size)
     return {
         "type":"table_list",
-        "data":table_manager.list_all_table()
+        "data":res["tables"],
+        "total":res["total"],
+        "page":res["page"],
+        "page_size":res["page_size"]
     }
 
 @app.post('/create')
+@timed(HTTP_LATENCY.labels("/create"))
 async def create_table_handler(form:CreateTableForm):
     await login_auth(form.user_id, form.token)
     new_table = table_manager.create_new_table()
@@ -119,6 +146,7 @@ async def create_table_handler(form:CreateTableForm):
     }
 
 @app.post('/join')
+@timed(HTTP_LATENCY.labels("/join"))
 async def join_table_handler(form:JoinTableForm):
     await login_auth(form.user_id, form.token)
     return {
@@ -132,28 +160,61 @@ async def exit_table_handler(form:ExitTableForm):
     await table_manager.exit_table(form.table_code, form.user_id)
 
 @app.websocket('/ws/{user_id}/{token}')
-async def player_connect(ws:WebSocket, user_id:str, token:str):
+async def player_connect(ws:WebSocket, user_id:str, token:str, format:str="json"):
     try:
         await login_auth(user_id, token)
     except HTTPException as e:
         await ws.close(1008, reason=e.detail)
         logger.debug(f"玩家【{user_id}】的WebSocket连接因【{e.detail}】断开")
         return
+    if format not in CODECS:
+        await ws.close(1008, reason="不支持的消息编码。")
+        logger.debug(f"玩家【{user_id}】的WebSocket连接因【不支持的消息编码{format}】断开")
+        return
     player = player_manager.get_online_player(user_id)
     if not player.if_in_table():
         await ws.close(1008, reason="玩家尚未在桌内，无法进行WebSocket连接。")
         logger.debug(f"玩家【{user_id}】的WebSocket连接因【用户尚未在桌内】断开")
         return
     await ws.accept()
-    logger.info(f"玩家【{user_id}】WebSocket连接成功")
-    await player.connect_websocket(ws)
+    logger.info(f"玩家【{user_id}】WebSocket连接成功，消息编码为【{format}】")
+    await player.connect_websocket(ws, CODECS[format])
 
 
 
     
 
+# 管理部分
+
+def admin_auth(token:Optional[str]):
+    '''管理接口验证，未配置ADMIN_TOKEN时管理接口不可用'''
+    if ADMIN_TOKEN is None or token is None or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(403, "无权访问管理接口")
+
+@app.get('/admin/stalls')
+async def loop_stalls_handler(x_admin_token:Optional[str]=Header(None)):
+    admin_auth(x_admin_token)
+    return {
+        "threshold": loop_monitor.threshold,
+        "stalls": [stall.to_dict() for stall in loop_monitor.stalls]
+    }
+
+@app.get('/admin/profile', response_class=PlainTextResponse)
+async def profile_handler(seconds:float=5, x_admin_token:Optional[str]=Header(None)):
+    admin_auth(x_admin_token)
+    if profiler.running:
+        raise HTTPException(409, "已有正在进行的采样分析")
+    if not 0 < seconds <= profiler.max_duration:
+        raise HTTPException(400, f"采样时长须在0到{profiler.max_duration}秒之间")
+    logger.info(f"开始采样分析，时长为{seconds}秒。")
+    return PlainTextResponse(await profiler.profile(seconds))
+
+
+
 if __name__ == '__main__':
     uvicorn.run(
         app=app,
         host="0.0.0.0",
-        port=23333)
\ No newline at end of file
+        port=23333,
+        ws_ping_interval=WS_PING_INTERVAL,
+        ws_ping_timeout=WS_PING_TIMEOUT)
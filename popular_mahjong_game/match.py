@@ -1,17 +1,40 @@
-from typing import Optional, Deque, Literal
-from collections import deque, Counter
+from typing import Any, Optional, Deque, Literal
+from collections import deque
 from dataclasses import dataclass, field
 from fastapi import WebSocket
 from loguru import logger
 from hashlib import md5
 import random
+import secrets
 import asyncio
+import heapq
 
 from player import Player, player_manager
-from utils import MATCH_PLAYER_COUNT, THINKING_TIME_LIMIT, READY_TIMEOUT, TABLE_WAIT_TIME
+from engine import HandEvaluator
+from shanten import calculate_shanten, ukeire, discard_candidates
+from autoplay import AutoPlayPolicy, DEFAULT_POLICY
+from scheduler import scheduler
+from countdown import countdown_service
+from connection import connection_manager
+from arbiter import ClaimArbiter
+from log import table_logger
+from matchlog import MatchLog, match_log_writer
+from metrics import HANDLER_LATENCY, WAIT_LATENCY, PENDING_WAITS, WAIT_TIMEOUTS, AUTO_PLAYS, SEND_FAILURES
+from sync import EventStream
+from tile import Tile, TILE_KINDS, tile_from_str, tile_to_str, parse_tile, number_of, suit_of, meld_to_str, action_to_str
+from cache import LRUCache
+from utils import REQUEST_PRIORITY, MATCH_PLAYER_COUNT, THINKING_TIME_LIMIT, READY_TIMEOUT, TABLE_WAIT_TIME, HAND_CACHE_SIZE, HAND_CACHE_PREWARM, TABLE_CODE_MAX, HALL_CACHE_SIZE
 from exceptions import *
 
 
+INITIAL_DECK:list[Tile] = [tile_from_str(f"{num}{color}") for _ in range(4) for num in range(1,10) for color in "msp"]
+'''未洗牌的牌堆，洗牌前的顺序影响同一种子生成的牌堆'''
+
+def new_seed() -> int:
+    '''生成新的牌局随机种子'''
+    return secrets.randbits(64)
+
+
 @dataclass
 class PlayerInMatch:
     name:str
@@ -22,16 +45,20 @@ class PlayerInMatch:
     '''牌局玩家序号'''
     ws:WebSocket
     '''玩家WebSocket连接'''
-    close:list[str]=field(default_factory=list)
+    close:list[Tile]=field(default_factory=list)
     '''玩家手牌'''
-    open:list[tuple[str,...]]=field(default_factory=list)
+    open:list[tuple]=field(default_factory=list)
     '''玩家副露，为(种类,牌,...)元组'''
-    draw:str=None
+    draw:Optional[Tile]=None
     '''摸到的单张牌'''
-    discard:list[tuple[str,bool]]=field(default_factory=list)
+    discard:list[tuple[Tile,bool]]=field(default_factory=list)
     '''牌河，为(牌,是否手切)元组'''
     score:int=0
     '''玩家获得分数'''
+    close_count:list[int]=field(default_factory=lambda:[0]*TILE_KINDS)
+    '''手牌计数，下标为牌的整数编码，随手牌变化同步更新'''
+    _waits:Optional[frozenset[Tile]]=field(default=None, repr=False, compare=False)
+    '''听牌缓存，手牌变化时置空，下次查询时重新计算'''
     
     @classmethod
     def construct(cls, player:Player, index:int):
@@ -43,8 +70,63 @@ class PlayerInMatch:
             ws=player.ws,
             score=player.total_score
         )
+
+    @property
+    def waits(self) -> frozenset[Tile]:
+        '''当前手牌的听牌，只在手牌变化后重新计算'''
+        if self._waits is None:
+            self._waits = hand_evaluator.waits(self.close_count, bool(self.open))
+        return self._waits
+
+    def hand_count(self) -> list[int]:
+        '''手牌与摸牌合计的27格计数向量'''
+        counts = self.close_count.copy()
+        if self.draw is not None:
+            counts[self.draw] += 1
+        return counts
+
+    def shanten(self) -> int:
+        '''当前手牌（含摸牌）的向听数'''
+        return calculate_shanten(self.hand_count(), len(self.open))
+
+    def ukeire(self, visible:Optional[list[int]]=None) -> tuple[int, dict[Tile, int]]:
+        '''未摸牌时的有效进张，visible为手牌以外已见牌的计数'''
+        return ukeire(self.close_count, len(self.open), visible)
+
+    def discard_candidates(self, visible:Optional[list[int]]=None, best_only:bool=False) -> list[tuple[Tile, int, int]]:
+        '''摸牌后各切牌选择的(切牌, 切后向听数, 切后有效进张枚数)'''
+        return discard_candidates(self.hand_count(), len(self.open), visible, best_only)
+
+    def add_close(self, tile:Tile):
+        '''向手牌中加入一张牌'''
+        self.close.append(tile)
+        self.close_count[tile] += 1
+        self._waits = None
+
+    def remove_close(self, tile:Tile, num:int=1):
+        '''从手牌中移除num张指定牌'''
+        for _ in range(num):
+            self.close.remove(tile)
+        self.close_count[tile] -= num
+        self._waits = None
+
+    def replace_close(self, index:int, tile:Tile) -> Tile:
+        '''将手牌中指定位置的牌替换为新牌，返回被替换的牌'''
+        old = self.close[index]
+        self.close[index] = tile
+        self.close_count[old] -= 1
+        self.close_count[tile] += 1
+        self._waits = None
+        return old
+
+    def pop_close(self) -> Tile:
+        '''移除并返回手牌最后一张牌'''
+        tile = self.close.pop()
+        self.close_count[tile] -= 1
+        self._waits = None
+        return tile
     
-    def action_check(self, new:str=None, target_player_index:int=None, need_discard:bool=False, only_discard:bool=False) -> list[dict]:
+    def action_check(self, new:Optional[Tile]=None, target_player_index:int=None, need_discard:bool=False, only_discard:bool=False) -> list[dict]:
         actions = []
         if only_discard or need_discard:
             actions.append({
@@ -53,7 +135,7 @@ class PlayerInMatch:
             })
             if only_discard:
                 return actions
-        if new:
+        if new is not None:
             if target_player_index==None:
                 actions:list[dict] = actions+self._kan_check(new, target_player_index)+self._win_check(new, target_player_index)
             else:
@@ -62,42 +144,42 @@ class PlayerInMatch:
         return actions
         
 
-    def _chi_check(self, new:str, target_player_index:int) -> list[dict]:
+    def _chi_check(self, new:Tile, target_player_index:int) -> list[dict]:
         res = []
         if not ((self.player_index and self.player_index-1==target_player_index) or (not self.player_index and target_player_index+1==MATCH_PLAYER_COUNT)):
             return res
-        num, type = int(new[0]), new[1]
+        num, cnt = number_of(new), self.close_count
         # (A) B C型
-        if f"{num+1}"+type in self.close and f"{num+2}"+type in self.close:
+        if num<=7 and cnt[new+1] and cnt[new+2]:
             res.append({
                 "action": "chi",
                 "tile_type": new,
                 "player_index": self.player_index,
                 "target_player_index": target_player_index,
-                "tiles": [f"{num+1}"+type, f"{num+2}"+type]
+                "tiles": [new+1, new+2]
             })
         # A (B) C型
-        if f"{num-1}"+type in self.close and f"{num+1}"+type in self.close:
+        if 2<=num<=8 and cnt[new-1] and cnt[new+1]:
             res.append({
                 "action": "chi",
                 "tile_type": new,
                 "player_index": self.player_index,
                 "target_player_index": target_player_index,
-                "tiles": [f"{num-1}"+type, f"{num+1}"+type]
+                "tiles": [new-1, new+1]
             })
         # A B (C)型
-        if f"{num-1}"+type in self.close and f"{num-2}"+type in self.close:
+        if num>=3 and cnt[new-1] and cnt[new-2]:
             res.append({
                 "action": "chi",
                 "tile_type": new,
                 "player_index": self.player_index,
                 "target_player_index": target_player_index,
-                "tiles": [f"{num-1}"+type, f"{num-2}"+type]
+                "tiles": [new-1, new-2]
             })
         return res
 
-    def _pon_check(self, new:str, target_player_index:int) -> list[dict]:
-        if self.close.count(new)>=2:
+    def _pon_check(self, new:Tile, target_player_index:int) -> list[dict]:
+        if self.close_count[new]>=2:
             return [{
                 "action": "pon",
                 "tile_type": new,
@@ -107,14 +189,13 @@ class PlayerInMatch:
         else:
             return []
 
-    def _kan_check(self, new:str, target_player_index:int=None) -> list[dict]:
+    def _kan_check(self, new:Tile, target_player_index:int=None) -> list[dict]:
         res = []
         if target_player_index==None:
             # 检查暗杠
-            temp_close = self.close.copy() + [new]
-            cnt = Counter(temp_close)
-            for i,v in cnt:
-                if v==4:
+            cnt = self.close_count
+            for i in range(TILE_KINDS):
+                if cnt[i]+(i==new) == 4:
                     res.append({
                         "action":"kan",
                         "kan_type":"concealed",
@@ -134,7 +215,7 @@ class PlayerInMatch:
                     })
         else:
             # 检查大明杠
-            if self.close.count(new)==3:
+            if self.close_count[new]==3:
                 res.append({
                     "action":"kan",
                     "kan_type":"exposed",
@@ -144,96 +225,8 @@ class PlayerInMatch:
                 })
         return res
 
-    def _win_check(self, new:str, target_player_index:int=None) -> list[dict]:
-        from collections import Counter
-        all_close = Counter(self.close+[new])
-        posible = []
-        def get_next_tile(tile:str)->str:
-            num = int(tile[0])
-            if num==9:
-                return ''
-            else:
-                return str(num+1)+tile[1]
-        def get_last_tile(tile:str)->str:
-            num = int(tile[0])
-            if num==1:
-                return ''
-            else:
-                return str(num-1)+tile[1]
-        def dfs(last_close:Counter[str], temp_tiles:list[tuple[str]]):
-            nonlocal posible
-            # 边界条件，只剩雀头或不合法
-            if sum(last_close.values()) <= 2:
-                for k,v in last_close.items():
-                    if v==2:
-                        posible.append(temp_tiles+[[k]*2])
-                        break
-                return
-            # 递归求所有拆牌可能性
-            for k,v in last_close.items():
-                # 以k成刻子
-                if v>=3:
-                    new_close = last_close.copy()
-                    new_close[k] -= 3
-                    dfs(last_close=new_close, temp_tiles=temp_tiles+[(k)*3])
-                # 以k为中心的顺子
-                if v and last_close[get_last_tile(k)] and last_close[get_next_tile(k)]:
-                    new_close = last_close.copy()
-                    new_close[k] -= 1
-                    new_close[get_last_tile(k)] -= 1
-                    new_close[get_next_tile(k)] -= 1
-                    dfs(last_close=new_close, temp_tiles=temp_tiles+[(get_last_tile(k), k, get_next_tile(k))])
-            return
-        dfs(all_close, [])
-        win_result = []
-        # 清一色最后统一检查
-        # 七对子检查
-        if not self.open:
-            flag = 1
-            for k,v in all_close.items():
-                if v%2:
-                    flag = 0
-                    break
-            if flag:
-                win_result.append([12,["七对子"]])
-        # 常规和牌番数计算
-        def check_win(tiles:list[tuple[str]]) -> list:
-            res = [3, ["素和"]]
-            # 基本和检查（全是顺子）
-            flag = 1
-            for tile in tiles:
-                if len(tile)!=2 and len(set(tile)) == 1:
-                    flag = 0
-                    break
-            if flag:
-                res[0] += 3
-                res[1].append("基本和")
-            # 对对和检查（全是顺子）
-            flag = 1
-            for tile in tiles:
-                if len(tile)!=2 and len(set(tile)) != 1:
-                    flag = 0
-                    break
-            if flag:
-                res[0] += 5
-                res[1].append("对对和")
-            return res
-        for tiles in posible:
-            all_tile = tiles+self.open
-            res = check_win(all_tile)
-            win_result.append(res)
-        # 清一色检查
-        all_tiles = self.close+[new]
-        for open_tiles in self.open:
-            all_tiles.extend(open_tiles)
-        color_cnt = Counter(tile[1] for tile in all_tiles)
-        if len(color_cnt) == 1:
-            for win in win_result:
-                win[0] += 9
-                win[1].append("清一色")
-        # 最终选择
-        win_result.sort(reverse=True)
-        if win_result:
+    def _win_check(self, new:Tile, target_player_index:int=None) -> list[dict]:
+        if new in self.waits:
             return [{
                 "action": "win",
                 "tile_type": new,
@@ -247,10 +240,10 @@ class PlayerInMatch:
         return {
             "name":self.name,
             "user_id":self.user_id,
-            "close":self.close,
-            "open":self.open,
-            "draw":self.draw,
-            "discard":self.discard,
+            "close":[tile_to_str(tile) for tile in self.close],
+            "open":[meld_to_str(meld) for meld in self.open],
+            "draw":tile_to_str(self.draw) if self.draw is not None else None,
+            "discard":[(tile_to_str(tile), tsumogiri) for tile, tsumogiri in self.discard],
             "score":self.score
         }
     
@@ -258,9 +251,9 @@ class PlayerInMatch:
         return {
             "name":self.name,
             "user_id":self.user_id,
-            "open":self.open,
-            "draw":self.draw,
-            "discard":self.discard,
+            "open":[meld_to_str(meld) for meld in self.open],
+            "draw":tile_to_str(self.draw) if self.draw is not None else None,
+            "discard":[(tile_to_str(tile), tsumogiri) for tile, tsumogiri in self.discard],
             "score":self.score
         }
 
@@ -271,26 +264,78 @@ class Match:
     
     player:list[PlayerInMatch]
     '''游戏玩家，首位为庄家'''
-    initial_deck:list[str]
+    initial_deck:list[Tile]
     '''对局牌堆'''
     hash:str
     '''牌堆哈希'''
     rand_seed:Optional[int]=None
-    '''给定的随机种子'''
+    '''随机种子，未给定时随机生成，与哈希一同记录以便复现牌局'''
+    rng:random.Random
+    '''本局独立的随机数生成器，不影响全局random模块'''
+    seat_order:list[int]
+    '''座次，第i位玩家为传入的第seat_order[i]位玩家'''
+    draw_log:list[tuple[int, Tile]]
+    '''摸牌记录，为(摸牌玩家序号, 牌)元组，包括配牌'''
 
-    deck:Deque[str]
+    deck:Deque[Tile]
     '''牌堆，会时刻变化'''
     turn:int = 0
     '''摸牌次序'''
     result:dict={}
     '''牌局结果，可以用以判断牌局是否结束'''
+    match_log:Optional[MatchLog]=None
+    '''牌局事件记录，配牌完成后创建'''
+    log:Any=logger
+    '''日志记录器，由牌桌创建时为牌桌的记录器'''
 
-    def __init__(self, players:list[Player], rand_seed:Optional[int]=None):
-        self.player = [PlayerInMatch.construct(player, i) for i, player in enumerate(players)]
-        self._shuffle_deck(rand_seed)
+    def __init__(self, players:list[Player], rand_seed:Optional[int]=None, shuffle_seats:bool=False, log:Any=None):
+        '''
+        :param players: 参与牌局的玩家
+        :param rand_seed: 随机种子，为None时随机生成
+        :param shuffle_seats: 是否用本局随机数生成器打乱座次
+        :param log: 日志记录器，为None时使用全局记录器
+        '''
+        if log is not None:
+            self.log = log
+        self.draw_log = []
+        self.rand_seed = rand_seed if rand_seed is not None else new_seed()
+        self.rng = random.Random(self.rand_seed)
+        self.seat_order = list(range(len(players)))
+        if shuffle_seats:
+            self.rng.shuffle(self.seat_order)
+        self.player = [PlayerInMatch.construct(players[seat], i) for i, seat in enumerate(self.seat_order)]
+        self._shuffle_deck()
         self._initial_hand()
+        # 记录只用于复盘，构造失败时本局不记录，不影响牌局进行
+        try:
+            self.match_log = MatchLog.construct(self)
+        except Exception as e:
+            self.log.warning("牌局记录构造失败，本局不记录。错误类型为{error!r}。", error=e)
+
+    @staticmethod
+    def regenerate(rand_seed:int, player_count:int=MATCH_PLAYER_COUNT, shuffle_seats:bool=False) -> tuple[list[int], list[Tile]]:
+        '''
+        由随机种子重新生成座次与牌堆，可在其他进程或节点复现牌局
+        :rtype: 返回(座次, 初始牌堆)
+        '''
+        rng = random.Random(rand_seed)
+        seat_order = list(range(player_count))
+        if shuffle_seats:
+            rng.shuffle(seat_order)
+        deck = INITIAL_DECK.copy()
+        rng.shuffle(deck)
+        return seat_order, deck
+
+    def to_record(self) -> dict:
+        '''牌局复现记录，包括哈希、随机种子、座次与摸牌顺序'''
+        return {
+            "hash": self.hash,
+            "rand_seed": self.rand_seed,
+            "seat_order": self.seat_order,
+            "draw_log": [(player_index, tile_to_str(tile)) for player_index, tile in self.draw_log]
+        }
     
-    def draw(self, player_index:int=None, turn_change:bool=True, wall_end:bool=False) -> tuple[int, str]:
+    def draw(self, player_index:int=None, turn_change:bool=True, wall_end:bool=False) -> tuple[int, Tile]:
         '''
         玩家摸牌
         :param player_index: 摸牌玩家的序号，默认为self.turn值
@@ -312,214 +357,144 @@ class Match:
                 "winner_index": None,
                 "loser_index": None
             }
+            if self.match_log is not None:
+                self.match_log.result(self.result)
             raise MatchEndedException("牌堆为空，牌局结束。")
         if wall_end:
             player.draw = self.deck.pop()
         else:
             player.draw = self.deck.popleft()
+        self.draw_log.append((player_index, player.draw))
+        if self.match_log is not None:
+            self.match_log.draw(player_index, player.draw, wall_end)
         if turn_change:
             self._turn_change()
         return player_index, player.draw
 
-    def discard(self, player_index:int, tile_type:str='', discard_draw:bool=True) -> str:
+    def discard(self, player_index:int, tile_type:Optional[Tile]=None, discard_draw:bool=True) -> Tile:
         '''玩家切牌'''
         player = self.player[player_index]
-        if not tile_type and not discard_draw:
+        if tile_type is None and not discard_draw:
             raise DiscardException(f"切牌信息不足，切牌失败。")
-        elif (discard_draw and player.draw==tile_type) or (discard_draw and not tile_type and player.draw):
+        elif discard_draw and player.draw is not None and (tile_type is None or player.draw==tile_type):
             player.discard.append((player.draw, False))
             tile_type = player.draw
-        elif discard_draw and not tile_type and player.draw:
-            tile_type = player.close.pop()
+        elif discard_draw and tile_type is None:
+            tile_type = player.pop_close()
             player.discard.append((tile_type, True))
-            logger.debug("玩家默认切牌且draw区为空，已自动切手牌。")
+            self.log.debug("玩家序号【{player_index}】默认切牌且draw区为空，已自动切手牌。", player_index=player_index)
+        elif player.close_count[tile_type]:
+            player.discard.append((tile_type, True))
+            i = player.close.index(tile_type)
+            if player.draw is not None: # 摸了牌的情况
+                player.replace_close(i, player.draw)
+            else: # 没摸牌的情况
+                player.remove_close(tile_type)
         else:
-            flag = False
-            for i, tile in enumerate(player.close):
-                if tile==tile_type:
-                    flag = True
-                    player.discard.append((tile_type, True))
-                    if player.draw: # 摸了牌的情况
-                        player.close[i] = player.draw
-                    else: # 没摸牌的情况
-                        player.close.pop(i)
-                    break
-            if not flag:
-                tile_type = player.close.pop()
+            if player.draw is not None:
+                tile_type = player.draw
+                player.discard.append((tile_type, False))
+            else:
+                tile_type = player.pop_close()
                 player.discard.append((tile_type, True))
-                logger.error("玩家选择切牌错误，已自动切手牌。")
+            self.log.error("玩家序号【{player_index}】选择切牌错误，已自动切牌。", player_index=player_index)
         player.draw = None
+        if self.match_log is not None:
+            self.match_log.discard(player_index, tile_type, player.discard[-1][1])
         return tile_type
 
-    def chi(self, player_index:int, target_player_index:int, tile_type:str, tiles:tuple[str,str]):
+    def chi(self, player_index:int, target_player_index:int, tile_type:Tile, tiles:tuple[Tile,Tile]):
         '''吃'''
         player = self.player[player_index]
         target_player_index = player_index-1 if player_index else MATCH_PLAYER_COUNT-1
         if len(tiles) != 2:
             raise ChiException(f"指定吃牌数量错误，长度应为2，而现在为{len(tiles)}。")
-        for tile in tiles:
-            if tile not in player.close:
-                raise ChiException(f"所指定吃牌在手牌中不存在，出错吃牌：{tiles}，手牌：{player.close}。")
+        if tile_type is None or None in tiles:
+            raise ChiException("所指定吃牌无法识别。")
+        if tiles[0]==tiles[1] or not all(player.close_count[tile] for tile in tiles):
+            raise ChiException(f"所指定吃牌在手牌中不存在，出错吃牌：{[tile_to_str(tile) for tile in tiles]}，手牌：{[tile_to_str(tile) for tile in player.close]}。")
         if self.player[target_player_index].discard[-1][0] != tile_type:
-            raise ChiException(f"所吃牌不同于指定吃牌，将吃的牌为{self.player[target_player_index].discard[-1][0]}，而指定的牌为{tile_type}。")
+            raise ChiException(f"所吃牌不同于指定吃牌，将吃的牌为{tile_to_str(self.player[target_player_index].discard[-1][0])}，而指定的牌为{tile_to_str(tile_type)}。")
         temp_tiles = sorted([*tiles, tile_type])
-        if len(set([tile[1] for tile in temp_tiles]))!=1 or int(temp_tiles[0][0])+1!=int(temp_tiles[1][0]) or int(temp_tiles[1][0])+1!=int(temp_tiles[2][0]):
-            raise ChiException(f"所指定吃牌条件不成立，出错吃牌面子：{temp_tiles}。")
+        if suit_of(temp_tiles[0])!=suit_of(temp_tiles[2]) or temp_tiles[0]+1!=temp_tiles[1] or temp_tiles[1]+1!=temp_tiles[2]:
+            raise ChiException(f"所指定吃牌条件不成立，出错吃牌面子：{[tile_to_str(tile) for tile in temp_tiles]}。")
         self.player[target_player_index].discard.pop()
         for tile in tiles:
-            player.close.remove(tile)
+            player.remove_close(tile)
         player.open.append(("chi", *temp_tiles))
+        if self.match_log is not None:
+            self.match_log.chi(player_index, target_player_index, temp_tiles)
         self._turn_change(cur_turn=player_index)
 
-    def pon(self, player_index:int, target_player_index:int, tile_type:str):
+    def pon(self, player_index:int, target_player_index:int, tile_type:Tile):
         '''碰'''
         player = self.player[player_index]
+        if tile_type is None:
+            raise PonException("所指定碰牌无法识别。")
         if self.player[target_player_index].discard[-1][0] != tile_type:
-            raise PonException(f"所碰牌不同于指定吃牌，将碰的牌为{self.player[target_player_index].discard[-1][0]}，而指定的牌为{tile_type}。")
-        if player.close.count(tile_type) < 2:
-            raise PonException(f"所指定碰牌条件不成立，出错碰牌：{tile_type}，手牌：{player.close}。")
+            raise PonException(f"所碰牌不同于指定吃牌，将碰的牌为{tile_to_str(self.player[target_player_index].discard[-1][0])}，而指定的牌为{tile_to_str(tile_type)}。")
+        if player.close_count[tile_type] < 2:
+            raise PonException(f"所指定碰牌条件不成立，出错碰牌：{tile_to_str(tile_type)}，手牌：{[tile_to_str(tile) for tile in player.close]}。")
         self.player[target_player_index].discard.pop()[0]
-        player.close.remove(tile_type)
-        player.close.remove(tile_type)
+        player.remove_close(tile_type, 2)
         player.open.append(("pon", *[tile_type for _ in range(3)]))
+        if self.match_log is not None:
+            self.match_log.pon(player_index, target_player_index, tile_type)
         self._turn_change(cur_turn=player_index)
 
-    def kan(self, player_index:int, tile_type:str, kan_type:Literal["concealed","exposed","extended"], target_player_index:Optional[int]=None):
+    def kan(self, player_index:int, tile_type:Tile, kan_type:Literal["concealed","exposed","extended"], target_player_index:Optional[int]=None):
         '''杠'''
         player = self.player[player_index]
+        if tile_type is None:
+            raise KanException("所指定杠牌无法识别。")
         if kan_type=='concealed':
-            if player.draw == tile_type and player.close.count(tile_type) == 3:
+            if player.draw == tile_type and player.close_count[tile_type] == 3:
                 player.draw = None
-                for _ in range(3):
-                    player.close.remove(tile_type)
+                player.remove_close(tile_type, 3)
                 player.open.append(("con_kan", *[tile_type for _ in range(4)]))
-            elif player.draw != tile_type and player.close.count(tile_type) == 4:
-                for _ in range(4):
-                    player.close.remove(tile_type)
+            elif player.draw != tile_type and player.close_count[tile_type] == 4:
+                player.remove_close(tile_type, 4)
                 self._draw_to_close(player_index)
                 player.open.append(("con_kan", *[tile_type for _ in range(4)]))
             else:
                 raise KanException("暗杠条件不成立，请检查杠牌模式是否选择错误。")
         elif kan_type=='exposed' and target_player_index!=None:
             if self.player[target_player_index].discard[-1][0] != tile_type:
-                raise KanException(f"明杠条件不成立，所杠牌不同于指定的牌。将杠的牌为{self.player[target_player_index].discard[-1][0]}，而指定的牌为{tile_type}。")
-            if player.close.count(tile_type) != 3:
-                raise KanException(f"手牌中将要杠的牌不为3张，将杠的牌为{tile_type}，而手牌为{player.close}。")
+                raise KanException(f"明杠条件不成立，所杠牌不同于指定的牌。将杠的牌为{tile_to_str(self.player[target_player_index].discard[-1][0])}，而指定的牌为{tile_to_str(tile_type)}。")
+            if player.close_count[tile_type] != 3:
+                raise KanException(f"手牌中将要杠的牌不为3张，将杠的牌为{tile_to_str(tile_type)}，而手牌为{[tile_to_str(tile) for tile in player.close]}。")
             self.player[target_player_index].discard.pop()
-            for _ in range(3):
-                player.close.remove(tile_type)
+            player.remove_close(tile_type, 3)
             player.open.append(("exp_kan", *[tile_type for _ in range(4)]))
         elif kan_type=='extended':
-            temp_close = player.close + [player.draw]
-            if tile_type not in temp_close:
+            if player.draw != tile_type and not player.close_count[tile_type]:
                 raise KanException("加杠缺少所指定的牌。")
             flag = False
-            for open in player.open:
+            for i, open in enumerate(player.open):
                 if open[0]=='pon' and open[1]==tile_type:
                     if player.draw == tile_type:
                         player.draw = None
                     else:
-                        player.close.remove(tile_type)
-                    open = ["exp_kan", *[tile_type for _ in range(4)]]
+                        player.remove_close(tile_type)
+                    player.open[i] = ("exp_kan", *[tile_type for _ in range(4)])
                     flag = True
                     break
             if not flag:
                 raise KanException("未找到可加杠的副露碰牌。")
         else:
             raise KanException(f"所指定杠牌类型错误，类型应为concealed, exposed, extended其一，而非{kan_type}。")
+        if self.match_log is not None:
+            self.match_log.kan(player_index, tile_type, kan_type, target_player_index)
         self.turn = player_index
         
-    def win(self, player_index:int, tile_type:str, target_player_index:Optional[int]=None):
+    def win(self, player_index:int, tile_type:Tile, target_player_index:Optional[int]=None):
         '''玩家和牌'''
         player = self.player[player_index]
-        from collections import Counter
-        all_close = Counter(player.close+[tile_type])
-        posible = []
-        def get_next_tile(tile:str)->str:
-            num = int(tile[0])
-            if num==9:
-                return ''
-            else:
-                return str(num+1)+tile[1]
-        def get_last_tile(tile:str)->str:
-            num = int(tile[0])
-            if num==1:
-                return ''
-            else:
-                return str(num-1)+tile[1]
-        def dfs(last_close:Counter[str], temp_tiles:list[tuple[str]]):
-            nonlocal posible
-            # 边界条件，只剩雀头或不合法
-            if sum(last_close.values()) <= 2:
-                for k,v in last_close.items():
-                    if v==2:
-                        posible.append(temp_tiles+[[k]*2])
-                        break
-                return
-            # 递归求所有拆牌可能性
-            for k,v in last_close.items():
-                # 以k成刻子
-                if v>=3:
-                    new_close = last_close.copy()
-                    new_close[k] -= 3
-                    dfs(last_close=new_close, temp_tiles=temp_tiles+[(k)*3])
-                # 以k为中心的顺子
-                if v and last_close[get_last_tile(k)] and last_close[get_next_tile(k)]:
-                    new_close = last_close.copy()
-                    new_close[k] -= 1
-                    new_close[get_last_tile(k)] -= 1
-                    new_close[get_next_tile(k)] -= 1
-                    dfs(last_close=new_close, temp_tiles=temp_tiles+[(get_last_tile(k), k, get_next_tile(k))])
-            return
-        dfs(all_close, [])
-        win_result = []
-        # 清一色最后统一检查
-        # 七对子检查
-        if not player.open:
-            flag = 1
-            for k,v in all_close.items():
-                if v%2:
-                    flag = 0
-                    break
-            if flag:
-                win_result.append([12,["七对子"]])
-        # 常规和牌番数计算
-        def check_win(tiles:list[tuple[str]]) -> list:
-            res = [3, ["素和"]]
-            # 基本和检查（全是顺子）
-            flag = 1
-            for tile in tiles:
-                if len(tile)!=2 and len(set(tile)) == 1:
-                    flag = 0
-                    break
-            if flag:
-                res[0] += 3
-                res[1].append("基本和")
-            # 对对和检查（全是顺子）
-            flag = 1
-            for tile in tiles:
-                if len(tile)!=2 and len(set(tile)) != 1:
-                    flag = 0
-                    break
-            if flag:
-                res[0] += 5
-                res[1].append("对对和")
-            return res
-        for tiles in posible:
-            all_tile = tiles+player.open
-            res = check_win(all_tile)
-            win_result.append(res)
-        # 清一色检查
-        all_tiles = player.close+[tile_type]
-        for open_tiles in player.open:
-            all_tiles.extend(open_tiles)
-        color_cnt = Counter(tile[1] for tile in all_tiles)
-        if len(color_cnt) == 1:
-            for win in win_result:
-                win[0] += 9
-                win[1].append("清一色")
-        # 最终选择
-        win_result.sort(reverse=True)
+        if tile_type is None:
+            raise WinException("所指定和牌无法识别。")
+        counts = player.close_count.copy()
+        counts[tile_type] += 1
+        win_result = hand_evaluator.evaluate(counts, player.open)
         if not win_result:
             raise WinException("牌型未构成和牌")
         self.result = {
@@ -531,9 +506,24 @@ class Match:
             "winner_index": player_index,
             "loser_index": target_player_index
         }
+        if self.match_log is not None:
+            self.match_log.result(self.result)
         raise MatchEndedException("玩家和牌，牌局结束")
 
 
+    def visible_count(self, player_index:int) -> list[int]:
+        '''指定玩家手牌以外已见牌的27格计数向量，包括所有牌河与副露'''
+        counts = [0]*TILE_KINDS
+        for player in self.player:
+            for tile, _ in player.discard:
+                counts[tile] += 1
+            for meld in player.open:
+                if meld[0] == "con_kan" and player.player_index != player_index:
+                    continue
+                for tile in meld[1:]:
+                    counts[tile] += 1
+        return counts
+
     def _turn_change(self, cur_turn:int=None, next_turn:int=None):
         '''将turn转到下一位玩家，如果提供了cur_turn则为其下一位，如果提供了next_turn则为其'''
         if cur_turn!=None:
@@ -546,18 +536,16 @@ class Match:
     def _draw_to_close(self, player_index:int):
         '''将摸牌放入手牌中'''
         player = self.player[player_index]
-        if player.draw:
-            player.close.append(self.player[player_index].draw)
+        if player.draw is not None:
+            player.add_close(player.draw)
             player.draw = None
 
-    def _shuffle_deck(self, rand_seed:Optional[int]=None):
-        self.rand_seed = rand_seed
-        random.seed(rand_seed)
-        temp_deck = [f"{num}{color}" for _ in range(4) for num in range(1,10) for color in "msp"]
-        random.shuffle(temp_deck)
+    def _shuffle_deck(self):
+        temp_deck = INITIAL_DECK.copy()
+        self.rng.shuffle(temp_deck)
         # 双人测试牌堆
-        # temp_deck = ["1m", "1m", "2m", "2m", "3m", "4m", "5s", "5s", "3m", "3p", "3p", "4p", "5m", "3p", "7s", "8s", "4p", "5s", "5s", "6s", "9s", "6s", "5s", "4s", "6s", "3s", "5m", "9s", "3m", "4s", "9s", "9s"]
-        self.hash = md5(''.join(temp_deck).encode()).hexdigest()
+        # temp_deck = [tile_from_str(tile) for tile in ["1m", "1m", "2m", "2m", "3m", "4m", "5s", "5s", "3m", "3p", "3p", "4p", "5m", "3p", "7s", "8s", "4p", "5s", "5s", "6s", "9s", "6s", "5s", "4s", "6s", "3s", "5m", "9s", "3m", "4s", "9s", "9s"]]
+        self.hash = md5(''.join(tile_to_str(tile) for tile in temp_deck).encode()).hexdigest()
         self.initial_deck = temp_deck
         self.deck = deque(temp_deck)
 
@@ -575,74 +563,101 @@ class Match:
 @dataclass(unsafe_hash=False)
 class Table:
     '''牌桌类，控制牌局开始和进行节奏，与用户交流'''
-    static_code:int = 1
-    table_code:str = field(default_factory=lambda:f"{Table.static_code:04}")
+    table_code:str = ""
+    '''4位牌桌号，由牌桌管理器分配'''
     player:list[Player] = field(default_factory=list)
     match:Match=None
     player_in_match:list[PlayerInMatch] = field(default_factory=list)
     player_request:list[Optional[dict]] = field(default_factory=lambda:[{} for _ in range(MATCH_PLAYER_COUNT)])
+    auto_play_policy:AutoPlayPolicy = field(default_factory=lambda:DEFAULT_POLICY)
+    player_changed:asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+    '''玩家加入或退出时触发，唤醒等待人数的主流程'''
+    wait_expired:bool = False
+    '''等待人数是否已超时'''
+    streams:list[EventStream] = field(default_factory=list)
+    '''各座位玩家的牌局事件流'''
+    _hall_dict:Optional[dict] = field(default=None, repr=False)
+    '''大厅列表中本牌桌信息的缓存'''
+    _waited:float = field(default=0, repr=False)
+    '''等待玩家与嵌套处理的累计耗时（秒），处理函数耗时从中扣除这部分，只统计自身的处理'''
+    rand_seed:Optional[int] = None
+    '''牌局随机种子，为None时随机生成'''
+    autostart:bool = field(default=True, repr=False)
+    '''创建后是否立即启动主流程，为False时由调用方直接驱动run，如基准测试'''
 
     def __post_init__(self):
-        Table.static_code += 1
-        asyncio.create_task(self.main())
+        if self.autostart:
+            asyncio.create_task(self.main())
+
+    @property
+    def log(self):
+        '''绑定了牌桌号的日志记录器，DEBUG日志按牌桌抽样'''
+        log = self.__dict__.get("_log")
+        if log is None:
+            log = self.__dict__["_log"] = table_logger(self.table_code)
+        return log
 
     async def main(self):
-        # 每秒检查人数
-        time_limit = TABLE_WAIT_TIME # 等待时间限制
-        while time_limit>0:
-            await asyncio.sleep(1)
-            time_limit -= 1
-            if len(self.player) == MATCH_PLAYER_COUNT:
-                break
-        if not time_limit:
+        # 等待人数达到目标，超时由共享定时器触发
+        timer = scheduler.call_later(TABLE_WAIT_TIME, self._on_wait_timeout)
+        while len(self.player) < MATCH_PLAYER_COUNT and not self.wait_expired:
+            self.player_changed.clear()
+            await self.player_changed.wait()
+        timer.cancel()
+        if len(self.player) < MATCH_PLAYER_COUNT:
             await self.dismiss("在限制时间内人数不足，牌桌被解散。")
             return
-        logger.debug(f"牌桌【{self.table_code}】检查到人数已达目标，发送准备请求。")
+        self.log.debug("检查到人数已达目标，发送准备请求。")
         # 准备阶段
         await self.ready()
         if not (len(self.player) == MATCH_PLAYER_COUNT and all(req and req.get("type")=="ready" for req in self.player_request)):
             await self.dismiss("有玩家没有准备，牌桌被解散。")
             return
-        logger.debug(f"牌桌【{self.table_code}】准备完毕。")
+        self.log.debug("准备完毕。")
         self.player_request = [{} for _ in range(MATCH_PLAYER_COUNT)]
         res = await self.run()
-        await self.send_public_message({
+        if self.match.match_log is not None:
+            match_log_writer.submit(self.match.match_log)
+        await self.send_public_event({
             "type": "end",
             "data": res
         })
         # 用户成绩变更
-        logger.debug(f"牌桌【{self.table_code}】牌局结束，准备更新玩家分数。")
-        logger.debug(f"牌桌【{self.table_code}】牌局结果如下\n{res}")
+        self.log.debug("牌局结束，牌局结果如下\n{result}", result=res)
         if res.get("end_type") == "zimo":
             score = res.get("score", 0)
-            winner_index = res.get("winner")
+            winner_index = res.get("winner_index")
             for i in range(MATCH_PLAYER_COUNT):
                 if i == winner_index:
                     self.player_in_match[i].score += 3*score
-                    logger.debug(f"序号【{i}】的玩家【{self.player_in_match[i].user_id}】分数 +3*{score}.")
                 else:
                     self.player_in_match[i].score -= score
-                    logger.debug(f"序号【{i}】的玩家【{self.player_in_match[i].user_id}】分数 -{score}.")
-            logger.debug(f"牌局结束，序号【{winner_index}】的玩家【{self.player_in_match[i].user_id}】{'自摸' if res.get('end_type') == 'zimo' else '荣和'}获胜【{score}*3】点数。")
+            self.log.debug("序号【{winner_index}】的玩家【{user_id}】自摸获胜【{score}*3】点数。",
+                winner_index=winner_index, user_id=self.player_in_match[winner_index].user_id, score=score)
         elif res.get("end_type") == "ron":
             score:int = res.get("score", 0)
             winner_index:int = res.get("winner_index")
             loser_index:int = res.get("loser_index")
             self.player_in_match[winner_index].score += score
-            logger.debug(f"序号【{winner_index}】的玩家【{self.player_in_match[winner_index].user_id}】分数 +{score}.")
             self.player_in_match[loser_index].score -= score
-            logger.debug(f"序号【{loser_index}】的玩家【{self.player_in_match[loser_index].user_id}】分数 -{score}.")
-            logger.debug(f"牌局结束，序号【{winner_index}】的玩家【{self.player_in_match[winner_index].user_id}】{'自摸' if res.get('end_type') == 'zimo' else '荣和'}获胜【{score}*3】点数。")
+            self.log.debug("序号【{winner_index}】的玩家【{user_id}】荣和序号【{loser_index}】获胜【{score}】点数。",
+                winner_index=winner_index, user_id=self.player_in_match[winner_index].user_id, loser_index=loser_index, score=score)
         else:
-            logger.debug(f"牌局结束，荒牌流局。")
+            self.log.debug("牌局结束，荒牌流局。")
+        # 分数先写入本地日志，稍后批量写入数据库
         for i in range(MATCH_PLAYER_COUNT):
-            await self.player[i].update_score(self.player_in_match[i].score)
-        logger.info(f"牌桌【{self.table_code}】牌局结束，桌内玩家分数已更新。")
+            self.player[i].total_score = self.player_in_match[i].score
+        await player_manager.save_scores(self.player)
+        self.log.info("牌局结束，桌内玩家分数已更新。")
         # 牌桌解散
         await self.dismiss("牌局结束，牌桌解散。", False)
         return
 
 
+    def _on_wait_timeout(self):
+        self.wait_expired = True
+        self.player_changed.set()
+
     async def dismiss(self, reason:str="", send_msg:bool=True):
         if send_msg:
             await self.send_public_message(
@@ -652,7 +667,7 @@ class Table:
                 })
         tasks = [asyncio.create_task(table_manager.exit_table(self.table_code, player.user_id, True)) for player in self.player]
         await asyncio.gather(*tasks)
-        logger.debug(f"牌桌【{self.table_code}】被解散，原因是【{reason}】。")
+        self.log.debug("牌桌被解散，原因是【{reason}】。", reason=reason)
         table_manager._remove_table(self)
 
 
@@ -662,6 +677,21 @@ class Table:
             "players":[player.to_dict() for player in self.player],
             "if_start":bool(self.match)
         }
+
+    def hall_dict(self) -> dict:
+        '''大厅列表使用的牌桌信息，牌桌变化前重复使用'''
+        if self._hall_dict is None:
+            self._hall_dict = self.to_dict()
+        return self._hall_dict
+
+    def status(self) -> str:
+        '''牌桌状态，为waiting或playing'''
+        return "playing" if self.match else "waiting"
+
+    def touch(self):
+        '''牌桌人员或状态变化，使大厅列表缓存失效'''
+        self._hall_dict = None
+        table_manager.invalidate_hall()
     
     async def join(self, user_id:str):
         if len(self.player) >= MATCH_PLAYER_COUNT:
@@ -672,30 +702,23 @@ class Table:
         if not player.if_in_table():
             player.join_table(self.table_code)
             self.player.append(player_manager.get_online_player(user_id))
+            self.player_changed.set()
+            self.touch()
             await self.send_public_message({
                 "type":"join",
                 "data":self.player[-1].to_dict()
             }, len(self.player)-1)
-            logger.debug(f"玩家【{user_id}】加入房间【{self.table_code}】。")
+            self.log.debug("玩家【{user_id}】加入房间。", user_id=user_id)
         else:
-            # 发送牌局当前信息
-            if self.match:
-                tasks = [asyncio.create_task(self.send_private_message({
-                        "type": "update_info",
-                        "data": {
-                            "self":self.player_in_match[i].to_dict(), 
-                            "table":[player.to_public_dict() for player in self.player_in_match]},
-                            "rest_tile":len(self.match.deck)
-                    }, i)) for i in range(MATCH_PLAYER_COUNT)]
-                await asyncio.gather(*tasks)
-            logger.debug(f"玩家【{user_id}】重连房间【{self.table_code}】。")
+            # 牌局快照在WebSocket连接建立后发送，见_connect_handler
+            self.log.debug("玩家【{user_id}】重连房间。", user_id=user_id)
     
     async def ready(self):
         await asyncio.sleep(3) # 等待最后一名玩家的WebSocket连接
         await self.send_public_message({
             "type":"can_ready"
         })
-        logger.debug("等待玩家准备中...")
+        self.log.debug("等待玩家准备中...")
         tasks = [asyncio.create_task(self.wait_for_player(i, READY_TIMEOUT)) for i in range(MATCH_PLAYER_COUNT)]
         await asyncio.gather(*tasks)
 
@@ -707,143 +730,188 @@ class Table:
             raise PlayerExitException(401, "牌局未结束，无法正常退出")
         await player.exit_table()
         self.player.remove(player)
+        self.player_changed.set()
+        self.touch()
         if self.player:
             await self.send_public_message({
                 "type":"exit",
                 "data":self.player[-1].to_dict()
             })
-        logger.info(f"玩家【{user_id}】退出房间【{self.table_code}】。")
+        self.log.info("玩家【{user_id}】退出房间。", user_id=user_id)
 
 
     def _init_match(self, rand_seed:int=None):
-        '''初始化牌桌'''
-        random.shuffle(self.player)
-        self.match=Match(self.player, rand_seed)
+        '''初始化牌桌，座次与牌堆均由牌局自身的随机数生成器决定'''
+        self.match=Match(self.player, rand_seed, shuffle_seats=True, log=self.log)
+        self.player=[self.player[seat] for seat in self.match.seat_order]
         self.player_in_match=self.match.player
-        logger.info(f"牌桌【{self.table_code}】初始化完成，哈希值为【{self.match.hash}】。")
+        self.touch()
+        self.log.info("牌桌初始化完成，哈希值为【{hash}】，随机种子为【{rand_seed}】。", hash=self.match.hash, rand_seed=self.match.rand_seed)
     
     async def run(self) -> dict:
         '''牌局进行'''
         # 初始化牌桌
-        self._init_match()
-        # 发送初始牌桌信息
-        tasks = [asyncio.create_task(self.send_private_message({
-                "type": "init_info",
-                "data": {
-                    "self":self.player_in_match[i].to_dict(), 
-                    "table":[player.to_public_dict() for player in self.player_in_match]},
-                    "rest_tile":len(self.match.deck)
-            }, i)) for i in range(MATCH_PLAYER_COUNT)]
+        self._init_match(self.rand_seed)
+        self.streams = [EventStream() for _ in range(MATCH_PLAYER_COUNT)]
+        # 发送初始牌桌快照，此后只发送增量事件
+        tasks = [asyncio.create_task(self.send_private_message(self.snapshot(i, "init_info"), i)) for i in range(MATCH_PLAYER_COUNT)]
         await asyncio.gather(*tasks)
-        logger.debug(f"牌桌【{self.table_code}】初始化完成，已向玩家发送初始信息。")
+        self.log.debug("已向玩家发送初始信息。")
         # 牌局正常进行
         while not self.match.result:
-            tasks = [asyncio.create_task(self.send_private_message({
-                    "type": "update_info",
-                    "data": {
-                        "self":self.player_in_match[i].to_dict(), 
-                        "table":[player.to_public_dict() for player in self.player_in_match]},
-                        "rest_tile":len(self.match.deck)
-                }, i)) for i in range(MATCH_PLAYER_COUNT)]
-            await asyncio.gather(*tasks)
             # 摸牌
             try:
                 draw_player_index, draw_tile = self.match.draw()
             except MatchEndedException:
-                logger.debug(f"牌桌【{self.table_code}】在摸牌时检测到牌局结束。")
+                self.log.debug("在摸牌时检测到牌局结束。")
                 break
-            await self.send_private_message({
+            await self.send_event({
                 "type":"draw_self",
-                "data":{"tile":draw_tile}
+                "data":{"tile":tile_to_str(draw_tile), "rest_tile":len(self.match.deck)}
             }, draw_player_index)
-            await self.send_public_message({
+            await self.send_public_event({
                 "type":"draw_other",
-                "data":{"player_index":draw_player_index}
+                "data":{"player_index":draw_player_index, "rest_tile":len(self.match.deck)}
             }, draw_player_index)
             # 摸牌玩家检测，进行操作。操作所引发的其他操作均在对应函数中进行
             await self.check_player_action_option(draw_player_index, new=draw_tile, need_discard=True)
             try:
                 await self.handle_player_request(draw_player_index, "discard")
             except MatchEndedException:
-                logger.debug(f"牌桌【{self.table_code}】在玩家操作时检测到牌局结束。")
+                self.log.debug("在玩家操作时检测到牌局结束。")
                 break
             except:
-                logger.error(f"牌桌【{self.table_code}】在处理玩家操作时出错，可能是操作不合法，已忽略。")
+                self.log.error("在处理玩家操作时出错，可能是操作不合法，已忽略。")
                 continue
         return self.match.result
 
-    async def check_player_action_option(self, player_index:int, target_player_index:int=None, new:str=None, need_discard=False, only_discard=False):
-        logger.debug(f"牌桌【{self.table_code}】开始检查玩家序号【{player_index}】可选操作，参数为player_index={player_index}, target_player_index={target_player_index}, new={new}, need_discard={need_discard}, only_discard={only_discard}...")
-        option = self.match.player[player_index].action_check(new=new, target_player_index=target_player_index, need_discard=need_discard, only_discard=only_discard)
-        logger.debug(f"牌桌【{self.table_code}】检查到玩家序号【{player_index}】可选操作如下：{option}")
+    async def check_player_action_option(self, player_index:int, target_player_index:int=None, new:Optional[Tile]=None, need_discard=False, only_discard=False, option:Optional[list[dict]]=None, arbiter:Optional[ClaimArbiter]=None):
+        '''
+        检查玩家可选操作并等待其选择
+        :param option: 已计算好的可选操作，为None时在此计算
+        :param arbiter: 鸣牌仲裁，玩家作出选择后提交给仲裁
+        '''
+        if option is None:
+            self.log.debug("开始检查玩家序号【{player_index}】可选操作，参数为target_player_index={target_player_index}, new={new}, need_discard={need_discard}, only_discard={only_discard}...",
+                player_index=player_index, target_player_index=target_player_index, new=new, need_discard=need_discard, only_discard=only_discard)
+            option = self.match.player[player_index].action_check(new=new, target_player_index=target_player_index, need_discard=need_discard, only_discard=only_discard)
+        self.log.debug("检查到玩家序号【{player_index}】可选操作如下：{option}", player_index=player_index, option=option)
         if option:
-            await self.send_private_message({
-                "type":"action_choose",
-                "data":{"action":option}
-            }, player_index)
-            await self.wait_for_player(player_index, THINKING_TIME_LIMIT)
-
-    async def wait_for_player(self, player_index:int, timeout:int):
-        '''等待用户发来请求'''
-        logger.debug(f"牌桌【{self.table_code}】开始等待玩家序号【{player_index}】的响应。")
+            # 断线玩家直接托管，不等待
+            if self.player[player_index].ws is None:
+                self.player_request[player_index] = self.auto_play_policy.choose(self.match, player_index, option)
+                AUTO_PLAYS.labels("offline").inc()
+                self.log.debug("玩家序号【{player_index}】不在线，托管操作为：{request}", player_index=player_index, request=self.player_request[player_index])
+            else:
+                # 此前收到的消息都不是对本次操作选择的回应，如已取消的鸣牌等待迟到的回应
+                self.player[player_index].clear_inbox()
+                prompt_seq = await self.send_event({
+                    "type":"action_choose",
+                    "data":{"action":[action_to_str(action) for action in option]}
+                }, player_index)
+                await self.wait_for_player(player_index, THINKING_TIME_LIMIT, prompt_seq)
+                if not self.player_request[player_index]:
+                    self.player_request[player_index] = self.auto_play_policy.choose(self.match, player_index, option)
+                    AUTO_PLAYS.labels("no_response").inc()
+                    self.log.debug("玩家序号【{player_index}】未响应，托管操作为：{request}", player_index=player_index, request=self.player_request[player_index])
+            if arbiter:
+                arbiter.submit(player_index, self.player_request[player_index])
+
+    async def wait_for_player(self, player_index:int, timeout:int, prompt_seq:Optional[int]=None):
+        '''
+        等待用户发来请求
+        :param prompt_seq: 所等待回应的操作选择的seq，回应带有其他seq时视为对过期操作选择的回应并丢弃
+        '''
+        self.log.debug("开始等待玩家序号【{player_index}】的响应。", player_index=player_index)
+        countdown = await countdown_service.start(lambda msg:self.send_private_message(msg, player_index), timeout)
+        PENDING_WAITS.inc()
+        start = scheduler.time()
         try:
-            countdown_task = asyncio.create_task(self._wait_countdown(player_index, timeout-1))
-            self.player_request[player_index] = await asyncio.wait_for(self.player[player_index].ws.receive_json(), timeout)
-            logger.debug(f"收到序号【{player_index}】玩家的请求如下\n{self.player_request[player_index]}")
+            self.player_request[player_index] = await asyncio.wait_for(self._receive_reply(player_index, prompt_seq), timeout)
+            self.log.debug("收到序号【{player_index}】玩家的请求如下\n{request}", player_index=player_index, request=self.player_request[player_index])
         except asyncio.TimeoutError:
-            logger.debug(f"牌桌【{self.table_code}】等待玩家序号【{player_index}】超时。")
+            WAIT_TIMEOUTS.inc()
+            self.log.debug("等待玩家序号【{player_index}】超时。", player_index=player_index)
         except Exception as e:
-            logger.error(f"牌桌【{self.table_code}】有牌桌成员断线，为其采用默认行为托管...错误类型为{e}。")
-        countdown_task.cancel()
-        
-    async def _wait_countdown(self, player_index:int, timeout:int):
-        '''进行倒计时'''
-        for time in range(timeout, -1, -1):
-            if self.player_request[player_index]:
-                return
-            else:
-                await self.send_private_message({
-                    "type":"countdown",
-                    "data":{"count":time}
-                }, player_index)
-                await asyncio.sleep(1)
+            self.log.error("有牌桌成员断线，为其采用默认行为托管...错误类型为{error!r}。", player_index=player_index, error=e)
+        finally:
+            waited = scheduler.time()-start
+            WAIT_LATENCY.observe(waited)
+            self._waited += waited
+            PENDING_WAITS.dec()
+            countdown_service.stop(countdown)
 
-    def compare_player_requests(self) -> Optional[int]:
-        '''比较不同玩家请求优先级，返回应处理玩家下标，None则为无操作'''
-        logger.debug(f"牌桌【{self.table_code}】开始比较不同玩家的请求优先级...")
-        if not any(self.player_request):
-            logger.debug(f"牌桌【{self.table_code}】玩家请求均为空，已取消比较。")
-            return
-        por = {"win":10, "discard":9, "kan":8, "pon":7, "chi":6, "cancel":0}
-        index, max_por = None, 0
-        for i, request in enumerate(self.player_request):
-            if request:
-                if por[request.get("type", "cancel")] > max_por:
-                    index = i
-                    max_por = por[request.get("type", "cancel")]
-        for i in range(MATCH_PLAYER_COUNT):
-            if i==index:
-                continue
-            self.player_request[i] = {}
-        if index!= None:
-            logger.debug(f"牌桌【{self.table_code}】比较得最高优先级的请求为序号【{index}】请求：{self.player_request[index]}")
-        else:
-            logger.debug(f"牌桌【{self.table_code}】比较可知没有应处理的请求，已返回 None.")
-        return index
+    async def _receive_reply(self, player_index:int, prompt_seq:Optional[int]) -> dict:
+        '''读取玩家的下一条回应，丢弃带有其他seq的过期回应，不带seq的回应照常接受'''
+        while True:
+            request = await self.player[player_index].receive()
+            seq = request.get("seq")
+            if prompt_seq is None or seq is None or seq == prompt_seq:
+                return request
+            self.log.debug("玩家序号【{player_index}】的回应对应已过期的操作选择【seq={seq}】，已丢弃。", player_index=player_index, seq=seq)
+
+    async def arbitrate_claims(self, player_index:int, tile:Tile) -> Optional[int]:
+        '''
+        对切出的牌进行鸣牌仲裁，已无人能胜过当前最佳请求时立即裁决并取消其余玩家的等待
+        :rtype: 应处理的玩家下标，None则为无操作
+        '''
+        # 各玩家的等待并行进行，整个仲裁按一段等待计入，不累加各玩家的等待
+        waited, start = self._waited, scheduler.time()
+        try:
+            return await self._arbitrate_claims(player_index, tile)
+        finally:
+            self._waited = waited+scheduler.time()-start
+
+    async def _arbitrate_claims(self, player_index:int, tile:Tile) -> Optional[int]:
+        arbiter = ClaimArbiter()
+        for index in range(MATCH_PLAYER_COUNT):
+            if index != player_index:
+                arbiter.offer(index, self.match.player[index].action_check(new=tile, target_player_index=player_index))
+        arbiter.open()
+        tasks = {index:asyncio.create_task(self.check_player_action_option(index, player_index, tile, option=options, arbiter=arbiter))
+                 for index, options in arbiter.options.items()}
+        if tasks:
+            # 仲裁完成或所有玩家都已响应时结束等待
+            waiter = asyncio.create_task(arbiter.wait())
+            pending = set(tasks.values())
+            while pending and not arbiter.resolved.is_set():
+                _, pending = await asyncio.wait(pending | {waiter}, return_when=asyncio.FIRST_COMPLETED)
+                pending.discard(waiter)
+            waiter.cancel()
+        cancelled = [index for index, task in tasks.items() if not task.done()]
+        for index in cancelled:
+            tasks[index].cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        if cancelled:
+            self.log.debug("鸣牌仲裁提前完成，已取消玩家序号{cancelled}的等待。", cancelled=cancelled)
+            await asyncio.gather(*[self.send_event({"type":"action_close"}, index) for index in cancelled])
+        for index in range(MATCH_PLAYER_COUNT):
+            if index != arbiter.winner:
+                self.player_request[index] = {}
+        if arbiter.winner is not None:
+            self.player_request[arbiter.winner] = arbiter.requests[arbiter.winner]
+            self.log.debug("仲裁得最高优先级的请求为序号【{player_index}】请求：{request}", player_index=arbiter.winner, request=arbiter.requests[arbiter.winner])
+        return arbiter.winner
 
     async def handle_player_request(self, player_index:int, default_type:str="cancel"):
         '''对不同类型请求调用不同的处理函数'''
         method_name = f'_{self.player_request[player_index].get("type", default_type)}_handler'
         if hasattr(self, method_name):
-            logger.debug(f"牌桌【{self.table_code}】请求处理，为玩家使用【{method_name}】操作。")
+            self.log.debug("请求处理，为玩家序号【{player_index}】使用【{method}】操作。", player_index=player_index, method=method_name)
+            waited, start = self._waited, scheduler.time()
             try:
                 await self.__getattribute__(method_name)(player_index=player_index)
             except MatchEndedException as e:
                 raise e
             except Exception as e:
-                logger.error(f"用户调用【{method_name}】操作时出错，错误类型为{e}。")
+                self.log.error("玩家序号【{player_index}】调用【{method}】操作时出错，错误类型为{error!r}。", player_index=player_index, method=method_name, error=e)
+            finally:
+                # 扣除其中等待玩家与嵌套处理的时间；对外层处理函数而言，本次处理整体计为等待
+                elapsed = scheduler.time()-start
+                HANDLER_LATENCY.labels(method_name).observe(elapsed-(self._waited-waited))
+                self._waited = waited+elapsed
         else:
-            logger.error(f"未找到指定的type方法，所指定method_name为【{method_name}】，已忽略操作。")
+            self.log.error("未找到指定的type方法，所指定method_name为【{method}】，已忽略操作。", method=method_name)
         self.player_request[player_index] = {}
 
     async def _cancel_handler(self, player_index:int):
@@ -858,128 +926,238 @@ class Table:
                 "tile_type": "",
                 "discard_draw": True
             }
-        tile = self.match.discard(player_index, request.get("tile_type", ""), request.get("discard_draw", True))
+        tile_type, discard_draw = parse_tile(request.get("tile_type", "")), request.get("discard_draw", True)
+        if tile_type is None and request.get("tile_type"):
+            # 无法识别的牌按默认切牌处理，保证本巡一定切出一张牌
+            self.log.error("玩家序号【{player_index}】所切的牌【{tile}】无法识别，已自动切牌。", player_index=player_index, tile=request.get("tile_type"))
+            discard_draw = True
+        tile = self.match.discard(player_index, tile_type, discard_draw)
         self.player_request[player_index] = {}
-        await self.send_public_message({
+        await self.send_public_event({
             "type": "discard",
-            "tile_type": tile,
+            "tile_type": tile_to_str(tile),
             "player_index": player_index,
+            "hand_cut": self.match.player[player_index].discard[-1][1]
         })
-        logger.debug(f"牌桌【{self.table_code}】中玩家序号【{player_index}】的【切牌】操作完成，进行后续操作。")
-        tasks = [asyncio.create_task(self.check_player_action_option(index, player_index, tile, False)) for index in range(MATCH_PLAYER_COUNT) if index!=player_index]
-        await asyncio.gather(*tasks)
-        action_index = self.compare_player_requests()
+        self.log.debug("玩家序号【{player_index}】的【切牌】操作完成，进行后续操作。", player_index=player_index)
+        action_index = await self.arbitrate_claims(player_index, tile)
         if action_index!=None:
             try:
                 await self.handle_player_request(action_index, "cancel")
+            except MatchEndedException as e:
+                raise e
             except:
-                logger.error(f"牌桌【{self.table_code}】在处理玩家操作时出错，可能是操作不合法，已忽略。")
+                self.log.error("在处理玩家操作时出错，可能是操作不合法，已忽略。")
 
     async def _chi_handler(self, player_index:int):
         request = self.player_request[player_index]
         if not request:
             return
-        self.match.chi(player_index, request.get("target_player_index"), request.get("tile_type"), request.get("tiles"))
+        tile_type, tiles = parse_tile(request.get("tile_type")), [parse_tile(tile) for tile in request.get("tiles") or []]
+        self.match.chi(player_index, request.get("target_player_index"), tile_type, tiles)
         self.player_request[player_index] = {}
-        await self.send_public_message({
+        await self.send_public_event({
             "type": "chi",
-            "tiles": sorted([request.get("tile_type")]+request.get("tiles")),
+            "tiles": [tile_to_str(tile) for tile in sorted([tile_type]+tiles)],
             "player_index": player_index,
             "target_player_index": request.get("target_player_index")
         })
-        logger.debug(f"牌桌【{self.table_code}】中玩家序号【{player_index}】的【吃】操作完成，进行后续操作。")
+        self.log.debug("玩家序号【{player_index}】的【吃】操作完成，进行后续操作。", player_index=player_index)
         await self.check_player_action_option(player_index, only_discard=True)
         try:
             await self.handle_player_request(player_index, "discard")
         except:
-            logger.error(f"牌桌【{self.table_code}】在处理玩家操作时出错，可能是操作不合法，已忽略。")
+            self.log.error("在处理玩家操作时出错，可能是操作不合法，已忽略。")
 
 
     async def _pon_handler(self, player_index:int):
         request = self.player_request[player_index]
         if not request:
             return
-        self.match.pon(player_index, request.get("target_player_index"), request.get("tile_type"))
+        self.match.pon(player_index, request.get("target_player_index"), parse_tile(request.get("tile_type")))
         self.player_request[player_index] = {}
-        await self.send_public_message({
+        await self.send_public_event({
             "type": "pon",
             "tiles": [request.get("tile_type")]*3,
             "player_index": player_index,
             "target_player_index": request.get("target_player_index")
         })
-        logger.debug(f"牌桌【{self.table_code}】中玩家序号【{player_index}】的【碰】操作完成，进行后续操作。")
+        self.log.debug("玩家序号【{player_index}】的【碰】操作完成，进行后续操作。", player_index=player_index)
         await self.check_player_action_option(player_index, only_discard=True)
         try:
             await self.handle_player_request(player_index, "discard")
         except:
-            logger.error(f"牌桌【{self.table_code}】在处理玩家操作时出错，可能是操作不合法，已忽略。")
+            self.log.error("在处理玩家操作时出错，可能是操作不合法，已忽略。")
 
     async def _kan_handler(self, player_index:int):
         request = self.player_request[player_index]
         if not request:
             return
-        self.match.kan(player_index, request.get("tile_type"), request.get("kan_type"), request.get("target_player_index"))
+        self.match.kan(player_index, parse_tile(request.get("tile_type")), request.get("kan_type"), request.get("target_player_index"))
         self.player_request[player_index] = {}
-        await self.send_public_message({
+        await self.send_public_event({
             "type": "kan",
             "kan_type": request.get("kan_type"),
             "tiles": [request.get("tile_type")]*4,
             "player_index": player_index,
             "target_player_index": request.get("target_player_index")
         })
-        logger.debug(f"牌桌【{self.table_code}】中玩家序号【{player_index}】的【杠】操作完成，进行后续操作。")
+        self.log.debug("玩家序号【{player_index}】的【杠】操作完成，进行后续操作。", player_index=player_index)
 
     async def _win_handler(self, player_index:int):
         request = self.player_request[player_index]
         if not request:
             return
-        self.match.win(player_index, request.get("tile_type"), request.get("target_player_index"))
+        self.match.win(player_index, parse_tile(request.get("tile_type")), request.get("target_player_index"))
         self.player_request[player_index] = {}
-        logger.debug(f"牌桌【{self.table_code}】中玩家序号【{player_index}】的【和牌】操作完成，进行后续操作。")
+        self.log.debug("玩家序号【{player_index}】的【和牌】操作完成，进行后续操作。", player_index=player_index)
+
+    def snapshot(self, player_index:int, msg_type:str="update_info") -> dict:
+        '''牌局完整快照，seq为该玩家事件流的当前序号，客户端从此序号之后继续应用事件'''
+        return {
+            "type": msg_type,
+            "seq": self.streams[player_index].seq,
+            "data": {
+                "self":self.player_in_match[player_index].to_dict(),
+                "table":[player.to_public_dict() for player in self.player_in_match]},
+                "rest_tile":len(self.match.deck)
+        }
+
+    async def resync(self, player_index:int, last_seq:int):
+        '''重放玩家last_seq之后的事件，缺失事件已不在缓冲中时改发快照'''
+        events = self.streams[player_index].since(last_seq) if self.streams else None
+        if events is None:
+            if self.match and self.streams:
+                await self.send_private_message(self.snapshot(player_index), player_index)
+            return
+        self.log.debug("向玩家序号【{player_index}】重放{count}条事件。", player_index=player_index, count=len(events))
+        for event in events:
+            await self.send_private_message(event, player_index)
+
+    async def send_event(self, msg:dict, player_index:int) -> Optional[int]:
+        '''发送牌局事件，事件记入该玩家的事件流并带上序号，返回该序号，没有事件流时返回None'''
+        if not self.streams:
+            await self.send_private_message(msg, player_index)
+            return None
+        event = self.streams[player_index].append(msg)
+        await self.send_private_message(event, player_index)
+        return event["seq"]
+
+    async def send_public_event(self, msg:dict, ignore_player_index:int=None):
+        '''广播牌局事件，消息对每种编码只编码一次，各玩家的seq拼接到编码结果上'''
+        if not self.streams:
+            await self.send_public_message(msg, ignore_player_index)
+            return
+        bodies = {}
+        tasks = []
+        for i, player in enumerate(self.player):
+            if i==ignore_player_index:
+                continue
+            seq = self.streams[i].append(msg)["seq"]
+            codec = player.codec
+            if codec.name not in bodies:
+                bodies[codec.name] = codec.encode(msg)
+            tasks.append(asyncio.create_task(self.send_encoded(codec.with_seq(bodies[codec.name], seq), i)))
+        await asyncio.gather(*tasks)
 
     async def send_public_message(self, msg:dict, ignore_player_index:int=None):
-        logger.debug(f"牌桌【{self.table_code}】广播信息中{'，忽略玩家序号【'+str(ignore_player_index)+'】' if ignore_player_index!=None else ''}。")
+        self.log.debug("广播【{msg_type}】信息中，忽略玩家序号【{ignore_player_index}】。", msg_type=msg.get("type"), ignore_player_index=ignore_player_index)
+        bodies = {}
         tasks = []
         for i, player in enumerate(self.player):
             if ignore_player_index!=None and ignore_player_index==i:
                 continue
-            tasks.append(asyncio.create_task(self.send_private_message(msg, i)))
+            codec = player.codec
+            if codec.name not in bodies:
+                bodies[codec.name] = codec.encode(msg)
+            tasks.append(asyncio.create_task(self.send_encoded(bodies[codec.name], i)))
         await asyncio.gather(*tasks)
 
     async def send_private_message(self, msg:dict, player_index:int):
         try:
-            ws = self.player[player_index].ws
+            codec = self.player[player_index].codec
         except Exception as e:
-            logger.error(f"牌桌【{self.table_code}】获取玩家序号【{player_index}】的WebSocket连接时失败。错误类型为{e}。")
+            self.log.error("获取玩家序号【{player_index}】时失败。错误类型为{error!r}。", player_index=player_index, error=e)
             return
+        await self.send_encoded(codec.encode(msg), player_index)
+
+    async def send_encoded(self, data, player_index:int):
+        '''向玩家发送已按其连接编码的消息'''
         try:
-            await ws.send_json(msg)
-            logger.debug(f"牌桌【{self.table_code}】向玩家序号【{player_index}】发送消息：{msg}")
+            player = self.player[player_index]
         except Exception as e:
-            logger.error(f"牌桌【{self.table_code}】向玩家序号【{player_index}】发送消息时出错，已忽略。错误类型为{e}。")
-
+            self.log.error("获取玩家序号【{player_index}】的WebSocket连接时失败。错误类型为{error!r}。", player_index=player_index, error=e)
+            return
+        if player.ws is None:
+            return
+        try:
+            await player.send_encoded(data)
+            self.log.debug("向玩家序号【{player_index}】发送消息：{data}", player_index=player_index, data=data)
+        except Exception as e:
+            SEND_FAILURES.inc()
+            self.log.error("向玩家序号【{player_index}】发送消息时出错，已忽略。错误类型为{error!r}。", player_index=player_index, error=e)
 
 
 @dataclass
 class TableManager:
-    tables:list[Table] = field(default_factory=list)
+    tables:dict[str, Table] = field(default_factory=dict)
+    '''牌桌号到牌桌的索引，按创建顺序排列'''
+    _free_codes:list[int] = field(default_factory=list)
+    '''已回收的牌桌号，最小堆，优先复用较小的号码'''
+    _next_code:int = 1
+    '''从未使用过的最小牌桌号'''
+    hall_version:int = 0
+    '''大厅列表版本号，任一牌桌变化时递增'''
+    _hall_cache:LRUCache = field(default_factory=lambda:LRUCache(HALL_CACHE_SIZE), repr=False)
+    '''大厅列表分页缓存，键含版本号，旧版本条目自然淘汰'''
 
     def list_all_table(self) -> list[dict]:
         '''获取所以牌桌信息'''
-        return [table.to_dict() for table in self.tables]
-    
+        return [table.hall_dict() for table in self.tables.values()]
+
+    def list_tables(self, status:Optional[str]=None, page:int=1, page_size:int=20) -> dict:
+        '''
+        获取分页的牌桌信息
+        :param status: waiting为未开局，playing为对局中，open为未开局且有空位，None不筛选
+        :rtype: 包含total、page、page_size与当前页tables的字典
+        '''
+        return self._hall_cache.get_or_compute(
+            (self.hall_version, status, page, page_size),
+            lambda:self._list_tables(status, page, page_size))
+
+    def _list_tables(self, status:Optional[str], page:int, page_size:int) -> dict:
+        tables = self.tables.values()
+        if status == "open":
+            tables = [table for table in tables if not table.match and len(table.player) < MATCH_PLAYER_COUNT]
+        elif status:
+            tables = [table for table in tables if table.status() == status]
+        else:
+            tables = list(tables)
+        start = (page-1)*page_size
+        return {
+            "total": len(tables),
+            "page": page,
+            "page_size": page_size,
+            "tables": [table.hall_dict() for table in tables[start:start+page_size]]
+        }
+
+    def invalidate_hall(self):
+        '''使大厅列表缓存失效'''
+        self.hall_version += 1
+
     def create_new_table(self) -> Table:
         '''创建新牌桌'''
-        new_table = Table()
-        self.tables.append(new_table)
+        new_table = Table(table_code=self._allocate_code())
+        self.tables[new_table.table_code] = new_table
+        self.invalidate_hall()
         return new_table
 
     def get_table(self, table_code:str) -> Table:
         '''用牌桌code获取牌桌'''
-        for table in self.tables:
-            if table.table_code == table_code:
-                return table
-        raise HTTPException(401, "指定牌桌不存在")
+        table = self.tables.get(table_code)
+        if table is None:
+            raise HTTPException(401, "指定牌桌不存在")
+        return table
 
     async def join_table(self, table_code:str, user_id:str) -> dict:
         '''用户加入牌桌'''
@@ -993,23 +1171,61 @@ class TableManager:
         await table.exit(user_id)
         if not from_dismiss and len(table.player) <= 0:
             await table.dismiss("房间内已无玩家。")
-    
+
+    def _allocate_code(self) -> str:
+        if self._free_codes:
+            return f"{heapq.heappop(self._free_codes):04}"
+        if self._next_code > TABLE_CODE_MAX:
+            raise HTTPException(503, "牌桌数量已达上限")
+        code = self._next_code
+        self._next_code += 1
+        return f"{code:04}"
+
     def _remove_table(self, table:Table):
         try:
-            if table in self.tables:
-                self.tables.remove(table)
-                logger.info(f"牌桌管理器已删除牌桌【{table.table_code}】。")
+            if self.tables.get(table.table_code) is table:
+                self.tables.pop(table.table_code)
+                heapq.heappush(self._free_codes, int(table.table_code))
+                self.invalidate_hall()
+                table.log.info("牌桌管理器已删除牌桌。")
             else:
-                logger.debug(f"牌桌管理器删除牌桌时发现牌桌【{table.table_code}】不存在，已忽略删除操作。")
+                table.log.debug("牌桌管理器删除牌桌时发现牌桌不存在，已忽略删除操作。")
         except Exception as e:
-            logger.info(f"牌桌管理器删除牌桌【{table.table_code}】时出错，错误原因是{e}。")
+            table.log.info("牌桌管理器删除牌桌时出错，错误原因是{error!r}。", error=e)
         
 
 
+def init_hand_evaluator(cache_size:int=HAND_CACHE_SIZE, prewarm:int=HAND_CACHE_PREWARM):
+    '''初始化手牌判定器，所有牌桌共用一份缓存'''
+    global hand_evaluator
+    hand_evaluator = HandEvaluator(cache_size)
+    if prewarm:
+        hand_evaluator.prewarm(prewarm)
+        logger.info(f"手牌判定缓存预热完成，当前缓存条目数为{len(hand_evaluator.evaluate_cache)}。")
+    logger.info("手牌判定器初始化完成")
+
+async def _resync_handler(player:Player, msg:dict):
+    '''客户端发现序号缺口时请求重新同步，在读取循环中直接处理，不打断牌桌等待'''
+    table = table_manager.tables.get(player.in_table)
+    if table is None or player not in table.player:
+        return
+    await table.resync(table.player.index(player), msg.get("last_seq", 0))
+
+async def _connect_handler(player:Player):
+    '''玩家WebSocket连接建立时，若其牌桌的牌局正在进行，发送完整快照'''
+    table = table_manager.tables.get(player.in_table)
+    if table is None or player not in table.player or not (table.match and table.streams):
+        return
+    player_index = table.player.index(player)
+    await table.send_private_message(table.snapshot(player_index), player_index)
+
 def init_table_manager():
     '''初始化牌桌管理器'''
     global table_manager
     table_manager = TableManager()
     logger.info("牌桌管理器初始化初始化完成")
 
-init_table_manager()
\ No newline at end of file
+init_hand_evaluator()
+init_table_manager()
+connection_manager.on("resync", _resync_handler)
+connection_manager.on_connect(_connect_handler)
\ No newline at end of file
@@ -0,0 +1,299 @@
+'''牌局记录
+
+每局牌在进行中把事件追加到内存中的紧凑二进制记录，每个事件只是几个字节的追加，不做序列化：
+    事件类型(1字节) + 玩家序号(1字节) + 负载长度(1字节) + 负载(每项1字节)
+牌为整数牌编码，没有对象玩家时记为 NO_PLAYER。记录开头为：
+    版本号(1字节) + 牌堆哈希(16字节) + 开始时间(8字节double) + 玩家数(1字节) + 随机种子(2字节长度前缀，有符号大端整数)
+    + 各玩家user_id(长度前缀UTF-8)
+随机种子可以是任意整数，因此不以定长字段记录。版本1的记录仍可解码。
+
+牌局结束后记录交给 MatchLogWriter，由共享定时器定期成批处理：先追加到本地暂存文件并fsync，再在一个事务中写入
+数据库 TABLE_TABLES_NAME 表，写入成功后暂存文件只保留尚未写入的记录。文件与数据库操作都在线程池中执行，不阻塞事件循环；
+服务崩溃后启动时重放暂存文件。
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional, TYPE_CHECKING
+from loguru import logger
+from time import time
+import asyncio
+import os
+import struct
+
+import db
+from scheduler import scheduler, TimerHandle
+from tile import tile_to_str
+from utils import TABLE_TABLES_NAME, MATCH_LOG_PATH, MATCH_LOG_FLUSH_INTERVAL
+
+if TYPE_CHECKING:
+    from match import Match
+
+
+MATCH_LOG_VERSION = 2
+'''记录格式版本号'''
+
+EVENT_DEAL, EVENT_DRAW, EVENT_DISCARD, EVENT_CHI, EVENT_PON, EVENT_KAN, EVENT_RESULT = range(7)
+
+EVENT_NAMES = ("deal", "draw", "discard", "chi", "pon", "kan", "result")
+'''事件类型名，下标为事件类型编码'''
+
+KAN_TYPES = ("concealed", "exposed", "extended")
+'''杠的种类，下标为负载中的编码'''
+
+END_TYPES = ("draw_end", "zimo", "ron")
+'''牌局结束方式，下标为负载中的编码'''
+
+NO_PLAYER = 0xff
+'''没有对象玩家时的玩家序号'''
+
+_HEADER = struct.Struct(">B16sdBH")
+_HEADER_V1 = struct.Struct(">B16sQdB")
+_FRAME = struct.Struct(">I")
+
+
+def _player(player_index:Optional[int]) -> int:
+    return NO_PLAYER if player_index is None else player_index
+
+def _seed_bytes(rand_seed:int) -> bytes:
+    '''以最短的有符号大端字节表示随机种子'''
+    return rand_seed.to_bytes(rand_seed.bit_length()//8+1, "big", signed=True)
+
+
+class MatchLog:
+    '''单局牌的事件记录'''
+
+    __slots__ = ("hash", "data")
+
+    def __init__(self, match_hash:str, rand_seed:int, user_ids:Iterable[str], started:Optional[float]=None):
+        self.hash = match_hash
+        '''牌堆哈希，作为记录的键'''
+        seed = _seed_bytes(rand_seed)
+        self.data = bytearray(_HEADER.pack(MATCH_LOG_VERSION, bytes.fromhex(match_hash), time() if started is None else started, 0, len(seed)))
+        '''编码后的记录'''
+        self.data += seed
+        count = 0
+        for user_id in user_ids:
+            raw = user_id.encode()
+            self.data.append(len(raw))
+            self.data += raw
+            count += 1
+        self.data[_HEADER.size-3] = count
+
+    @classmethod
+    def construct(cls, match:"Match") -> "MatchLog":
+        '''以配牌完成的牌局构造记录，并记入各玩家的配牌'''
+        log = cls(match.hash, match.rand_seed, [player.user_id for player in match.player])
+        for player in match.player:
+            log.append(EVENT_DEAL, player.player_index, *player.close)
+        return log
+
+    def append(self, event:int, player_index:int, *payload:int):
+        '''追加一个事件，负载各项须在0~255之间'''
+        self.data += bytes((event, player_index, len(payload), *payload))
+
+    # 摸牌与切牌每巡都会发生，直接写入字节，不经过append
+    def draw(self, player_index:int, tile:int, wall_end:bool=False):
+        self.data += bytes((EVENT_DRAW, player_index, 2, tile, wall_end))
+
+    def discard(self, player_index:int, tile:int, hand_cut:bool):
+        self.data += bytes((EVENT_DISCARD, player_index, 2, tile, hand_cut))
+
+    def chi(self, player_index:int, target_player_index:int, tiles:Iterable[int]):
+        self.append(EVENT_CHI, player_index, target_player_index, *tiles)
+
+    def pon(self, player_index:int, target_player_index:int, tile:int):
+        self.append(EVENT_PON, player_index, target_player_index, tile)
+
+    def kan(self, player_index:int, tile:int, kan_type:str, target_player_index:Optional[int]=None):
+        self.append(EVENT_KAN, player_index, _player(target_player_index), tile, KAN_TYPES.index(kan_type))
+
+    def result(self, result:dict):
+        '''记录牌局结果，分数以2字节记录'''
+        score = min(max(result.get("score", 0), 0), 0xffff)
+        self.append(EVENT_RESULT, _player(result.get("winner_index")), END_TYPES.index(result.get("end_type")),
+                    _player(result.get("loser_index")), score >> 8, score & 0xff)
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.data)
+
+
+def decode_match_log(data:bytes) -> dict:
+    '''将记录解码为便于阅读的字典，牌还原为字符串'''
+    version = data[0]
+    if version == MATCH_LOG_VERSION:
+        _, hash_bytes, started, count, seed_length = _HEADER.unpack_from(data)
+        pos = _HEADER.size+seed_length
+        rand_seed = int.from_bytes(data[_HEADER.size:pos], "big", signed=True)
+    elif version == 1:
+        _, hash_bytes, rand_seed, started, count = _HEADER_V1.unpack_from(data)
+        pos = _HEADER_V1.size
+    else:
+        raise ValueError(f"不支持的牌局记录版本：{version}")
+    players = []
+    for _ in range(count):
+        length = data[pos]
+        players.append(data[pos+1:pos+1+length].decode())
+        pos += 1+length
+    events = []
+    while pos < len(data):
+        event, player_index, length = data[pos], data[pos+1], data[pos+2]
+        payload = list(data[pos+3:pos+3+length])
+        pos += 3+length
+        name = EVENT_NAMES[event]
+        player_index = None if player_index == NO_PLAYER else player_index
+        if event == EVENT_DEAL:
+            item = {"tiles": [tile_to_str(tile) for tile in payload]}
+        elif event == EVENT_DRAW:
+            item = {"tile": tile_to_str(payload[0]), "wall_end": bool(payload[1])}
+        elif event == EVENT_DISCARD:
+            item = {"tile": tile_to_str(payload[0]), "hand_cut": bool(payload[1])}
+        elif event == EVENT_CHI:
+            item = {"target_player_index": payload[0], "tiles": [tile_to_str(tile) for tile in payload[1:]]}
+        elif event == EVENT_PON:
+            item = {"target_player_index": payload[0], "tile": tile_to_str(payload[1])}
+        elif event == EVENT_KAN:
+            item = {"target_player_index": None if payload[0] == NO_PLAYER else payload[0],
+                    "tile": tile_to_str(payload[1]), "kan_type": KAN_TYPES[payload[2]]}
+        else:
+            item = {"end_type": END_TYPES[payload[0]], "loser_index": None if payload[1] == NO_PLAYER else payload[1],
+                    "score": payload[2] << 8 | payload[3]}
+        events.append({"type": name, "player_index": player_index, **item})
+    return {
+        "hash": hash_bytes.hex(),
+        "rand_seed": rand_seed,
+        "started": started,
+        "players": players,
+        "events": events
+    }
+
+
+class MatchLogWriter:
+    '''牌局记录的批量写入，先写本地暂存文件，再写入数据库'''
+
+    def __init__(self, path:str=MATCH_LOG_PATH, flush_interval:float=MATCH_LOG_FLUSH_INTERVAL):
+        self.path = path
+        '''本地暂存文件路径，每条记录为 4字节长度 + 记录'''
+        self.flush_interval = flush_interval
+        '''最长写入间隔（秒）'''
+        self.queued:list[tuple[str, bytes]] = []
+        '''尚未写入本地文件的记录'''
+        self.pending:dict[str, bytes] = {}
+        '''已写入本地文件、尚未写入数据库的记录'''
+        self._file = None
+        self._timer:Optional[TimerHandle] = None
+        self._lock = asyncio.Lock()
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="matchlog")
+        '''单线程执行文件操作，保证追加顺序'''
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def submit(self, log:Optional[MatchLog]):
+        '''提交结束的牌局记录，只入队，不做I/O；log为None（本局未记录）时忽略'''
+        if log is None:
+            return
+        try:
+            self.queued.append((log.hash, log.to_bytes()))
+        except Exception as e:
+            logger.error(f"牌局记录提交失败，已忽略。错误类型为{e!r}。")
+            return
+        if self._timer is None:
+            self._timer = scheduler.call_later(self.flush_interval, self.flush)
+
+    async def flush(self):
+        '''将入队的记录追加到本地文件，再将所有未写入的记录写入数据库'''
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        async with self._lock:
+            if self.queued:
+                batch, self.queued = self.queued, []
+                await self._run(self._append, batch)
+                self.pending.update(batch)
+            if not self.pending or db.database is None:
+                return
+            batch = list(self.pending.items())
+            try:
+                await db.database.transaction(lambda cursor:self._insert(cursor, batch))
+            except Exception as e:
+                logger.error(f"牌局记录写入数据库失败，{len(self.pending)}条记录将在下次写入时重试。错误类型为{e}。")
+                self._timer = scheduler.call_later(self.flush_interval, self.flush)
+                return
+            for match_hash, _ in batch:
+                self.pending.pop(match_hash, None)
+            await self._run(self._compact, list(self.pending.values()))
+            logger.debug(f"已将{len(batch)}条牌局记录写入数据库。")
+            if (self.queued or self.pending) and self._timer is None:
+                self._timer = scheduler.call_later(self.flush_interval, self.flush)
+
+    def _append(self, batch:list[tuple[str, bytes]]):
+        if self._file is None:
+            self._file = open(self.path, "ab")
+        self._file.write(b"".join(_FRAME.pack(len(data))+data for _, data in batch))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _insert(self, cursor, batch:list[tuple[str, bytes]]):
+        ignore = "INSERT IGNORE" if db.database.backend == "mysql" else "INSERT OR IGNORE"
+        created = int(time())
+        cursor.executemany(db.database.sql(f"{ignore} INTO {TABLE_TABLES_NAME} (hash, log, created) VALUES (%s, %s, %s);"),
+                           [(match_hash, data, created) for match_hash, data in batch])
+
+    def _compact(self, logs:list[bytes]):
+        '''以尚未写入数据库的记录重写本地文件'''
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(b"".join(_FRAME.pack(len(data))+data for data in logs))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def _load(self) -> dict[str, bytes]:
+        logs = {}
+        if not os.path.exists(self.path):
+            return logs
+        with open(self.path, "rb") as f:
+            raw = f.read()
+        pos = 0
+        # 崩溃时可能留下不完整的末条记录，不予采信
+        while pos+_FRAME.size <= len(raw):
+            (length,) = _FRAME.unpack_from(raw, pos)
+            data = raw[pos+_FRAME.size:pos+_FRAME.size+length]
+            if len(data) < length:
+                break
+            logs[data[1:17].hex()] = data
+            pos += _FRAME.size+length
+        return logs
+
+    async def replay(self):
+        '''启动时将暂存文件中尚未写入的记录写入数据库'''
+        logs = await self._run(self._load)
+        if not logs:
+            return
+        logger.info(f"检测到{len(logs)}条未写入数据库的牌局记录，开始重放。")
+        for match_hash, data in logs.items():
+            self.pending.setdefault(match_hash, data)
+        await self.flush()
+
+    async def close(self):
+        '''写入所有记录并关闭暂存文件'''
+        await self.flush()
+        if self.pending:
+            logger.warning(f"关闭时仍有{len(self.pending)}条牌局记录未写入数据库，已保留在【{self.path}】中。")
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._file is not None:
+            await self._run(self._file.close)
+            self._file = None
+
+
+def init_match_log_writer():
+    '''初始化牌局记录写入'''
+    global match_log_writer
+    match_log_writer = MatchLogWriter()
+
+init_match_log_writer()
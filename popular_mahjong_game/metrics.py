@@ -0,0 +1,217 @@
+'''进程内监控指标
+
+指标在事件循环线程内记录，不加锁；直方图记录时只做一次二分查找和两次加法，累计值在导出时才计算。
+/metrics 路由以Prometheus文本格式导出全部指标：
+    curl http://127.0.0.1:8000/metrics
+带标签的指标通过 labels 取得子指标，子指标在首次使用时创建，之后可缓存复用：
+    HTTP_LATENCY.labels("/login").observe(0.012)
+'''
+
+from abc import ABC, abstractmethod
+from typing import Callable, Iterator, Optional
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter
+
+from utils import METRICS_LATENCY_BUCKETS
+
+
+def _escape(value:str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names:tuple[str, ...], values:tuple[str, ...], extra:str="") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{"+",".join(pairs)+"}" if pairs else ""
+
+def _format_value(value:float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric(ABC):
+    '''指标基类，设置了labelnames的指标本身不记录数值，只作为子指标的容器'''
+
+    type:str = "untyped"
+    '''导出时的指标类型'''
+
+    def __init__(self, name:str, documentation:str, labelnames:tuple[str, ...]=()):
+        self.name = name
+        '''指标名'''
+        self.documentation = documentation
+        '''指标说明'''
+        self.labelnames = tuple(labelnames)
+        '''标签名'''
+        self._children:dict[tuple[str, ...], Metric] = {}
+
+    def labels(self, *values:str) -> "Metric":
+        '''取得对应标签取值的子指标'''
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"指标【{self.name}】需要{len(self.labelnames)}个标签值")
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self) -> "Metric":
+        return type(self)(self.name, self.documentation)
+
+    @abstractmethod
+    def _samples(self, labels:str) -> Iterator[str]:
+        '''导出数值行，labels为已格式化的标签'''
+
+    def expose(self) -> Iterator[str]:
+        '''导出该指标的文本行'''
+        yield f"# HELP {self.name} {_escape(self.documentation)}"
+        yield f"# TYPE {self.name} {self.type}"
+        if self.labelnames:
+            for values, child in self._children.items():
+                yield from child._samples(_format_labels(self.labelnames, values))
+        else:
+            yield from self._samples("")
+
+
+class Counter(Metric):
+    '''只增不减的计数'''
+
+    type = "counter"
+
+    def __init__(self, name:str, documentation:str, labelnames:tuple[str, ...]=()):
+        super().__init__(name, documentation, labelnames)
+        self.value:float = 0
+
+    def inc(self, amount:float=1):
+        self.value += amount
+
+    def _samples(self, labels:str) -> Iterator[str]:
+        yield f"{self.name}_total{labels} {_format_value(self.value)}"
+
+
+class Gauge(Metric):
+    '''可增可减的当前值，设置了取值函数时在导出时读取'''
+
+    type = "gauge"
+
+    def __init__(self, name:str, documentation:str, labelnames:tuple[str, ...]=(), function:Optional[Callable[[], float]]=None):
+        super().__init__(name, documentation, labelnames)
+        self.value:float = 0
+        self.function = function
+        '''导出时调用的取值函数'''
+
+    def inc(self, amount:float=1):
+        self.value += amount
+
+    def dec(self, amount:float=1):
+        self.value -= amount
+
+    def set(self, value:float):
+        self.value = value
+
+    def set_function(self, function:Callable[[], float]):
+        '''改为导出时调用function取值，适用于本身已有计数的对象，如 len(tables)'''
+        self.function = function
+
+    def _samples(self, labels:str) -> Iterator[str]:
+        value = self.function() if self.function is not None else self.value
+        yield f"{self.name}{labels} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    '''分布统计，各桶只记录落入本桶的次数，导出时再累加'''
+
+    type = "histogram"
+
+    def __init__(self, name:str, documentation:str, labelnames:tuple[str, ...]=(), buckets:tuple[float, ...]=METRICS_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        '''各桶上界，不含+Inf'''
+        self.counts = [0]*(len(self.buckets)+1)
+        self.sum:float = 0
+
+    def _new_child(self) -> "Histogram":
+        return Histogram(self.name, self.documentation, buckets=self.buckets)
+
+    def observe(self, value:float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def _samples(self, labels:str) -> Iterator[str]:
+        prefix = labels[1:-1]+"," if labels else ""
+        total = 0
+        for bound, count in zip(self.buckets+(float("inf"),), self.counts):
+            total += count
+            yield f'{self.name}_bucket{{{prefix}le="{_format_value(bound)}"}} {total}'
+        yield f"{self.name}_sum{labels} {_format_value(self.sum)}"
+        yield f"{self.name}_count{labels} {total}"
+
+
+class MetricsRegistry:
+    '''指标注册表，按注册顺序导出'''
+
+    def __init__(self):
+        self.metrics:dict[str, Metric] = {}
+
+    def register(self, metric:Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"指标【{metric.name}】已注册")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name:str, documentation:str, labelnames:tuple[str, ...]=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name:str, documentation:str, labelnames:tuple[str, ...]=(), function:Optional[Callable[[], float]]=None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name:str, documentation:str, labelnames:tuple[str, ...]=(), buckets:tuple[float, ...]=METRICS_LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        '''以Prometheus文本格式导出全部指标'''
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.expose())
+        return "\n".join(lines)+"\n"
+
+
+def timed(histogram:Histogram):
+    '''记录异步函数耗时（秒）的装饰器，保留原函数签名，可用于FastAPI路由'''
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(perf_counter()-start)
+        return wrapper
+    return decorator
+
+
+def init_metrics():
+    '''初始化指标注册表'''
+    global metrics
+    metrics = MetricsRegistry()
+
+init_metrics()
+
+
+HTTP_LATENCY = metrics.histogram("mahjong_http_request_seconds", "HTTP接口处理耗时", ("path",))
+HANDLER_LATENCY = metrics.histogram("mahjong_table_handler_seconds", "牌桌请求处理函数自身耗时，不含等待玩家与嵌套处理", ("handler",))
+WAIT_LATENCY = metrics.histogram("mahjong_player_wait_seconds", "等待玩家响应耗时")
+ACTIVE_TABLES = metrics.gauge("mahjong_active_tables", "当前牌桌数")
+ONLINE_PLAYERS = metrics.gauge("mahjong_online_players", "当前在线玩家数")
+OPEN_WEBSOCKETS = metrics.gauge("mahjong_open_websockets", "当前WebSocket连接数")
+PENDING_WAITS = metrics.gauge("mahjong_pending_waits", "正在等待玩家响应的次数")
+WAIT_TIMEOUTS = metrics.counter("mahjong_wait_timeouts", "等待玩家响应超时次数")
+AUTO_PLAYS = metrics.counter("mahjong_auto_plays", "托管代为操作次数", ("reason",))
+SEND_FAILURES = metrics.counter("mahjong_send_failures", "WebSocket消息发送失败次数")
+LOOP_LAG = metrics.histogram("mahjong_event_loop_lag_seconds", "事件循环心跳回调的延迟")
@@ -0,0 +1,188 @@
+'''事件循环监控
+
+卡顿检测：事件循环每隔 LOOP_LAG_INTERVAL 秒更新一次心跳，后台线程发现心跳超过 LOOP_LAG_THRESHOLD 秒未更新时，
+通过 sys._current_frames() 抓取事件循环线程此刻的调用栈，即正在阻塞事件循环的代码（如同步的数据库调用、耗时的和牌检查）。
+卡顿结束后记录实际卡顿时长，最近的记录保存在 LoopLagMonitor.stalls 中。
+
+采样分析：在后台线程中按固定间隔抓取事件循环线程的调用栈，输出为火焰图工具可直接读取的折叠栈格式：
+    table:0001;handler:_discard_handler;match.py:_discard_handler;engine.py:waits 12
+每行以所属牌桌与处理函数开头，牌桌由调用栈中局部变量self为Table的栈帧确定；事件循环空闲时的样本归入 idle。
+'''
+
+from dataclasses import dataclass
+from typing import Optional
+from collections import Counter, deque
+from loguru import logger
+from time import perf_counter, sleep, time
+import asyncio
+import os
+import sys
+import threading
+
+from metrics import LOOP_LAG
+from utils import LOOP_LAG_INTERVAL, LOOP_LAG_THRESHOLD, LOOP_LAG_HISTORY, PROFILE_INTERVAL, PROFILE_MAX_DURATION
+
+
+IDLE_FUNCTIONS = {"select", "poll", "epoll", "_run_once", "run_forever"}
+'''事件循环等待I/O时栈顶所在的函数，栈顶为这些函数时视为空闲'''
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+def _table_of(frame) -> Optional[str]:
+    '''栈帧局部变量self为牌桌时返回其牌桌号'''
+    if "self" not in frame.f_code.co_varnames[:1]:
+        return None
+    obj = frame.f_locals.get("self")
+    if type(obj).__name__ == "Table":
+        return getattr(obj, "table_code", None) or "-"
+    return None
+
+def fold_stack(frame) -> str:
+    '''将栈帧折叠为一行，从外到内以分号分隔，开头为所属牌桌与处理函数'''
+    frames = []
+    table = handler = None
+    while frame is not None:
+        frames.append(_frame_label(frame))
+        if table is None:
+            table = _table_of(frame)
+            if table is not None:
+                handler = frame.f_code.co_name
+        frame = frame.f_back
+    frames.reverse()
+    if frames and frames[-1].rsplit(":", 1)[-1] in IDLE_FUNCTIONS:
+        return "idle"
+    prefix = [f"table:{table}", f"handler:{handler}"] if table is not None else ["table:-"]
+    return ";".join(prefix+frames)
+
+
+@dataclass
+class LoopStall:
+    '''一次事件循环卡顿'''
+    started:float
+    '''开始卡顿的Unix时间戳'''
+    stack:str
+    '''检测到卡顿时事件循环线程的折叠调用栈'''
+    duration:Optional[float]=None
+    '''实际卡顿时长（秒），卡顿尚未结束时为None'''
+
+    def to_dict(self) -> dict:
+        return {
+            "started": self.started,
+            "duration": self.duration,
+            "stack": self.stack
+        }
+
+
+class LoopLagMonitor:
+    '''事件循环卡顿检测，心跳由事件循环更新，检查在独立线程中进行，因此卡顿期间也能抓取调用栈'''
+
+    def __init__(self, interval:float=LOOP_LAG_INTERVAL, threshold:float=LOOP_LAG_THRESHOLD, history:int=LOOP_LAG_HISTORY):
+        self.interval = interval
+        '''心跳间隔（秒）'''
+        self.threshold = threshold
+        '''心跳超过多久未更新视为卡顿（秒）'''
+        self.stalls:deque[LoopStall] = deque(maxlen=history)
+        '''最近的卡顿记录'''
+        self.loop_thread_id:Optional[int] = None
+        '''事件循环所在线程'''
+        self._beat = 0.0
+        self._current:Optional[LoopStall] = None
+        self._loop:Optional[asyncio.AbstractEventLoop] = None
+        self._handle:Optional[asyncio.TimerHandle] = None
+        self._stop = threading.Event()
+        self._thread:Optional[threading.Thread] = None
+
+    def start(self):
+        '''在事件循环中调用，开始检测'''
+        self._loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self._beat = perf_counter()
+        self._stop.clear()
+        self._handle = self._loop.call_later(self.interval, self._heartbeat, self._loop.time()+self.interval)
+        self._thread = threading.Thread(target=self._watch, name="loop-lag-monitor", daemon=True)
+        self._thread.start()
+        logger.info(f"事件循环卡顿检测已启动，阈值为{self.threshold}秒。")
+
+    def stop(self):
+        self._stop.set()
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _heartbeat(self, expected:float):
+        lag = self._loop.time()-expected
+        self._beat = perf_counter()
+        LOOP_LAG.observe(max(lag, 0))
+        stall = self._current
+        if stall is not None:
+            self._current = None
+            stall.duration = lag
+            logger.warning(f"事件循环卡顿{stall.duration:.3f}秒，卡顿时调用栈为【{stall.stack}】。")
+        self._handle = self._loop.call_later(self.interval, self._heartbeat, self._loop.time()+self.interval)
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            if self._current is not None or perf_counter()-self._beat < self.threshold:
+                continue
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is None:
+                continue
+            stall = LoopStall(time(), fold_stack(frame))
+            del frame
+            self._current = stall
+            self.stalls.append(stall)
+
+
+class SamplingProfiler:
+    '''事件循环线程的采样分析器，同一时间只允许一次分析'''
+
+    def __init__(self, interval:float=PROFILE_INTERVAL, max_duration:float=PROFILE_MAX_DURATION):
+        self.interval = interval
+        '''采样间隔（秒）'''
+        self.max_duration = max_duration
+        '''单次分析的最长时长（秒）'''
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def sample(self, thread_id:int, duration:float) -> Counter:
+        '''在当前线程中阻塞采样duration秒，返回各折叠栈的样本数'''
+        samples = Counter()
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("已有正在进行的采样分析")
+        try:
+            deadline = perf_counter()+min(duration, self.max_duration)
+            while perf_counter() < deadline:
+                frame = sys._current_frames().get(thread_id)
+                if frame is None:
+                    break
+                samples[fold_stack(frame)] += 1
+                del frame
+                sleep(self.interval)
+        finally:
+            self._lock.release()
+        return samples
+
+    async def profile(self, duration:float, thread_id:Optional[int]=None) -> str:
+        '''在后台线程中采样事件循环线程，返回折叠栈文本'''
+        thread_id = threading.get_ident() if thread_id is None else thread_id
+        samples = await asyncio.to_thread(self.sample, thread_id, duration)
+        logger.info(f"采样分析完成，共{sum(samples.values())}个样本。")
+        return "".join(f"{stack} {count}\n" for stack, count in samples.most_common())
+
+
+def init_monitor():
+    '''初始化卡顿检测与采样分析器'''
+    global loop_monitor, profiler
+    loop_monitor = LoopLagMonitor()
+    profiler = SamplingProfiler()
+
+init_monitor()
@@ -1,12 +1,14 @@
 from dataclasses import dataclass, field
 from fastapi import WebSocket, WebSocketDisconnect
 from loguru import logger
-from hashlib import md5
-from time import time
-import asyncio
 
 from exceptions import *
+from wire import Codec, JSON_CODEC
+from connection import connection_manager
+from scheduler import scheduler, TimerHandle
 from utils import *
+from session import session_manager
+from journal import score_journal
 
 
 
@@ -24,6 +26,8 @@ class Player:
     '''玩家桌号'''
     ws:WebSocket=None
     '''玩家WebSocket连接'''
+    codec:Codec=JSON_CODEC
+    '''连接协商的消息编码'''
 
     def to_dict(self):
         return {
@@ -35,14 +39,22 @@ class Player:
         }
     
     @classmethod
-    def get_player(cls, user_id:str):
-        '''从数据库构造玩家信息，不会实时更新'''
-        args = get_player_info(user_id)
+    def from_account(cls, account:tuple):
+        '''由账户数据行构造玩家信息，列顺序为 id, name, user_id, email, password, total_score'''
         return cls(
-            name = args.get("name", "Anonymous"),
-            user_id = args.get("user_id", ""),
-            email = args.get("email", ""),
+            name = account[1],
+            user_id = account[2],
+            email = account[3],
+            total_score = account[5],
         )
+
+    @classmethod
+    async def get_player(cls, user_id:str):
+        '''从账户缓存或数据库构造玩家信息，不会实时更新'''
+        account = await session_manager.get_account(user_id)
+        if account is None:
+            raise UserInvalidException(401, "未找到目标用户")
+        return cls.from_account(account)
     
     def if_in_table(self) -> bool:
         '''玩家是否在桌内'''
@@ -52,10 +64,12 @@ class Player:
         '''玩家加入牌桌'''
         if self.if_in_table() and self.in_table != table_code:
             raise PlayerJoinException(403, "用户已在其他牌局中")
+        player_manager._index_table(self, table_code)
         self.in_table = table_code
     
     async def exit_table(self):
         '''玩家退出当前牌桌'''
+        player_manager._index_table(self, '')
         self.in_table = ''
         if self.ws:
             try:
@@ -64,87 +78,125 @@ class Player:
                 logger.debug(f"玩家【{self.user_id}】后端关闭Websocket连接时出错，错误类型{e}。")
         self.ws = None
     
-    async def connect_websocket(self, ws:WebSocket):
-        self.ws = ws
-        try:
-            while True:
-                await asyncio.sleep(10)
-                await ws.send_json({
-                    "type":"heartbeat"
-                })
-        except:
-            logger.error(f"检测到用户【{self.user_id}】WebSocket连接断开。")
-            self.ws = None
+    async def send(self, msg:dict):
+        '''按连接编码发送消息'''
+        await self.send_encoded(self.codec.encode(msg))
+
+    async def send_encoded(self, data):
+        '''发送已按本连接编码的消息'''
+        if self.codec.binary:
+            await self.ws.send_bytes(data)
+        else:
+            await self.ws.send_text(data)
+
+    async def receive(self) -> dict:
+        '''等待连接管理器转来的下一条消息'''
+        return await connection_manager.receive(self.user_id)
+
+    def clear_inbox(self):
+        '''丢弃尚未读取的消息，用于发出新的操作选择前忽略迟到的回应'''
+        connection_manager.clear(self.user_id)
+
+    async def connect_websocket(self, ws:WebSocket, codec:Codec=JSON_CODEC):
+        '''由连接管理器接管连接，直至连接断开'''
+        await connection_manager.serve(self, ws, codec)
     
     async def update_score(self, new_score:int):
         self.total_score = new_score
         logger.debug(f"玩家【{self.user_id}】分数已更新。")
-        _save_player_data(self)
-        logger.debug(f"玩家【{self.user_id}】分数已保存到数据库。")
+        await _save_player_data(self)
 
 
 @dataclass
 class PlayerManager:
     '''在线玩家管理器'''
-    player_online:list[Player] = field(default_factory=list)
-    '''在线玩家信息，在内存存储更新信息'''
-    player_token:dict[str, str] = field(default_factory=dict)
-    '''在线玩家token哈希表'''
+    player_online:dict[str, Player] = field(default_factory=dict)
+    '''在线玩家信息，键为user_id，在内存存储更新信息'''
+    by_table:dict[str, set[str]] = field(default_factory=dict)
+    '''桌号到桌内在线玩家user_id的索引'''
+    _sweep_timer:Optional[TimerHandle] = field(default=None, repr=False)
+    '''定期清理的定时器，有在线玩家时才登记'''
 
     def get_online_player(self, user_id:str) -> Player:
         '''从在线玩家中检索目标玩家'''
-        for player in self.player_online:
-            if player.user_id == user_id:
-                return player
-        raise UserInvalidException(401, "未找到目标用户")
-
-    def login(self, user_id:str) -> str:
-        new_player = Player.get_player(user_id)
-        token = self.player_token[user_id] = md5((str(new_player.to_dict())+str(time())).encode()).hexdigest()
-        for player in self.player_online:
-            if player.user_id == user_id:
-                self.player_online.remove(player)
-                break
-        self.player_online.append(new_player)
-        self.player_token[user_id] = token
+        player = self.player_online.get(user_id)
+        if player is None:
+            raise UserInvalidException(401, "未找到目标用户")
+        return player
+
+    def get_table_players(self, table_code:str) -> list[Player]:
+        '''获取在指定牌桌内的在线玩家'''
+        return [self.player_online[user_id] for user_id in self.by_table.get(table_code, ()) if user_id in self.player_online]
+
+    async def login(self, account:tuple) -> str:
+        '''以已验证的账户数据行登录，返回新的会话token'''
+        new_player = Player.from_account(account)
+        user_id = new_player.user_id
+        token = await session_manager.create(user_id)
+        old_player = self.player_online.pop(user_id, None)
+        if old_player is not None:
+            self._index_table(old_player, '')
+        self.player_online[user_id] = new_player
+        if self._sweep_timer is None:
+            self._sweep_timer = scheduler.call_later(SESSION_SWEEP_INTERVAL, self.sweep)
         return token
+
+    async def sweep(self):
+        '''清除过期会话，并移出没有有效会话、不在牌桌内且未连接的玩家'''
+        self._sweep_timer = None
+        expired = await session_manager.sweep()
+        idle = [player for user_id, player in self.player_online.items()
+                if user_id not in session_manager.sessions and not player.if_in_table() and player.ws is None]
+        for player in idle:
+            self.player_online.pop(player.user_id)
+            self._index_table(player, '')
+        if expired or idle:
+            logger.info(f"已清除{len(expired)}个过期会话与{len(idle)}名离线玩家。")
+        if self.player_online or session_manager.sessions:
+            self._sweep_timer = scheduler.call_later(SESSION_SWEEP_INTERVAL, self.sweep)
     
     async def logout(self, user_id:str):
-        if user_id in self.player_token:
-            self.player_token.pop(user_id)
+        if await session_manager.revoke(user_id):
             player = self.get_online_player(user_id)
             if player.if_in_table():
                 table_code = player.in_table
                 from match import table_manager
                 await table_manager.exit_table(table_code, user_id)
-                _save_player_data(player)
-                self.player_online.remove(player)
+                await _save_player_data(player)
+                self.player_online.pop(user_id, None)
+                self._index_table(player, '')
                 return True
             return False
 
-    def if_online(self, user_id:str) -> bool:
-        return user_id in self.player_token
-    
-    def if_user_valid(self, user_id:str, token:str) -> bool:
-        return self.player_token.get(user_id, '') == token
-    
-    def save_all_data(self):
-        for player in self.player_online:
-            _save_player_data(player)
+    async def save_scores(self, players:list[Player]):
+        '''记录玩家分数，由分数日志延迟批量写入数据库'''
+        for player in players:
+            session_manager.update_account_score(player.user_id, player.total_score)
+        await score_journal.record_many((player.user_id, player.total_score) for player in players)
+
+    async def save_all_data(self):
+        await self.save_scores(list(self.player_online.values()))
+        await score_journal.flush()
         logger.info("所有玩家数据已保存。")
 
+    def _index_table(self, player:Player, table_code:str):
+        '''玩家所在牌桌变化时更新桌号索引'''
+        if player.in_table:
+            members = self.by_table.get(player.in_table)
+            if members is not None:
+                members.discard(player.user_id)
+                if not members:
+                    self.by_table.pop(player.in_table)
+        if table_code and self.player_online.get(player.user_id) is player:
+            self.by_table.setdefault(table_code, set()).add(player.user_id)
+
 
 
     
-def _save_player_data(player:Player):
-    '''更新Player分数数据'''
-    with connection.cursor() as cursor:
-        cursor.execute(f"""
-        UPDATE {ACCOUNT_TABLES_NAME} 
-        SET total_score = {player.total_score} 
-        WHERE user_id = '{player.user_id}';""")
-        connection.commit()
-    logger.debug(f"玩家 {player.user_id} 分数数据成功保存。")
+async def _save_player_data(player:Player):
+    '''记录Player分数数据，由分数日志延迟批量写入数据库'''
+    await player_manager.save_scores([player])
+    logger.debug(f"玩家 {player.user_id} 分数数据已记录。")
 
 def init_player_manager():
     '''初始化在线用户管理器'''
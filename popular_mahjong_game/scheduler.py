@@ -0,0 +1,113 @@
+'''进程内共享定时器
+
+所有牌桌的等待超时登记在同一个最小堆中，由单个后台任务休眠到最近的截止时间，
+没有到期的定时器时该任务一直挂起，空闲牌桌不产生任何唤醒。
+'''
+
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+from loguru import logger
+import asyncio
+import heapq
+import itertools
+
+
+@dataclass(order=True)
+class TimerHandle:
+    '''定时器句柄'''
+    deadline:float
+    '''到期时间，为事件循环时钟'''
+    seq:int
+    '''登记顺序，截止时间相同时先登记先执行'''
+    callback:Callable[..., Any]=field(compare=False)
+    '''到期回调，可以是普通函数或协程函数'''
+    args:tuple=field(default=(), compare=False)
+    '''回调参数'''
+    cancelled:bool=field(default=False, compare=False)
+    '''是否已取消'''
+    scheduler:Optional["Scheduler"]=field(default=None, compare=False, repr=False)
+    '''登记所在的定时器，到期或取消后置空'''
+
+    def cancel(self):
+        '''取消定时器，已到期的定时器取消无效果'''
+        self.cancelled = True
+        if self.scheduler is not None:
+            self.scheduler._live -= 1
+            self.scheduler = None
+
+
+class Scheduler:
+    '''
+    共享定时器，到期回调在事件循环中依次执行
+    登记为O(log n)；取消只做标记，为O(1)，已取消的定时器在到达堆顶时才被移除
+    '''
+
+    def __init__(self):
+        self._heap:list[TimerHandle] = []
+        self._live = 0
+        '''未到期且未取消的定时器数'''
+        self._counter = itertools.count()
+        self._wakeup:Optional[asyncio.Event] = None
+        self._task:Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        '''未到期且未取消的定时器数，为O(1)'''
+        return self._live
+
+    def time(self) -> float:
+        '''当前事件循环时钟'''
+        return asyncio.get_running_loop().time()
+
+    def call_at(self, deadline:float, callback:Callable[..., Any], *args) -> TimerHandle:
+        '''在事件循环时钟到达deadline时调用callback'''
+        handle = TimerHandle(deadline, next(self._counter), callback, args, scheduler=self)
+        self._live += 1
+        self._ensure_running()
+        heapq.heappush(self._heap, handle)
+        # 新定时器早于当前最近截止时间时唤醒后台任务重新计算休眠时间
+        if self._heap[0] is handle:
+            self._wakeup.set()
+        return handle
+
+    def call_later(self, delay:float, callback:Callable[..., Any], *args) -> TimerHandle:
+        '''在delay秒后调用callback'''
+        return self.call_at(self.time()+delay, callback, *args)
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            # 清除堆顶已取消的定时器
+            while self._heap and self._heap[0].cancelled:
+                heapq.heappop(self._heap)
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            delay = self._heap[0].deadline - self.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            handle = heapq.heappop(self._heap)
+            handle.scheduler = None
+            self._live -= 1
+            try:
+                res = handle.callback(*handle.args)
+                if asyncio.iscoroutine(res):
+                    asyncio.create_task(res)
+            except Exception as e:
+                logger.error(f"定时器回调【{getattr(handle.callback, '__qualname__', handle.callback)}】执行出错，错误类型为{e}。")
+
+
+def init_scheduler():
+    '''初始化共享定时器'''
+    global scheduler
+    scheduler = Scheduler()
+
+init_scheduler()
@@ -0,0 +1,182 @@
+'''登录会话与账户缓存
+
+token由 secrets.token_urlsafe 生成并带有过期时间，验证在内存中以 hmac.compare_digest 定长比较完成。
+账户数据行缓存在带过期时间的LRU缓存中，登录只需一次数据库查询，缓存命中时不访问数据库。
+
+配置 SESSION_STORE_PATH 后会话同时写入本地sqlite文件，多个工作进程可验证同一会话：
+内存中没有对应会话、token不一致或距上次核对超过 SESSION_STORE_RECHECK 时从共享文件重新读取。
+'''
+
+from dataclasses import dataclass
+from typing import Optional
+from time import time
+import asyncio
+import hmac
+import secrets
+import sqlite3
+
+import db
+from cache import LRUCache
+from utils import SESSION_TTL, SESSION_TOKEN_BYTES, SESSION_STORE_PATH, SESSION_STORE_RECHECK, ACCOUNT_CACHE_SIZE, ACCOUNT_CACHE_TTL
+
+
+@dataclass
+class Session:
+    '''单个登录会话'''
+    user_id:str
+    '''用户ID'''
+    token:str
+    '''会话token'''
+    expires:float
+    '''过期时间，为Unix时间戳（秒）'''
+    checked:float=0
+    '''上次与共享存储核对的时间'''
+
+    def expired(self, now:Optional[float]=None) -> bool:
+        return (time() if now is None else now) >= self.expires
+
+
+class SessionStore:
+    '''基于本地sqlite文件的共享会话存储，供同一台机器上的多个工作进程使用'''
+
+    def __init__(self, path:str):
+        self.path = path
+        '''sqlite文件路径'''
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sessions(user_id TEXT PRIMARY KEY, token TEXT NOT NULL, expires REAL NOT NULL);")
+        self._lock = asyncio.Lock()
+
+    async def _run(self, sql:str, args:tuple=()) -> Optional[tuple]:
+        async with self._lock:
+            return await asyncio.get_running_loop().run_in_executor(None, lambda:self._conn.execute(sql, args).fetchone())
+
+    async def load(self, user_id:str) -> Optional[Session]:
+        row = await self._run("SELECT user_id, token, expires FROM sessions WHERE user_id = ?;", (user_id,))
+        return Session(*row, checked=time()) if row else None
+
+    async def save(self, session:Session):
+        await self._run("INSERT OR REPLACE INTO sessions (user_id, token, expires) VALUES (?, ?, ?);", (session.user_id, session.token, session.expires))
+
+    async def delete(self, user_id:str):
+        await self._run("DELETE FROM sessions WHERE user_id = ?;", (user_id,))
+
+    async def purge(self, now:float):
+        '''删除所有已过期的会话'''
+        await self._run("DELETE FROM sessions WHERE expires <= ?;", (now,))
+
+    def close(self):
+        self._conn.close()
+
+
+class SessionManager:
+    '''会话管理器，每个用户同时只有一个有效会话，重复登录时旧token失效'''
+
+    def __init__(self, ttl:float=SESSION_TTL, store:Optional[SessionStore]=None):
+        self.ttl = ttl
+        '''会话有效期（秒）'''
+        self.store = store
+        '''共享会话存储，为None时只在本进程内存中保存'''
+        self.sessions:dict[str, Session] = {}
+        '''用户ID到会话的索引'''
+        self.accounts = LRUCache(ACCOUNT_CACHE_SIZE)
+        '''账户数据行缓存，值为(过期时间, 数据行)'''
+
+    async def create(self, user_id:str) -> str:
+        '''为用户创建新会话并返回token'''
+        now = time()
+        session = Session(user_id, secrets.token_urlsafe(SESSION_TOKEN_BYTES), now+self.ttl, now)
+        self.sessions[user_id] = session
+        if self.store:
+            await self.store.save(session)
+        return session.token
+
+    async def get(self, user_id:str) -> Optional[Session]:
+        '''取得用户未过期的会话'''
+        session = self.sessions.get(user_id)
+        now = time()
+        if self.store and (session is None or now-session.checked > SESSION_STORE_RECHECK):
+            session = await self._reload(user_id)
+        if session is None:
+            return None
+        if session.expired(now):
+            await self.revoke(user_id)
+            return None
+        return session
+
+    async def validate(self, user_id:str, token:str) -> tuple[Optional[Session], bool]:
+        '''
+        验证token，比较耗时与token内容无关
+        :rtype: 返回(用户未过期的会话, token是否一致)，用户未登录时会话为None
+        '''
+        start = time()
+        session = await self.get(user_id)
+        if session is None:
+            return None, False
+        if hmac.compare_digest(session.token.encode(), token.encode()):
+            return session, True
+        # token不一致时可能已在其他工作进程重新登录，本次尚未核对过共享存储则重新读取
+        if self.store and session.checked < start:
+            session = await self._reload(user_id)
+            if session is None or session.expired():
+                return None, False
+            return session, hmac.compare_digest(session.token.encode(), token.encode())
+        return session, False
+
+    async def _reload(self, user_id:str) -> Optional[Session]:
+        session = await self.store.load(user_id)
+        if session is None:
+            self.sessions.pop(user_id, None)
+        else:
+            self.sessions[user_id] = session
+        return session
+
+    async def revoke(self, user_id:str) -> bool:
+        '''注销用户会话，返回会话是否存在'''
+        existed = self.sessions.pop(user_id, None) is not None
+        if self.store:
+            await self.store.delete(user_id)
+        return existed
+
+    async def sweep(self) -> list[str]:
+        '''清除内存与共享存储中已过期的会话，返回被清除会话的用户ID'''
+        now = time()
+        expired = [user_id for user_id, session in self.sessions.items() if session.expired(now)]
+        for user_id in expired:
+            self.sessions.pop(user_id)
+        if self.store:
+            await self.store.purge(now)
+        return expired
+
+    async def get_account(self, user_id:str) -> Optional[tuple]:
+        '''
+        获取账户数据行，优先使用缓存
+        :rtype: 列顺序为 id, name, user_id, email, password, total_score，账户不存在时为None
+        '''
+        cached = self.accounts.get(user_id)
+        now = time()
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        row = await db.get_account(user_id)
+        if row is not None:
+            self.accounts.put(user_id, (now+ACCOUNT_CACHE_TTL, row))
+        return row
+
+    def update_account_score(self, user_id:str, total_score:int):
+        '''分数变更时同步更新缓存中的账户数据行'''
+        cached = self.accounts.get(user_id)
+        if cached is not None:
+            expires, row = cached
+            self.accounts.put(user_id, (expires, (*row[:5], total_score)))
+
+    def close(self):
+        if self.store:
+            self.store.close()
+
+
+def init_session_manager(store_path:Optional[str]=SESSION_STORE_PATH):
+    '''初始化会话管理器'''
+    global session_manager
+    session_manager = SessionManager(store=SessionStore(store_path) if store_path else None)
+
+init_session_manager()
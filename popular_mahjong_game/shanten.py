@@ -0,0 +1,252 @@
+'''向听数与牌效率计算模块
+
+向听数为手牌距离听牌还差的有效进张次数，听牌为0，和牌为-1。
+一般形按花色拆为面子、雀头、搭子，单花色的拆解结果以花色键缓存在查找表中，
+同一花色形状只会搜索一次，之后的计算只需查表与合并三种花色的结果。
+七对子与 engine.is_win 的规则一致，四张同种牌计为两对。
+
+以和牌判定与逐张暴力计算交叉检查：python shanten.py -n 20000
+'''
+
+from typing import Optional
+import argparse
+import random
+import sys
+
+from tile import Tile, TILE_KINDS, to_counts
+from engine import suit_key, is_win, waiting_tiles
+
+
+_SUIT_OPTIONS:dict[int, tuple[int,...]] = {}
+'''单花色查找表，值的下标为 面子数*2+雀头数，值为该条件下最多的搭子数，不可达为-1'''
+
+
+def _search_suit(counts:list[int]) -> tuple[int,...]:
+    '''搜索单花色所有的面子、雀头、搭子组合'''
+    best = [-1]*10
+    def dfs(i:int, meld:int, pair:int, taatsu:int):
+        while i < 9 and not counts[i]:
+            i += 1
+        if i == 9:
+            key = meld*2+pair
+            if taatsu > best[key]:
+                best[key] = taatsu
+            return
+        # 刻子
+        if counts[i] >= 3:
+            counts[i] -= 3
+            dfs(i, meld+1, pair, taatsu)
+            counts[i] += 3
+        # 顺子
+        if i <= 6 and counts[i+1] and counts[i+2]:
+            counts[i] -= 1; counts[i+1] -= 1; counts[i+2] -= 1
+            dfs(i, meld+1, pair, taatsu)
+            counts[i] += 1; counts[i+1] += 1; counts[i+2] += 1
+        if counts[i] >= 2:
+            counts[i] -= 2
+            # 雀头
+            if not pair:
+                dfs(i, meld, 1, taatsu)
+            # 对子搭子
+            dfs(i, meld, pair, taatsu+1)
+            counts[i] += 2
+        # 两面、边张搭子
+        if i <= 7 and counts[i+1]:
+            counts[i] -= 1; counts[i+1] -= 1
+            dfs(i, meld, pair, taatsu+1)
+            counts[i] += 1; counts[i+1] += 1
+        # 嵌张搭子
+        if i <= 6 and counts[i+2]:
+            counts[i] -= 1; counts[i+2] -= 1
+            dfs(i, meld, pair, taatsu+1)
+            counts[i] += 1; counts[i+2] += 1
+        # 孤张
+        counts[i] -= 1
+        dfs(i, meld, pair, taatsu)
+        counts[i] += 1
+    dfs(0, 0, 0, 0)
+    return tuple(best)
+
+def _suit_options(counts:list[int], start:int) -> tuple[int,...]:
+    '''查表取得单花色组合，未命中时搜索并写入查找表'''
+    key = suit_key(counts, start)
+    options = _SUIT_OPTIONS.get(key)
+    if options is None:
+        options = _SUIT_OPTIONS[key] = _search_suit(counts[start:start+9])
+    return options
+
+def build_tables(max_tiles:int=14):
+    '''预先生成张数不超过max_tiles的全部单花色查找表，生成全部形状约需数十秒'''
+    counts = [0]*9
+    def fill(i:int, left:int):
+        if i == 9:
+            _suit_options(counts, 0)
+            return
+        for num in range(min(4, left)+1):
+            counts[i] = num
+            fill(i+1, left-num)
+        counts[i] = 0
+    fill(0, max_tiles)
+
+
+def standard_shanten(counts:list[int], open_count:int=0) -> int:
+    '''
+    一般形（4面子1雀头）向听数
+    :param counts: 闭合手牌的27格计数向量
+    :param open_count: 副露数量
+    '''
+    need = 4 - open_count
+    # 合并三种花色，状态为 面子数*2+雀头数 -> 最多搭子数
+    merged = _suit_options(counts, 0)
+    for start in (9, 18):
+        options = _suit_options(counts, start)
+        combined = [-1]*10
+        for a, ta in enumerate(merged):
+            if ta < 0:
+                continue
+            for b, tb in enumerate(options):
+                if tb < 0:
+                    continue
+                meld, pair = (a>>1)+(b>>1), (a&1)+(b&1)
+                if meld > 4 or pair > 1:
+                    continue
+                key = meld*2+pair
+                if ta+tb > combined[key]:
+                    combined[key] = ta+tb
+        merged = combined
+    res = 8
+    for key, taatsu in enumerate(merged):
+        if taatsu < 0:
+            continue
+        meld, pair = key>>1, key&1
+        meld = min(meld, need)
+        taatsu = min(taatsu, need-meld)
+        res = min(res, 2*need - 2*meld - taatsu - pair)
+    return res
+
+def seven_pairs_shanten(counts:list[int]) -> int:
+    '''七对子向听数，与 engine.is_win 一致，四张同种牌计为两对'''
+    pairs = min(7, sum(num//2 for num in counts))
+    return 6 - pairs
+
+def calculate_shanten(counts:list[int], open_count:int=0) -> int:
+    '''
+    计算向听数，取一般形与七对子中较小者
+    :param counts: 闭合手牌的27格计数向量，张数应为3n+1或3n+2
+    :param open_count: 副露数量，有副露时不计七对子
+    '''
+    res = standard_shanten(counts, open_count)
+    if not open_count:
+        res = min(res, seven_pairs_shanten(counts))
+    return res
+
+def ukeire(counts:list[int], open_count:int=0, visible:Optional[list[int]]=None) -> tuple[int, dict[Tile, int]]:
+    '''
+    计算有效进张
+    :param counts: 闭合手牌的27格计数向量，张数应为3n+1
+    :param open_count: 副露数量
+    :param visible: 手牌以外已见牌的27格计数向量，如牌河与副露
+    :rtype: 返回(有效进张总枚数, {牌:剩余枚数})
+    '''
+    current = standard = standard_shanten(counts, open_count)
+    if not open_count:
+        current = min(current, seven_pairs_shanten(counts))
+    # 与手牌同花色且相距两张以上的牌不会减少一般形向听数，只在向听数由一般形决定时跳过
+    prune = standard < seven_pairs_shanten(counts) if not open_count else True
+    counts = counts.copy()
+    tiles = {}
+    for tile in range(TILE_KINDS):
+        rest = 4 - counts[tile] - (visible[tile] if visible else 0)
+        if rest <= 0:
+            continue
+        start = tile - tile%9
+        if prune and not any(counts[max(start, tile-2):min(start+9, tile+3)]):
+            continue
+        counts[tile] += 1
+        if calculate_shanten(counts, open_count) < current:
+            tiles[tile] = rest
+        counts[tile] -= 1
+    return sum(tiles.values()), tiles
+
+def discard_candidates(counts:list[int], open_count:int=0, visible:Optional[list[int]]=None, best_only:bool=False) -> list[tuple[Tile, int, int]]:
+    '''
+    计算各切牌选择的牌效率
+    :param counts: 闭合手牌的27格计数向量，张数应为3n+2
+    :param open_count: 副露数量
+    :param visible: 手牌以外已见牌的27格计数向量
+    :param best_only: 是否只返回切后向听数最小的选择，可省去其余选择的进张计算
+    :rtype: 返回[(切牌, 切后向听数, 切后有效进张枚数)]，按向听数升序、进张数降序排列
+    '''
+    counts = counts.copy()
+    shanten = {}
+    for tile in range(TILE_KINDS):
+        if not counts[tile]:
+            continue
+        counts[tile] -= 1
+        shanten[tile] = calculate_shanten(counts, open_count)
+        counts[tile] += 1
+    best = min(shanten.values(), default=0)
+    res = []
+    for tile, num in shanten.items():
+        if best_only and num > best:
+            continue
+        counts[tile] -= 1
+        total, _ = ukeire(counts, open_count, visible)
+        res.append((tile, num, total))
+        counts[tile] += 1
+    res.sort(key=lambda item:(item[1], -item[2]))
+    return res
+
+
+def _random_counts(rng:random.Random, size:int) -> list[int]:
+    '''从4~9种牌中抽取size张，对子、刻子与四张同种牌较多'''
+    kinds = rng.sample(range(TILE_KINDS), rng.randint(4, 9))
+    deck = [tile for tile in kinds for _ in range(4)]
+    return to_counts(rng.sample(deck, size))
+
+def _brute_ukeire(counts:list[int]) -> int:
+    '''不做剪枝，逐张计算有效进张枚数'''
+    current = calculate_shanten(counts)
+    counts = counts.copy()
+    total = 0
+    for tile in range(TILE_KINDS):
+        if counts[tile] >= 4:
+            continue
+        counts[tile] += 1
+        if calculate_shanten(counts) < current:
+            total += 5 - counts[tile]
+        counts[tile] -= 1
+    return total
+
+def cross_check(count:int, rand_seed:int=0) -> list[str]:
+    '''
+    以 engine 的和牌判定与逐张暴力计算交叉检查，返回不一致的手牌
+    14张手牌向听数为-1当且仅当和牌；13张手牌有听牌时向听数为0，否则不小于0，且有效进张与暴力计算一致
+    '''
+    rng = random.Random(rand_seed)
+    errors = []
+    for i in range(count):
+        counts = _random_counts(rng, 13+i%2)
+        shanten = calculate_shanten(counts)
+        if i%2:
+            ok = (shanten == -1) == is_win(counts)
+        else:
+            ok = shanten == 0 if waiting_tiles(counts) else shanten >= 0
+            total, brute = ukeire(counts)[0], _brute_ukeire(counts)
+            if total != brute:
+                errors.append(f"{counts} 有效进张为{total}，应为{brute}")
+        if not ok:
+            errors.append(f"{counts} 向听数为{shanten}")
+    return errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="以和牌判定交叉检查向听数")
+    parser.add_argument("-n", "--hands", type=int, default=20000, help="检查的手牌数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    args = parser.parse_args()
+    errors = cross_check(args.hands, args.seed)
+    for error in errors[:20]:
+        print(error)
+    print(f"检查{args.hands}副手牌，{len(errors)}副不一致。")
+    sys.exit(1 if errors else 0)
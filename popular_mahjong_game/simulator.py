@@ -0,0 +1,191 @@
+'''无界面批量对局模拟器
+
+不依赖数据库与WebSocket，直接驱动 Match 完成整局对局，用于测量引擎吞吐量。
+
+用法：python simulator.py -n 1000 -j 4
+'''
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import Optional
+from loguru import logger
+import argparse
+import sys
+
+from player import Player
+from match import Match, REQUEST_PRIORITY
+from autoplay import AutoPlayPolicy, DEFAULT_POLICY
+from tile import parse_tile
+from utils import MATCH_PLAYER_COUNT
+from exceptions import MatchEndedException
+
+
+@dataclass
+class SimulationStats:
+    '''模拟统计结果'''
+    matches:int = 0
+    '''完成对局数'''
+    draws:int = 0
+    '''摸牌次数'''
+    action_checks:int = 0
+    '''可选操作检查次数'''
+    action_check_time:float = 0.0
+    '''可选操作检查总耗时（秒）'''
+    win_evaluations:int = 0
+    '''和牌番数计算次数'''
+    win_evaluation_time:float = 0.0
+    '''和牌番数计算总耗时（秒）'''
+    elapsed:float = 0.0
+    '''模拟总耗时（秒），多进程时为墙钟时间'''
+    end_types:dict[str, int] = field(default_factory=dict)
+    '''各结束类型的对局数'''
+
+    def merge(self, other:"SimulationStats"):
+        '''合并另一份统计，耗时取较大者'''
+        self.matches += other.matches
+        self.draws += other.draws
+        self.action_checks += other.action_checks
+        self.action_check_time += other.action_check_time
+        self.win_evaluations += other.win_evaluations
+        self.win_evaluation_time += other.win_evaluation_time
+        self.elapsed = max(self.elapsed, other.elapsed)
+        for end_type, num in other.end_types.items():
+            self.end_types[end_type] = self.end_types.get(end_type, 0) + num
+
+    def report(self) -> dict:
+        '''汇总吞吐量指标'''
+        return {
+            "matches": self.matches,
+            "elapsed_s": round(self.elapsed, 4),
+            "matches_per_s": self.matches/self.elapsed if self.elapsed else 0.0,
+            "draws_per_s": self.draws/self.elapsed if self.elapsed else 0.0,
+            "action_check_us": self.action_check_time/self.action_checks*1e6 if self.action_checks else 0.0,
+            "win_evaluation_us": self.win_evaluation_time/self.win_evaluations*1e6 if self.win_evaluations else 0.0,
+            "end_types": dict(self.end_types)
+        }
+
+
+class MatchSimulator:
+    '''按照 Table 的流程同步驱动 Match，所有玩家均由托管策略操作'''
+
+    def __init__(self, policies:Optional[list[AutoPlayPolicy]]=None):
+        self.policies = policies or [DEFAULT_POLICY]*MATCH_PLAYER_COUNT
+        '''各座位的托管策略'''
+        self.players = [Player(name=f"bot{i}", user_id=f"bot_{i:05}", email="") for i in range(MATCH_PLAYER_COUNT)]
+        '''模拟玩家，不经过数据库'''
+        self.stats = SimulationStats()
+
+    def run(self, seeds:list[int]) -> SimulationStats:
+        '''按给定种子依次模拟对局'''
+        start = perf_counter()
+        for seed in seeds:
+            self.run_match(seed)
+        self.stats.elapsed += perf_counter()-start
+        return self.stats
+
+    def run_match(self, rand_seed:Optional[int]=None) -> dict:
+        '''模拟一整局，返回牌局结果'''
+        match = Match(self.players, rand_seed)
+        while not match.result:
+            try:
+                player_index, tile = match.draw()
+                self.stats.draws += 1
+                self._turn(match, player_index, tile)
+            except MatchEndedException:
+                break
+        self.stats.matches += 1
+        end_type = match.result.get("end_type", "")
+        self.stats.end_types[end_type] = self.stats.end_types.get(end_type, 0) + 1
+        return match.result
+
+    def _check(self, match:Match, player_index:int, **kwargs) -> dict:
+        '''检查可选操作并由策略作出选择，无可选操作时返回空请求'''
+        start = perf_counter()
+        option = match.player[player_index].action_check(**kwargs)
+        self.stats.action_check_time += perf_counter()-start
+        self.stats.action_checks += 1
+        if not option:
+            return {}
+        return self.policies[player_index].choose(match, player_index, option)
+
+    def _win(self, match:Match, player_index:int, request:dict):
+        start = perf_counter()
+        try:
+            match.win(player_index, parse_tile(request.get("tile_type")), request.get("target_player_index"))
+        finally:
+            self.stats.win_evaluation_time += perf_counter()-start
+            self.stats.win_evaluations += 1
+
+    def _turn(self, match:Match, player_index:int, tile:int):
+        '''摸牌玩家的回合，包括其切牌引发的鸣牌'''
+        request = self._check(match, player_index, new=tile, need_discard=True)
+        if request.get("type") == "win":
+            self._win(match, player_index, request)
+        if request.get("type") == "kan":
+            match.kan(player_index, parse_tile(request.get("tile_type")), request.get("kan_type"))
+            return
+        while True:
+            discarded = match.discard(player_index, parse_tile(request.get("tile_type")), request.get("discard_draw", True))
+            requests = [
+                self._check(match, index, new=discarded, target_player_index=player_index) if index != player_index else {}
+                for index in range(MATCH_PLAYER_COUNT)
+            ]
+            claim_index, max_por = None, 0
+            for index, claim in enumerate(requests):
+                if claim and REQUEST_PRIORITY[claim.get("type", "cancel")] > max_por:
+                    claim_index, max_por = index, REQUEST_PRIORITY[claim.get("type", "cancel")]
+            if claim_index is None:
+                return
+            claim = requests[claim_index]
+            if claim["type"] == "win":
+                self._win(match, claim_index, claim)
+            elif claim["type"] == "kan":
+                match.kan(claim_index, discarded, "exposed", player_index)
+                return
+            elif claim["type"] == "pon":
+                match.pon(claim_index, player_index, discarded)
+            elif claim["type"] == "chi":
+                match.chi(claim_index, player_index, discarded, [parse_tile(tile) for tile in claim["tiles"]])
+            else:
+                return
+            # 鸣牌后由鸣牌玩家切牌
+            player_index = claim_index
+            request = self._check(match, player_index, only_discard=True)
+
+
+def _run_chunk(seeds:list[int]) -> SimulationStats:
+    return MatchSimulator().run(seeds)
+
+def simulate(match_count:int, workers:int=1, base_seed:int=0) -> SimulationStats:
+    '''
+    批量模拟对局
+    :param match_count: 对局数量
+    :param workers: 进程数，为1时在当前进程中运行
+    :param base_seed: 起始随机种子，第i局种子为base_seed+i
+    '''
+    seeds = list(range(base_seed, base_seed+match_count))
+    if workers <= 1:
+        return MatchSimulator().run(seeds)
+    stats = SimulationStats()
+    chunks = [seeds[i::workers] for i in range(workers)]
+    start = perf_counter()
+    with ProcessPoolExecutor(workers) as executor:
+        for chunk_stats in executor.map(_run_chunk, chunks):
+            stats.merge(chunk_stats)
+    stats.elapsed = perf_counter()-start
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="无界面批量对局模拟")
+    parser.add_argument("-n", "--matches", type=int, default=1000, help="对局数量")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="进程数")
+    parser.add_argument("--seed", type=int, default=0, help="起始随机种子")
+    parser.add_argument("--log-level", default="WARNING", help="日志等级")
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+    stats = simulate(args.matches, args.workers, args.seed)
+    for key, value in stats.report().items():
+        print(f"{key}: {value}")
@@ -0,0 +1,42 @@
+'''牌局状态增量同步
+
+牌局中发给每位玩家的事件都带有该玩家独立递增的序号seq，客户端按序应用事件即可维护牌局状态。
+只有在开局、重连或客户端发现序号缺口时才发送完整快照，缺口在缓冲范围内时直接重放缺失事件。
+'''
+
+from collections import deque
+from itertools import islice
+from typing import Optional
+
+from utils import SYNC_LOG_SIZE
+
+
+class EventStream:
+    '''单个玩家的有序事件流，保留最近的事件用于重放'''
+
+    def __init__(self, maxlen:int=SYNC_LOG_SIZE):
+        self.seq = 0
+        '''最新事件序号，0表示尚无事件'''
+        self.log:deque[dict] = deque(maxlen=maxlen)
+        '''最近事件缓冲'''
+
+    def append(self, msg:dict) -> dict:
+        '''为消息分配序号并记录，返回带序号的新消息'''
+        self.seq += 1
+        event = dict(msg)
+        event["seq"] = self.seq
+        self.log.append(event)
+        return event
+
+    def since(self, last_seq:int) -> Optional[list[dict]]:
+        '''
+        取得last_seq之后的所有事件
+        :rtype: 缺失事件已不在缓冲中时返回None，此时应改发快照；last_seq<=0时客户端没有任何状态，同样返回None
+        '''
+        if last_seq <= 0:
+            return None
+        if last_seq >= self.seq:
+            return []
+        if not self.log or self.log[0]["seq"] > last_seq+1:
+            return None
+        return list(islice(self.log, last_seq+1-self.log[0]["seq"], None))
@@ -0,0 +1,64 @@
+'''牌面编码模块
+
+局内牌统一用0-26的整数表示，下标为 花色序号*9+(数字-1)，
+"5m"形式的字符串只在与客户端收发信息时使用。
+'''
+
+from typing import Iterable, Optional
+
+
+Tile = int
+'''牌的整数编码，0-8为万，9-17为索，18-26为筒'''
+
+SUIT_TYPES = "msp"
+'''花色顺序'''
+
+TILE_KINDS = 27
+'''牌的种类数'''
+
+TILE_STRS:tuple[str,...] = tuple(f"{num}{color}" for color in SUIT_TYPES for num in range(1,10))
+'''整数编码到字符串的对照表'''
+
+TILE_IDS:dict[str, Tile] = {tile:i for i, tile in enumerate(TILE_STRS)}
+'''字符串到整数编码的对照表'''
+
+
+def tile_from_str(tile:str) -> Tile:
+    '''将"5m"形式的牌转为整数编码，格式错误时抛出KeyError'''
+    return TILE_IDS[tile]
+
+def tile_to_str(tile:Tile) -> str:
+    '''将整数编码转为"5m"形式的牌'''
+    return TILE_STRS[tile]
+
+def parse_tile(tile:Optional[str]) -> Optional[Tile]:
+    '''解析客户端发来的牌，空值或无法识别时返回None，由牌局按未指定或不合法的牌处理'''
+    return TILE_IDS.get(tile) if isinstance(tile, str) else None
+
+def suit_of(tile:Tile) -> int:
+    '''牌的花色序号'''
+    return tile // 9
+
+def number_of(tile:Tile) -> int:
+    '''牌的数字，为1-9'''
+    return tile % 9 + 1
+
+def to_counts(tiles:Iterable[Tile]) -> list[int]:
+    '''将牌列表转为27格计数向量'''
+    counts = [0]*TILE_KINDS
+    for tile in tiles:
+        counts[tile] += 1
+    return counts
+
+def meld_to_str(meld:tuple) -> tuple:
+    '''将(种类,牌,...)形式的副露转为字符串形式'''
+    return (meld[0], *[TILE_STRS[tile] for tile in meld[1:]])
+
+def action_to_str(action:dict) -> dict:
+    '''将可选操作中的牌转为字符串形式，用于发送给客户端'''
+    res = dict(action)
+    if res.get("tile_type") is not None:
+        res["tile_type"] = TILE_STRS[res["tile_type"]]
+    if "tiles" in res:
+        res["tiles"] = [TILE_STRS[tile] for tile in res["tiles"]]
+    return res
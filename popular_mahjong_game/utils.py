@@ -1,8 +1,8 @@
-'''数据库连接等工具模块'''
+'''常量与请求表单等工具模块'''
 
-from pydantic import BaseModel, EmailStr, constr
+from typing import Optional, Literal
+from pydantic import BaseModel, EmailStr, constr, conint
 from loguru import logger
-import pymysql
 
 READY_TIMEOUT = 10
 '''准备限制时间'''
@@ -16,15 +16,132 @@ THINKING_TIME_LIMIT = 60
 TABLE_WAIT_TIME = 600
 '''牌桌未满限制时间'''
 
+COUNTDOWN_RESYNC_INTERVAL = 15
+'''倒计时校准帧发送间隔'''
+
+SYNC_LOG_SIZE = 256
+'''每位玩家保留用于重放的最近事件数'''
+
+HEARTBEAT_INTERVAL = 10
+'''连接空闲多久后发送保活消息'''
+
+PONG_TIMEOUT = 5
+'''对回应过pong的客户端，发送ping后多久未收到任何消息即判定连接失联'''
+
+WS_PING_INTERVAL = 20
+'''WebSocket协议层ping的发送间隔（秒），由服务器与浏览器自动完成，不需要客户端代码回应'''
+
+WS_PING_TIMEOUT = 20
+'''WebSocket协议层ping的回应超时（秒），超时后连接被关闭'''
+
+CONNECTION_INBOX_SIZE = 32
+'''每个连接待牌桌读取的消息上限'''
+
+REQUEST_PRIORITY = {"win":10, "discard":9, "kan":8, "pon":7, "chi":6, "cancel":0}
+'''玩家请求优先级，数值越大越优先'''
+
+METRICS_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+'''耗时直方图各桶上界（秒），等待玩家响应的耗时可达玩家考虑时间，因此上限覆盖到THINKING_TIME_LIMIT'''
+
+LOOP_LAG_INTERVAL = 0.1
+'''事件循环卡顿检测的心跳间隔（秒）'''
+
+LOOP_LAG_THRESHOLD = 0.2
+'''心跳超过多久未更新视为事件循环卡顿（秒）'''
+
+LOOP_LAG_HISTORY = 100
+'''保留的卡顿记录条数'''
+
+PROFILE_INTERVAL = 0.005
+'''采样分析的采样间隔（秒）'''
+
+PROFILE_MAX_DURATION = 60
+'''单次采样分析的最长时长（秒）'''
+
+ADMIN_TOKEN = None
+'''管理接口令牌，通过请求头X-Admin-Token传入，为None时管理接口不可用'''
+
+LOG_LEVEL = "INFO"
+'''日志输出级别'''
+
+LOG_TABLE_SAMPLE_RATE = 1.0
+'''记录DEBUG日志的牌桌比例'''
+
+LOG_PATH = None
+'''日志文件路径，为None时输出到标准错误'''
+
+LOG_SERIALIZE = False
+'''是否以JSON格式输出日志'''
+
 INIT_SCORE = 100
 '''玩家初始分'''
 
+HAND_CACHE_SIZE = 65536
+'''手牌判定缓存容量'''
+
+HAND_CACHE_PREWARM = 0
+'''启动时预热的手牌数量，为0则不预热'''
+
 ACCOUNT_TABLES_NAME = "account"
 '''用户注册数据表单'''
 
 TABLE_TABLES_NAME = "tables"
 '''牌局信息'''
 
+TABLE_CODE_MAX = 9999
+'''最大牌桌号，牌桌号为4位数字，解散后的牌桌号回收复用'''
+
+HALL_PAGE_SIZE = 20
+'''大厅列表默认每页牌桌数'''
+
+HALL_PAGE_SIZE_MAX = 100
+'''大厅列表每页牌桌数上限'''
+
+HALL_CACHE_SIZE = 128
+'''大厅列表分页缓存容量'''
+
+DB_POOL_SIZE = 8
+'''数据库连接池容量'''
+
+DB_PING_INTERVAL = 60
+'''连接空闲超过此秒数后，取出时先做健康检查'''
+
+SCORE_JOURNAL_PATH = "score_journal.log"
+'''分数变更本地日志路径'''
+
+SCORE_FLUSH_INTERVAL = 5
+'''分数变更写入数据库的最长间隔'''
+
+SCORE_FLUSH_BATCH = 500
+'''单条批量更新语句包含的最多玩家数'''
+
+MATCH_LOG_PATH = "match_log.bin"
+'''尚未写入数据库的牌局记录的本地暂存文件'''
+
+MATCH_LOG_FLUSH_INTERVAL = 5
+'''牌局记录批量写入的最长间隔（秒）'''
+
+SESSION_TTL = 86400
+'''登录会话有效期（秒）'''
+
+SESSION_TOKEN_BYTES = 32
+'''会话token的随机字节数'''
+
+SESSION_STORE_PATH = None
+'''多进程共享会话的sqlite文件路径，为None时会话只保存在本进程内存中'''
+
+SESSION_STORE_RECHECK = 5
+'''使用共享会话存储时，内存中的会话超过此秒数后重新核对'''
+
+SESSION_SWEEP_INTERVAL = 600
+'''清理过期会话与离线玩家的间隔（秒）'''
+
+ACCOUNT_CACHE_SIZE = 10000
+'''账户数据行缓存容量'''
+
+ACCOUNT_CACHE_TTL = 300
+'''账户数据行缓存有效期（秒）'''
+
 
 class RegisterForm(BaseModel):
     name: constr(regex=r'^[a-zA-Z\u4e00-\u9fa5]+$', max_length=7)
@@ -44,6 +161,10 @@ class LogoutForm(BaseModel):
 class ListTableForm(BaseModel):
     user_id: constr(regex=r'^[a-zA-Z0-9_]+$', min_length=5, max_length=15)
     token: str
+    page: conint(ge=1) = 1
+    page_size: conint(ge=1, le=HALL_PAGE_SIZE_MAX) = HALL_PAGE_SIZE
+    status: Optional[Literal["waiting", "playing", "open"]] = None
+    '''waiting为未开局，playing为对局中，open为未开局且有空位，不填则不筛选'''
 
 class CreateTableForm(BaseModel):
     user_id: constr(regex=r'^[a-zA-Z0-9_]+$', min_length=5, max_length=15)
@@ -58,65 +179,3 @@ class ExitTableForm(BaseModel):
     table_code: constr(regex=r'^[0-9]{4}$')
     user_id: constr(regex=r'^[a-zA-Z0-9_]+$', min_length=5, max_length=15)
     token: str
-
-
-# 数据库连接管理
-
-def connection_open(host='localhost',
-            user='mahjong',
-            password='MahjongPassword123456',
-            database='mahjong',
-            **kwargs):
-    '''连接到数据库，并将连接暂存到本模块connection变量'''
-    global connection
-    try:
-        connection = pymysql.connect(
-            host=host,
-            user=user,
-            password=password,
-            database=database,
-            **kwargs
-        )
-    except Exception as e:
-        logger.error("数据库连接错误，请检查配置项。")
-        raise e
-    logger.info("数据库连接成功。")
-    __init_check()
-
-def __init_check():
-    '''如果未创建所需表，则创建并初始化所需表'''
-    logger.debug("开始检查是否创建所需表")
-    with connection.cursor() as cursor:
-        cursor.execute(f"SHOW TABLES LIKE '{ACCOUNT_TABLES_NAME}';")
-        res = cursor.fetchone()
-        if res:
-            logger.info(f"检测到登录表 {ACCOUNT_TABLES_NAME} 已存在。")
-        else:
-            logger.info(f"登录表 {ACCOUNT_TABLES_NAME} 不存在，开始创建。")
-            cursor.execute(f"""
-            CREATE TABLE {ACCOUNT_TABLES_NAME}(
-            id INT NOT NULL AUTO_INCREMENT,
-            name VARCHAR(7) NOT NULL,
-            user_id VARCHAR(15) NOT NULL,
-            email VARCHAR(320) NOT NULL,
-            password VARCHAR(32) NOT NULL,
-            total_score INT NOT NULL,
-            PRIMARY KEY (id)
-            );""")
-            connection.commit()
-            logger.info(f"登录表 {ACCOUNT_TABLES_NAME} 创建成功！")
-
-def connection_close():
-    '''关闭数据库连接'''
-    connection.close()
-    logger.info("数据库连接已关闭。")
-
-def get_player_info(user_id:str) -> dict:
-    '''从数据库获取玩家信息'''
-    info_col = ["id", "name", "user_id", "email", "total_score"]
-    with connection.cursor() as cursor:
-        cursor.execute(f"SELECT {','.join(info_col)} FROM {ACCOUNT_TABLES_NAME} WHERE user_id = '{user_id}';")
-        res = cursor.fetchone()
-    return dict(zip(info_col, res))
-
-connection_open()
\ No newline at end of file
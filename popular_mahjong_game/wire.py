@@ -0,0 +1,239 @@
+'''WebSocket消息编码
+
+广播消息只序列化一次，再把同一份编码结果发给所有玩家；每位玩家不同的seq字段直接拼接到编码结果上，无需重新序列化。
+
+连接时以查询参数format选择编码，默认为JSON：
+    /ws/{user_id}/{token}?format=binary
+
+JSON编码在安装orjson时使用orjson，否则使用标准库json。
+
+二进制编码的帧结构为 版本号(1字节) + seq+1(变长整数，0表示无seq) + 消息体，消息体为带类型标签的值：
+    0x00 None    0x01 False    0x02 True
+    0x03 整数    ZigZag变长整数
+    0x04 浮点数  8字节大端double
+    0x05 字符串  变长整数长度 + UTF-8
+    0x06 列表    变长整数长度 + 各元素
+    0x07 字典    变长整数长度 + 交替的键与值
+    0x08 符号    1字节编码，见SYMBOLS，消息类型、字段名、副露种类等常用字符串均编码为符号
+    0x09 牌      1字节整数牌编码，见tile模块
+解码时符号与牌均还原为字符串，因此 decode(encode(msg)) == msg（元组还原为列表）。
+'''
+
+from abc import ABC, abstractmethod
+from typing import Union
+import json
+import struct
+
+from tile import TILE_IDS, TILE_STRS
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(msg:dict) -> str:
+    '''将消息编码为紧凑的JSON文本'''
+    if orjson is not None:
+        return orjson.dumps(msg).decode()
+    return json.dumps(msg, ensure_ascii=False, separators=(",", ":"))
+
+def with_seq(body:str, seq:int) -> str:
+    '''在已编码的JSON对象文本开头插入seq字段'''
+    if body == "{}":
+        return f'{{"seq":{seq}}}'
+    return f'{{"seq":{seq},{body[1:]}'
+
+
+SYMBOLS = (
+    # 消息类型
+    "init_info", "update_info", "draw_self", "draw_other", "action_choose", "countdown",
+    "discard", "chi", "pon", "kan", "win", "cancel", "end", "join", "exit", "dismiss",
+    "can_ready", "ready", "heartbeat", "resync", "table_info", "table_list",
+    # 字段名
+    "type", "data", "seq", "self", "table", "rest_tile", "tile", "tile_type", "tiles",
+    "player_index", "target_player_index", "hand_cut", "discard_draw", "count", "deadline",
+    "name", "user_id", "close", "open", "draw", "score", "action", "last_seq",
+    "kan_type", "con_kan", "exp_kan", "fans", "table_code", "players", "if_start",
+    "ping", "pong", "action_close",
+)
+'''二进制编码的符号表，只能在末尾追加，不能改动已有顺序'''
+
+SYMBOL_CODES = {symbol:code for code, symbol in enumerate(SYMBOLS)}
+
+BINARY_VERSION = 1
+'''二进制编码版本号'''
+
+_NONE, _FALSE, _TRUE, _INT, _FLOAT, _STR, _LIST, _DICT, _SYMBOL, _TILE = range(10)
+_DOUBLE = struct.Struct(">d")
+
+
+def _write_varint(buf:bytearray, value:int):
+    while value > 0x7f:
+        buf.append(value&0x7f | 0x80)
+        value >>= 7
+    buf.append(value)
+
+def _read_varint(data:bytes, pos:int) -> tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte&0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+def _write_value(buf:bytearray, value):
+    if value is None:
+        buf.append(_NONE)
+    elif value is True:
+        buf.append(_TRUE)
+    elif value is False:
+        buf.append(_FALSE)
+    elif isinstance(value, int):
+        buf.append(_INT)
+        _write_varint(buf, value<<1 if value >= 0 else (-value<<1)-1)
+    elif isinstance(value, float):
+        buf.append(_FLOAT)
+        buf += _DOUBLE.pack(value)
+    elif isinstance(value, str):
+        if value in TILE_IDS:
+            buf.append(_TILE)
+            buf.append(TILE_IDS[value])
+        elif value in SYMBOL_CODES:
+            buf.append(_SYMBOL)
+            buf.append(SYMBOL_CODES[value])
+        else:
+            raw = value.encode()
+            buf.append(_STR)
+            _write_varint(buf, len(raw))
+            buf += raw
+    elif isinstance(value, (list, tuple)):
+        buf.append(_LIST)
+        _write_varint(buf, len(value))
+        for item in value:
+            _write_value(buf, item)
+    elif isinstance(value, dict):
+        buf.append(_DICT)
+        _write_varint(buf, len(value))
+        for key, item in value.items():
+            _write_value(buf, key)
+            _write_value(buf, item)
+    else:
+        raise TypeError(f"无法编码的类型：{type(value).__name__}")
+
+def _read_value(data:bytes, pos:int):
+    tag = data[pos]
+    pos += 1
+    if tag == _NONE:
+        return None, pos
+    if tag == _FALSE:
+        return False, pos
+    if tag == _TRUE:
+        return True, pos
+    if tag == _INT:
+        value, pos = _read_varint(data, pos)
+        return (value>>1) ^ -(value&1), pos
+    if tag == _FLOAT:
+        return _DOUBLE.unpack_from(data, pos)[0], pos+8
+    if tag == _STR:
+        length, pos = _read_varint(data, pos)
+        return data[pos:pos+length].decode(), pos+length
+    if tag == _LIST:
+        length, pos = _read_varint(data, pos)
+        res = []
+        for _ in range(length):
+            item, pos = _read_value(data, pos)
+            res.append(item)
+        return res, pos
+    if tag == _DICT:
+        length, pos = _read_varint(data, pos)
+        res = {}
+        for _ in range(length):
+            key, pos = _read_value(data, pos)
+            res[key], pos = _read_value(data, pos)
+        return res, pos
+    if tag == _SYMBOL:
+        return SYMBOLS[data[pos]], pos+1
+    if tag == _TILE:
+        return TILE_STRS[data[pos]], pos+1
+    raise ValueError(f"未知的类型标签：{tag}")
+
+
+class Codec(ABC):
+    '''消息编解码器基类'''
+
+    name:str
+    '''编码名，对应连接参数format'''
+    binary:bool
+    '''编码结果是否为字节串'''
+
+    @abstractmethod
+    def encode(self, msg:dict) -> Union[str, bytes]:
+        ...
+
+    @abstractmethod
+    def with_seq(self, body:Union[str, bytes], seq:int) -> Union[str, bytes]:
+        '''为不含seq的编码结果加上seq'''
+
+    @abstractmethod
+    def decode(self, data:Union[str, bytes]) -> dict:
+        ...
+
+
+class JsonCodec(Codec):
+    '''JSON文本编码'''
+
+    name = "json"
+    binary = False
+
+    def encode(self, msg:dict) -> str:
+        return dumps(msg)
+
+    def with_seq(self, body:str, seq:int) -> str:
+        return with_seq(body, seq)
+
+    def decode(self, data:Union[str, bytes]) -> dict:
+        return json.loads(data)
+
+
+class BinaryCodec(Codec):
+    '''紧凑二进制编码，seq记录在帧头中'''
+
+    name = "binary"
+    binary = True
+
+    def encode(self, msg:dict) -> bytes:
+        buf = bytearray((BINARY_VERSION,))
+        if "seq" in msg:
+            msg = dict(msg)
+            _write_varint(buf, msg.pop("seq")+1)
+        else:
+            buf.append(0)
+        _write_value(buf, msg)
+        return bytes(buf)
+
+    def with_seq(self, body:bytes, seq:int) -> bytes:
+        # 无seq的帧头第二字节固定为0
+        buf = bytearray((BINARY_VERSION,))
+        _write_varint(buf, seq+1)
+        return bytes(buf) + body[2:]
+
+    def decode(self, data:bytes) -> dict:
+        if not data or data[0] != BINARY_VERSION:
+            raise ValueError("不支持的二进制编码版本")
+        seq, pos = _read_varint(data, 1)
+        msg, _ = _read_value(data, pos)
+        if not isinstance(msg, dict):
+            raise ValueError("消息体不是字典")
+        if seq:
+            msg["seq"] = seq-1
+        return msg
+
+
+JSON_CODEC = JsonCodec()
+BINARY_CODEC = BinaryCodec()
+
+CODECS:dict[str, Codec] = {codec.name:codec for codec in (JSON_CODEC, BINARY_CODEC)}
+'''可协商的编码，键为连接参数format的取值'''